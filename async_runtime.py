@@ -0,0 +1,118 @@
+import asyncio
+import concurrent.futures
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger("chat_server")
+
+
+class AsyncRuntime:
+    """
+    One long-lived asyncio event loop per process, running on its own thread.
+
+    Synchronous code (Celery tasks, Socket.IO handlers) submits coroutines with
+    ``run``, which blocks the caller until the result is ready. Because every
+    coroutine runs on the same loop, loop-bound resources created once at
+    import time (the ``AsyncOpenAI`` httpx pool, the async Redis pool,
+    ``asyncio.Semaphore`` limits) stay valid and shared across messages.
+    Coroutines share the loop, so blocking calls inside them must go through
+    ``asyncio.to_thread``.
+
+    Under ``monkey.patch_all()`` the loop thread is a greenlet and asyncio
+    uses gevent's selector, so the loop yields to the hub while idle and
+    callers waiting on a result are parked greenlets. The loop is started
+    lazily and restarted after a fork, so a process never inherits its
+    parent's loop.
+
+    Args:
+        name (str): Name of the loop thread.
+    """
+
+    def __init__(self, name="async-runtime"):
+        self.name = name
+        self._loop = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._submitted = 0
+        self._timeouts = 0
+        self._inflight = 0
+        self._runs = 0
+        self._run_total = 0.0
+
+    def _ensure_started(self):
+        if self._loop is not None and self._pid == os.getpid():
+            return self._loop
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                started = threading.Event()
+
+                def run_forever():
+                    asyncio.set_event_loop(loop)
+                    loop.call_soon(started.set)
+                    loop.run_forever()
+
+                self._thread = threading.Thread(target=run_forever, name=self.name, daemon=True)
+                self._thread.start()
+                started.wait()
+                self._loop = loop
+                self._pid = os.getpid()
+                logger.info(f"✅ Started async runtime loop in process {self._pid}")
+        return self._loop
+
+    @property
+    def loop(self):
+        return self._ensure_started()
+
+    def submit(self, coro):
+        """Schedule ``coro`` on the runtime loop and return a ``concurrent.futures.Future``."""
+        loop = self._ensure_started()
+        if threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError("AsyncRuntime.run called from the runtime loop; await the coroutine instead")
+        with self._lock:
+            self._submitted += 1
+        return asyncio.run_coroutine_threadsafe(coro, loop)
+
+    def run(self, coro, timeout=None):
+        """Run ``coro`` on the runtime loop and return its result, cancelling it after ``timeout`` seconds."""
+        future = self.submit(coro)
+        start = time.monotonic()
+        with self._lock:
+            self._inflight += 1
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            with self._lock:
+                self._timeouts += 1
+            raise
+        finally:
+            with self._lock:
+                self._inflight -= 1
+                self._runs += 1
+                self._run_total += time.monotonic() - start
+
+    def stop(self, timeout=5.0):
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+        if loop is None:
+            return
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout)
+        if not loop.is_running():
+            loop.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "running": self._loop is not None and self._pid == os.getpid(),
+                "submitted": self._submitted,
+                "inflight": self._inflight,
+                "timeouts": self._timeouts,
+                "avg_run_ms": round(self._run_total / self._runs * 1000, 2) if self._runs else None,
+            }
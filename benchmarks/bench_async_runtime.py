@@ -0,0 +1,157 @@
+"""
+Benchmark per-message overhead of running ai_respond-style coroutines from
+synchronous code with a new event loop per message versus the persistent
+AsyncRuntime.
+
+Each simulated message makes one HTTP request through an ``httpx.AsyncClient``
+(the client ``AsyncOpenAI`` uses internally). With a loop per message the
+client's connection pool cannot outlive the loop, so every message pays for a
+new loop, a new client and a new connection (a TLS handshake against a real
+HTTPS endpoint). With the runtime one client and its pooled connections serve
+every message.
+
+By default the requests go to a local keep-alive HTTP server started by the
+benchmark; pass ``--url`` (e.g. ``https://api.openai.com/v1/models``) to
+include real TLS handshakes.
+
+``--blocking-ms`` adds a blocking call per message (standing in for the
+database and Calendar calls ai_respond makes) and ``--concurrency`` submits
+messages from several greenlets at once. The ``persistent-to-thread`` mode
+runs the blocking call through ``asyncio.to_thread``, as ai_respond does;
+``persistent`` runs it on the loop, stalling every other message. The
+loop-per-message mode only runs with a concurrency of 1: greenlets share the
+thread's running-loop state, so concurrent per-message loops fail with
+"Cannot run the event loop while another loop is running".
+
+Usage:
+    python benchmarks/bench_async_runtime.py [--messages 200] [--url URL]
+        [--blocking-ms 0] [--concurrency 1]
+"""
+from gevent import monkey
+monkey.patch_all()
+
+import argparse
+import asyncio
+import concurrent.futures
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from async_runtime import AsyncRuntime
+
+
+class OkHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = b'{"ok": true}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_local_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), OkHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/"
+
+
+async def handle_message(client, url, blocking=0.0, to_thread=False):
+    if blocking:
+        if to_thread:
+            await asyncio.to_thread(time.sleep, blocking)
+        else:
+            time.sleep(blocking)
+    response = await client.get(url)
+    return response.status_code
+
+
+def loop_per_message(url, blocking):
+    """What ai_respond_sync used to do: a fresh loop (and so a fresh client) per message."""
+    async def once():
+        async with httpx.AsyncClient(timeout=30.0) as client:
+            return await handle_message(client, url, blocking)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(once())
+    finally:
+        loop.close()
+
+
+def summarize(timings):
+    timings = sorted(timings)
+    return {
+        "mean_ms": round(statistics.mean(timings) * 1000, 2),
+        "p50_ms": round(timings[len(timings) // 2] * 1000, 2),
+        "p95_ms": round(timings[int(len(timings) * 0.95) - 1] * 1000, 2),
+    }
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def run(mode, messages, url, blocking, concurrency):
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as callers:
+        if mode == "loop-per-message":
+            timings = list(callers.map(lambda _: timed(lambda: loop_per_message(url, blocking)), range(messages)))
+            return dict(summarize(timings), total_s=round(time.perf_counter() - start, 2))
+
+        runtime = AsyncRuntime(name="bench-runtime")
+        client = httpx.AsyncClient(timeout=30.0)
+        to_thread = mode == "persistent-to-thread"
+        try:
+            timings = list(callers.map(
+                lambda _: timed(lambda: runtime.run(handle_message(client, url, blocking, to_thread))), range(messages)
+            ))
+        finally:
+            runtime.run(client.aclose())
+            runtime.stop()
+    return dict(summarize(timings), total_s=round(time.perf_counter() - start, 2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--url", help="Endpoint to request instead of the local server")
+    parser.add_argument("--blocking-ms", type=float, default=0.0, help="Blocking call per message")
+    parser.add_argument("--concurrency", type=int, default=1, help="Messages submitted at once")
+    args = parser.parse_args()
+    blocking = args.blocking_ms / 1000
+
+    server = None
+    url = args.url
+    if not url:
+        server, url = start_local_server()
+    try:
+        modes = ("persistent", "persistent-to-thread")
+        if args.concurrency == 1:
+            modes = ("loop-per-message",) + modes
+        results = {mode: run(mode, args.messages, url, blocking, args.concurrency) for mode in modes}
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    print(f"messages={args.messages} concurrency={args.concurrency} blocking_ms={args.blocking_ms} url={url}")
+    for mode, result in results.items():
+        print(f"{mode:>20}: " + ", ".join(f"{k}={v}" for k, v in result.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Benchmark concurrent query throughput under gevent with and without the
+cooperative psycopg2 wait callback.
+
+Each run spawns CONCURRENCY greenlets that all execute an artificially slow
+query (``SELECT pg_sleep(QUERY_SECONDS)``) through the application's
+connection pool, while a heartbeat greenlet measures how late the hub wakes it
+up (a stand-in for Socket.IO pings). In blocking mode the queries run one after
+another and the heartbeat stalls; in green mode they overlap.
+
+Usage:
+    DATABASE_URL=postgresql://... python benchmarks/bench_gevent_db.py [--concurrency 20] [--query-seconds 0.2]
+"""
+from gevent import monkey
+monkey.patch_all()
+
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+import gevent
+import gevent.event
+from psycopg2 import extensions
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from db_pool import BlockingConnectionPool, make_psycopg2_green
+
+
+def heartbeat(stop, interval, lateness):
+    while not stop.is_set():
+        expected = time.monotonic() + interval
+        gevent.sleep(interval)
+        lateness.append(max(0.0, time.monotonic() - expected))
+
+
+def run(pool, concurrency, query_seconds):
+    def worker():
+        with pool.connection(owner="benchmark") as conn:
+            c = conn.cursor()
+            c.execute("SELECT pg_sleep(%s)", (query_seconds,))
+
+    stop = gevent.event.Event()
+    lateness = []
+    hb = gevent.spawn(heartbeat, stop, 0.01, lateness)
+    start = time.monotonic()
+    gevent.joinall([gevent.spawn(worker) for _ in range(concurrency)], raise_error=True)
+    elapsed = time.monotonic() - start
+    stop.set()
+    hb.join()
+    return {
+        "elapsed_s": round(elapsed, 3),
+        "queries_per_s": round(concurrency / elapsed, 2),
+        "max_heartbeat_delay_ms": round(max(lateness, default=0.0) * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--query-seconds", type=float, default=0.2)
+    args = parser.parse_args()
+
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        raise SystemExit("DATABASE_URL environment variable is not set")
+    database_url = database_url.replace("postgres://", "postgresql://", 1)
+
+    results = {}
+    for mode in ("blocking", "green"):
+        if mode == "green":
+            if not make_psycopg2_green():
+                raise SystemExit("gevent has not patched socket; green mode cannot be benchmarked")
+        else:
+            extensions.set_wait_callback(None)
+        pool = BlockingConnectionPool(
+            minconn=args.concurrency,
+            maxconn=args.concurrency,
+            max_waiters=args.concurrency,
+            dsn=database_url,
+        )
+        try:
+            results[mode] = run(pool, args.concurrency, args.query_seconds)
+        finally:
+            pool.closeall()
+
+    print(f"concurrency={args.concurrency} query_seconds={args.query_seconds}")
+    for mode, result in results.items():
+        print(f"{mode:>8}: " + ", ".join(f"{k}={v}" for k, v in result.items()))
+
+
+if __name__ == "__main__":
+    main()
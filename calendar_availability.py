@@ -0,0 +1,259 @@
+"""
+Booked-night lookups against the resort's Google Calendar.
+
+Nights are marked unavailable by events titled "Fully Booked". A night is the
+UTC day starting at its date; an event books every night it overlaps.
+
+``sync_calendar`` mirrors those nights into the ``calendar_booked_nights``
+table using the Calendar API's incremental sync tokens: the first run (or a
+run after the token expires) lists every event, later runs only the events
+changed since. ``local_booked_nights`` answers from that table as long as the
+last successful sync is at most ``CALENDAR_SYNC_MAX_STALENESS`` seconds old.
+"""
+import logging
+import os
+import time
+from datetime import date, datetime, time as dt_time, timedelta, timezone
+
+from googleapiclient.errors import HttpError
+
+logger = logging.getLogger("chat_server")
+
+CALENDAR_ID = os.getenv(
+    "GOOGLE_CALENDAR_ID",
+    "a33289c61cf358216690e7cc203d116cec4c44075788fab3f2b200f5bbcd89cc@group.calendar.google.com"
+)
+FULLY_BOOKED_SUMMARY = "Fully Booked"
+CALENDAR_SYNC_INTERVAL = float(os.getenv("CALENDAR_SYNC_INTERVAL", 60))
+CALENDAR_SYNC_MAX_STALENESS = float(os.getenv("CALENDAR_SYNC_MAX_STALENESS", 300))
+# How far either side of a fully booked stay to look for the same stay length
+ALTERNATIVE_SEARCH_DAYS = int(os.getenv("ALTERNATIVE_SEARCH_DAYS", 7))
+ALTERNATIVE_SUGGESTIONS = int(os.getenv("ALTERNATIVE_SUGGESTIONS", 2))
+# Arbitrary application-wide key for pg_try_advisory_xact_lock so syncs never overlap
+CALENDAR_SYNC_LOCK_ID = 727002
+
+
+def to_date(value):
+    return value.date() if isinstance(value, datetime) else value
+
+
+def night_range(check_in, check_out):
+    """Dates of the nights from ``check_in`` up to, not including, ``check_out``."""
+    night = to_date(check_in)
+    last = to_date(check_out)
+    while night < last:
+        yield night
+        night += timedelta(days=1)
+
+
+def utc_midnight(day):
+    return datetime.combine(to_date(day), dt_time.min, tzinfo=timezone.utc)
+
+
+def rfc3339(day):
+    return utc_midnight(day).isoformat().replace("+00:00", "Z")
+
+
+def _parse_event_time(value):
+    """Return an event's start or end as an aware UTC datetime."""
+    if "dateTime" in value:
+        parsed = datetime.fromisoformat(value["dateTime"].replace("Z", "+00:00"))
+        return parsed.astimezone(timezone.utc) if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+    return utc_midnight(date.fromisoformat(value["date"]))
+
+
+def event_nights(event):
+    """Dates of the nights an event overlaps (all-day end dates are exclusive)."""
+    start = _parse_event_time(event["start"])
+    end = _parse_event_time(event["end"])
+    night = start.date()
+    while utc_midnight(night) < end:
+        yield night
+        night += timedelta(days=1)
+
+
+def booked_nights(events, check_in, check_out):
+    """Sorted dates between ``check_in`` and ``check_out`` covered by a "Fully Booked" event."""
+    stay = set(night_range(check_in, check_out))
+    booked = set()
+    for event in events:
+        if event.get("summary") == FULLY_BOOKED_SUMMARY and event.get("status") != "cancelled":
+            booked.update(night for night in event_nights(event) if night in stay)
+    return sorted(booked)
+
+
+def alternative_stays(booked, check_in, check_out, search_days=ALTERNATIVE_SEARCH_DAYS,
+                      limit=ALTERNATIVE_SUGGESTIONS, earliest=None):
+    """
+    Return up to ``limit`` ``(check_in, check_out)`` date pairs of the same
+    length as the requested stay, shifted by at most ``search_days`` days and
+    free of every night in ``booked``, nearest first (earlier first on ties).
+    """
+    booked = set(booked)
+    check_in, check_out = to_date(check_in), to_date(check_out)
+    earliest = earliest or datetime.now(timezone.utc).date()
+    offsets = sorted((offset for offset in range(-search_days, search_days + 1) if offset), key=lambda o: (abs(o), o))
+    stays = []
+    for offset in offsets:
+        start, end = check_in + timedelta(days=offset), check_out + timedelta(days=offset)
+        if start < earliest or booked.intersection(night_range(start, end)):
+            continue
+        stays.append((start, end))
+        if len(stays) == limit:
+            break
+    return stays
+
+
+def search_windows(check_in, check_out, search_days=ALTERNATIVE_SEARCH_DAYS):
+    """Split the stay plus ``search_days`` either side into windows that can be queried in parallel."""
+    check_in, check_out = to_date(check_in), to_date(check_out)
+    return [
+        (check_in - timedelta(days=search_days), check_in),
+        (check_in, check_out),
+        (check_out, check_out + timedelta(days=search_days)),
+    ]
+
+
+def list_events(service, check_in, check_out):
+    """Fetch every event overlapping the stay with a single (paginated) range query."""
+    events = []
+    page_token = None
+    while True:
+        result = service.events().list(
+            calendarId=CALENDAR_ID,
+            timeMin=rfc3339(check_in),
+            timeMax=rfc3339(check_out),
+            singleEvents=True,
+            q=FULLY_BOOKED_SUMMARY,
+            fields="items(summary,status,start,end),nextPageToken",
+            pageToken=page_token,
+        ).execute()
+        events.extend(result.get("items", []))
+        page_token = result.get("nextPageToken")
+        if not page_token:
+            return events
+
+
+def local_booked_nights(conn, check_in, check_out, max_staleness=CALENDAR_SYNC_MAX_STALENESS):
+    """
+    Return the sorted booked nights of the stay from the local mirror, or None
+    if it has never been synced or is older than ``max_staleness`` seconds.
+    """
+    c = conn.cursor()
+    c.execute(
+        "SELECT EXTRACT(EPOCH FROM NOW() - last_synced_at) AS age FROM calendar_sync_state WHERE calendar_id = %s",
+        (CALENDAR_ID,)
+    )
+    row = c.fetchone()
+    if row is None or row['age'] is None:
+        logger.warning("⚠️ Local calendar mirror has never been synced")
+        return None
+    if row['age'] > max_staleness:
+        logger.warning(f"⚠️ Local calendar mirror is stale (last synced {row['age']:.0f} seconds ago)")
+        return None
+    c.execute(
+        "SELECT DISTINCT night FROM calendar_booked_nights WHERE night >= %s AND night < %s ORDER BY night",
+        (to_date(check_in), to_date(check_out))
+    )
+    return [row['night'] for row in c.fetchall()]
+
+
+def _changed_events(service, sync_token):
+    """Yield every event (changed since ``sync_token``, if given), then the new sync token."""
+    page_token = None
+    while True:
+        result = service.events().list(
+            calendarId=CALENDAR_ID,
+            singleEvents=True,
+            showDeleted=sync_token is not None,
+            syncToken=sync_token,
+            pageToken=page_token,
+            fields="items(id,summary,status,start,end),nextPageToken,nextSyncToken",
+        ).execute()
+        for event in result.get("items", []):
+            yield event
+        page_token = result.get("nextPageToken")
+        if not page_token:
+            yield result["nextSyncToken"]
+            return
+
+
+def _apply_event(cursor, event):
+    cursor.execute("DELETE FROM calendar_booked_nights WHERE event_id = %s", (event["id"],))
+    if event.get("summary") != FULLY_BOOKED_SUMMARY or event.get("status") == "cancelled":
+        return
+    nights = list(event_nights(event))
+    if nights:
+        cursor.executemany(
+            "INSERT INTO calendar_booked_nights (night, event_id) VALUES (%s, %s) ON CONFLICT DO NOTHING",
+            [(night, event["id"]) for night in nights]
+        )
+
+
+def fetch_calendar_changes(service, sync_token):
+    """
+    Return ``(events, next_token, full)``: the events changed since
+    ``sync_token`` (every event if it is None or has expired), the token for
+    the next sync, and whether this was a full sync.
+    """
+    try:
+        items = list(_changed_events(service, sync_token))
+    except HttpError as e:
+        if sync_token is None or e.resp.status != 410:
+            raise
+        # The sync token expired; start over with a full sync
+        logger.warning("⚠️ Calendar sync token expired, running a full sync")
+        sync_token = None
+        items = list(_changed_events(service, None))
+    return items[:-1], items[-1], sync_token is None
+
+
+def sync_calendar(service, lease):
+    """
+    Bring the local mirror up to date. The Calendar API is paged through
+    before any connection is leased; the changes are then applied in one short
+    transaction under an advisory lock. Returns the number of events applied,
+    or None if another sync holds the lock or got there first.
+
+    Args:
+        service: Calendar service object.
+        lease (callable): Returns a context manager yielding a pooled connection.
+    """
+    start_time = time.time()
+    with lease(autocommit=True) as conn:
+        c = conn.cursor()
+        c.execute("SELECT sync_token FROM calendar_sync_state WHERE calendar_id = %s", (CALENDAR_ID,))
+        row = c.fetchone()
+    sync_token = row['sync_token'] if row else None
+
+    events, next_token, full = fetch_calendar_changes(service, sync_token)
+    fetched = time.time()
+
+    with lease() as conn:
+        c = conn.cursor()
+        c.execute("SELECT pg_try_advisory_xact_lock(%s)", (CALENDAR_SYNC_LOCK_ID,))
+        if not c.fetchone()[0]:
+            logger.info("Calendar sync already running elsewhere, skipping")
+            return None
+        c.execute("SELECT sync_token FROM calendar_sync_state WHERE calendar_id = %s", (CALENDAR_ID,))
+        row = c.fetchone()
+        if (row['sync_token'] if row else None) != sync_token:
+            # Another sync applied newer changes while these were fetched
+            logger.info("Calendar was synced elsewhere in the meantime, discarding fetched changes")
+            return None
+        if full:
+            c.execute("DELETE FROM calendar_booked_nights")
+        for event in events:
+            _apply_event(c, event)
+        c.execute(
+            """
+            INSERT INTO calendar_sync_state (calendar_id, sync_token, last_synced_at) VALUES (%s, %s, NOW())
+            ON CONFLICT (calendar_id) DO UPDATE SET sync_token = EXCLUDED.sync_token, last_synced_at = EXCLUDED.last_synced_at
+            """,
+            (CALENDAR_ID, next_token)
+        )
+    logger.info(
+        f"✅ Calendar {'full' if full else 'incremental'} sync applied {len(events)} events "
+        f"in {time.time() - start_time:.2f} seconds ({time.time() - fetched:.2f} in the database)"
+    )
+    return len(events)
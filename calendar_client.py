@@ -0,0 +1,106 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import google_auth_httplib2
+import httplib2
+from googleapiclient.discovery import build
+
+logger = logging.getLogger("chat_server")
+
+
+class CalendarPoolTimeout(Exception):
+    """Raised when no Calendar client becomes free within the checkout timeout."""
+
+
+class CalendarClientPool:
+    """
+    Bounded pool of Google Calendar service objects.
+
+    A ``googleapiclient`` service wraps a single httplib2 connection, which is
+    not safe to use from two greenlets or threads at once. Each slot in this
+    pool gets its own ``AuthorizedHttp`` (sharing the refreshable credentials),
+    and callers lease a slot for the duration of one request. Slots are built
+    lazily up to ``size``. Like ``BlockingConnectionPool`` it only uses
+    ``threading``/``queue`` primitives, so under ``monkey.patch_all()`` waiting
+    callers are parked greenlets.
+
+    ``map`` runs one call per item concurrently, each on its own slot.
+
+    Args:
+        credentials: google-auth credentials with a Calendar scope.
+        size (int): Maximum number of clients (and concurrent requests).
+        checkout_timeout (float): Seconds a caller waits before ``CalendarPoolTimeout``.
+        http_timeout (float): Socket timeout of each client's HTTP connection.
+    """
+
+    def __init__(self, credentials, size=4, checkout_timeout=10.0, http_timeout=15.0):
+        self._credentials = credentials
+        self.size = size
+        self.checkout_timeout = checkout_timeout
+        self.http_timeout = http_timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="calendar")
+        self._stats = {"checkouts": 0, "waits": 0, "timeouts": 0, "wait_total": 0.0}
+
+    def _build(self):
+        http = google_auth_httplib2.AuthorizedHttp(self._credentials, http=httplib2.Http(timeout=self.http_timeout))
+        return build("calendar", "v3", http=http, cache_discovery=False)
+
+    def _checkout(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            grow = self._created < self.size
+            if grow:
+                self._created += 1
+        if grow:
+            try:
+                return self._build()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        start = time.monotonic()
+        with self._lock:
+            self._stats["waits"] += 1
+        try:
+            return self._idle.get(timeout=self.checkout_timeout)
+        except queue.Empty:
+            with self._lock:
+                self._stats["timeouts"] += 1
+            raise CalendarPoolTimeout(f"No Calendar client free after {self.checkout_timeout} seconds")
+        finally:
+            with self._lock:
+                self._stats["wait_total"] += time.monotonic() - start
+
+    @contextmanager
+    def lease(self):
+        """Lease a Calendar service object for exclusive use inside a ``with`` block."""
+        service = self._checkout()
+        with self._lock:
+            self._stats["checkouts"] += 1
+        try:
+            yield service
+        finally:
+            self._idle.put(service)
+
+    def map(self, fn, items):
+        """Return ``[fn(service, item) for item in items]``, running the calls concurrently."""
+        def call(item):
+            with self.lease() as service:
+                return fn(service, item)
+        return list(self._executor.map(call, items))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, size=self.size, created=self._created, idle=self._idle.qsize())
+        stats["wait_total"] = round(stats["wait_total"], 3)
+        return stats
@@ -10,8 +10,8 @@ from flask_socketio import SocketIO, emit, join_room, leave_room
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 import psycopg2
 from psycopg2.extras import DictCursor
-from psycopg2.pool import SimpleConnectionPool
 import os
+import sys
 import requests
 import json
 from datetime import datetime, timezone, timedelta
@@ -19,9 +19,7 @@ import time
 import logging
 import re
 from google.oauth2 import service_account
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from cachetools import TTLCache
 import openai
 from openai import AsyncOpenAI, OpenAI
 from openai import RateLimitError, APIError, AuthenticationError, APITimeoutError
@@ -31,6 +29,28 @@ import redis as sync_redis  # Add synchronous Redis client
 from concurrent_log_handler import ConcurrentRotatingFileHandler
 from langdetect import detect, DetectorFactory
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+from db_pool import BlockingConnectionPool, make_psycopg2_green
+from async_runtime import AsyncRuntime
+from openai_governor import OpenAIGovernor, OpenAIDegraded, GOVERNOR_STATS_KEY, summarize_stats as summarize_governor_stats
+from message_writer import MessageWriteBehind
+from message_buffer import RecentMessageBuffer
+from single_flight import SingleFlightCache
+from message_coalescer import MessageCoalescer
+from invalidation import InvalidationBus
+from conversation_state import ConversationStateCache, STATE_FIELDS as CONVERSATION_STATE_FIELDS
+from settings_service import SettingsService, Setting
+from faq_engine import FAQEngine, FAQ_STATS_KEY
+from prompt_builder import PromptBuilder
+from calendar_availability import (
+    alternative_stays, booked_nights, local_booked_nights, search_windows, list_events as list_calendar_events
+)
+from calendar_client import CalendarClientPool
+from conversation_memory import (
+    estimate_tokens, fit_history, summary_message, summarization_prompt, summary_pending_key,
+    SUMMARY_MAX_TOKENS, SUMMARY_PENDING_TTL
+)
+from llm_cache import LLMResponseCache, SCOPE_FAQ, SCOPE_CONTEXTUAL, classify_scope, context_hash, normalize_message, summarize_stats, LLM_CACHE_STATS_KEY
+from migrate import current_version as current_schema_version, latest_version as latest_schema_version
 
 DetectorFactory.seed = 0
 
@@ -65,13 +85,25 @@ redis_client = sync_redis.Redis.from_url(
     max_connections=20
 )
 
-# Async Redis client for ai_respond
+# Persistent event loop that all coroutines (ai_respond, summaries) run on
+async_runtime = AsyncRuntime()
+
+# Async Redis client for ai_respond; its pool belongs to async_runtime's loop
 async_redis_client = redis.Redis.from_url(
     os.getenv('REDIS_URL', 'redis://red-cvfhn5nnoe9s73bhmct0:6379'),
     decode_responses=True,
     max_connections=20
 )
 
+# Shared cache of OpenAI replies, keyed on message, language and prompt context
+llm_cache = LLMResponseCache(async_redis_client)
+
+# Dashboard caches recompute each key in one caller only
+dashboard_cache = SingleFlightCache(redis_client)
+
+# Collects a WhatsApp guest's burst of messages into one AI turn
+message_coalescer = MessageCoalescer(redis_client)
+
 # Simplified Redis sync functions
 def redis_get_sync(key):
     try:
@@ -86,6 +118,21 @@ def redis_setex_sync(key, ttl, value):
     except Exception as e:
         logger.error(f"❌ Error in redis_setex_sync for key {key}: {str(e)}")
 
+# Per-conversation cache generations. Message caches include the generation in
+# their key, so bumping it invalidates every cached page for the conversation
+# with a single INCR; the orphaned entries expire through their TTL.
+def messages_generation_key(convo_id):
+    return f"messages_gen:{convo_id}"
+
+def get_messages_generation(convo_id):
+    return redis_get_sync(messages_generation_key(convo_id)) or "0"
+
+def bump_messages_generation(convo_id):
+    try:
+        redis_client.incr(messages_generation_key(convo_id))
+    except Exception as e:
+        logger.error(f"❌ Error bumping message cache generation for convo_id {convo_id}: {str(e)}")
+
 app = Flask(__name__, static_folder='static', template_folder='templates')
 app.config["SECRET_KEY"] = SECRET_KEY
 CORS(app)
@@ -117,22 +164,40 @@ if "sslmode" not in database_url:
     database_url += "?sslmode=require"
     logger.info(f"Added sslmode=require to DATABASE_URL: {database_url}")
 
-db_pool = SimpleConnectionPool(
-    minconn=1,  # Start with 1 connection
-    maxconn=5,  # Limit to 5 connections to avoid overloading
+# Let psycopg2 yield to the gevent hub while waiting on Postgres instead of blocking the worker
+if os.getenv("DB_GREEN_MODE", "true").lower() == "true" and make_psycopg2_green():
+    logger.info("✅ Enabled cooperative psycopg2 wait callback for gevent")
+
+DB_POOL_MINCONN = int(os.getenv("DB_POOL_MINCONN", 1))
+DB_POOL_MAXCONN = int(os.getenv("DB_POOL_MAXCONN", 10))
+DB_POOL_MAX_WAITERS = int(os.getenv("DB_POOL_MAX_WAITERS", 100))
+DB_POOL_CHECKOUT_TIMEOUT = float(os.getenv("DB_POOL_CHECKOUT_TIMEOUT", 10))
+DB_POOL_IDLE_CHECK_AFTER = float(os.getenv("DB_POOL_IDLE_CHECK_AFTER", 30))
+DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", 1800))
+DB_LEASE_WARN_AFTER = float(os.getenv("DB_LEASE_WARN_AFTER", 5))
+DB_LEASE_RECLAIM_AFTER = float(os.getenv("DB_LEASE_RECLAIM_AFTER", 60))
+
+db_pool = BlockingConnectionPool(
+    minconn=DB_POOL_MINCONN,
+    maxconn=DB_POOL_MAXCONN,
+    max_waiters=DB_POOL_MAX_WAITERS,  # Callers beyond this are rejected instead of queueing
+    checkout_timeout=DB_POOL_CHECKOUT_TIMEOUT,  # Seconds to wait for a free connection
+    idle_check_after=DB_POOL_IDLE_CHECK_AFTER,  # Ping connections idle longer than this
+    max_lifetime=DB_POOL_MAX_LIFETIME,  # Recycle connections older than this
+    lease_warn_after=DB_LEASE_WARN_AFTER,  # Log leases held longer than this
+    lease_reclaim_after=DB_LEASE_RECLAIM_AFTER,  # Force-reclaim leases held longer than this
     dsn=database_url,
     sslmode="require",  # Enforce SSL
     sslrootcert=None,  # Let psycopg2 handle SSL certificates
     connect_timeout=10,  # 10-second timeout for connections
-    options="-c statement_timeout=10000"  # Set a 10-second statement timeout
+    options="-c statement_timeout=10000",  # Set a 10-second statement timeout
+    cursor_factory=DictCursor
 )
-logger.info("✅ Database connection pool initialized with minconn=1, maxconn=5, connect_timeout=10")
-
-# Cache for ai_enabled setting with 5-second TTL
-settings_cache = TTLCache(maxsize=1, ttl=5)
+db_pool.start_lease_reaper()
+logger.info(f"✅ Database connection pool initialized with minconn={DB_POOL_MINCONN}, maxconn={DB_POOL_MAXCONN}, max_waiters={DB_POOL_MAX_WAITERS}")
 
 # Import tasks after app and logger are initialized to avoid circular imports
-from tasks import process_whatsapp_message, send_whatsapp_message_task
+from tasks import process_whatsapp_message, send_whatsapp_message_task, summarize_conversation_history
 
 # Validate OpenAI API key
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
@@ -140,10 +205,15 @@ if not OPENAI_API_KEY:
     logger.error("⚠️ OPENAI_API_KEY not set in environment variables")
     raise ValueError("OPENAI_API_KEY not set")
 
-# Initialize OpenAI client with a timeout
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+
+# Initialize OpenAI client with a timeout. SDK retries are off: the SDK would
+# sleep out a 429's retry-after (up to 60s) while holding a governor slot and
+# a worker, so a 429 surfaces at once and openai_governor does the backing off.
 openai_client = AsyncOpenAI(
     api_key=OPENAI_API_KEY,
-    timeout=30.0
+    timeout=30.0,
+    max_retries=0
 )
 
 # Google Calendar setup with Service Account
@@ -162,7 +232,9 @@ SCOPES = ['https://www.googleapis.com/auth/calendar.readonly']
 credentials = service_account.Credentials.from_service_account_info(
     service_account_info, scopes=SCOPES
 )
-service = build('calendar', 'v3', credentials=credentials)
+# Each pooled client has its own HTTP connection, so concurrent greenlets never share one
+CALENDAR_POOL_SIZE = int(os.getenv("CALENDAR_POOL_SIZE", 4))
+calendar_pool = CalendarClientPool(credentials, size=CALENDAR_POOL_SIZE)
 
 # Messaging API tokens
 TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
@@ -260,68 +332,22 @@ except FileNotFoundError:
     """
     logger.warning("⚠️ qa_reference.txt not found, using default training document")
 
-def get_db_connection():
-    global db_pool
-    try:
-        conn = db_pool.getconn()
-        if conn.closed:
-            logger.warning("Connection retrieved from pool is closed, reinitializing pool")
-            db_pool.closeall()
-            db_pool = SimpleConnectionPool(
-                minconn=1,
-                maxconn=5,
-                dsn=database_url,
-                sslmode="require",
-                sslrootcert=None,
-                connect_timeout=10,
-                options="-c statement_timeout=10000"
-            )
-            conn = db_pool.getconn()
-        # Test the connection with a simple query
-        with conn.cursor() as c:
-            c.execute("SELECT 1")
-        conn.cursor_factory = DictCursor
-        logger.info("✅ Retrieved database connection from pool")
-        return conn
-    except Exception as e:
-        logger.error(f"❌ Failed to get database connection: {str(e)}", exc_info=True)
-        # If the error is SSL-related, reinitialize the pool
-        error_str = str(e).lower()
-        if any(err in error_str for err in ["ssl syscall error", "eof detected", "decryption failed", "bad record mac"]):
-            logger.warning("SSL error detected, reinitializing connection pool")
-            try:
-                db_pool.closeall()
-                db_pool = SimpleConnectionPool(
-                    minconn=1,
-                    maxconn=5,
-                    dsn=database_url,
-                    sslmode="require",
-                    sslrootcert=None,
-                    connect_timeout=10,
-                    options="-c statement_timeout=10000"
-                )
-                conn = db_pool.getconn()
-                with conn.cursor() as c:
-                    c.execute("SELECT 1")
-                conn.cursor_factory = DictCursor
-                logger.info("✅ Reinitialized database connection pool and retrieved new connection")
-                return conn
-            except Exception as e2:
-                logger.error(f"❌ Failed to reinitialize database connection pool: {str(e2)}", exc_info=True)
-                raise
-        raise e
-
-def release_db_connection(conn):
-    global db_pool
-    if conn:
-        try:
-            if conn.closed:
-                logger.warning("Attempted to release a closed connection")
-            else:
-                db_pool.putconn(conn)
-                logger.info("✅ Database connection returned to pool")
-        except Exception as e:
-            logger.error(f"❌ Failed to return database connection to pool: {str(e)}")
+# Answers standalone questions straight from the Q&A pairs without calling OpenAI
+faq_engine = FAQEngine(TRAINING_DOCUMENT)
+# Builds per-turn system prompts from the reference sections relevant to the message
+prompt_builder = PromptBuilder(TRAINING_DOCUMENT)
+
+def db_lease(timeout=None, autocommit=False):
+    """
+    Lease a pooled connection for the duration of a ``with`` block.
+
+    The transaction is committed when the block exits normally, rolled back when
+    it raises, and the connection is always returned to the pool, including on
+    early returns. Leases held too long are logged and eventually reclaimed.
+    Pass ``autocommit=True`` for single-statement work to skip BEGIN/COMMIT.
+    """
+    owner = sys._getframe(1).f_code.co_name
+    return db_pool.connection(owner=owner, timeout=timeout, autocommit=autocommit)
 
 def with_db_retry(func):
     """Decorator to retry database operations on failure."""
@@ -332,333 +358,114 @@ def with_db_retry(func):
                 return func(*args, **kwargs)
             except Exception as e:
                 logger.error(f"❌ Database operation failed (Attempt {attempt + 1}/{retries}): {str(e)}")
-                error_str = str(e).lower()
-                if any(err in error_str for err in ["ssl syscall error", "eof detected", "decryption failed", "bad record mac", "connection already closed"]):
-                    global db_pool
-                    try:
-                        db_pool.closeall()
-                        db_pool = SimpleConnectionPool(
-                            minconn=5,
-                            maxconn=30,
-                            dsn=database_url,
-                            sslmode="require",
-                            sslrootcert=None
-                        )
-                        logger.info("✅ Reinitialized database connection pool due to SSL or connection error")
-                    except Exception as e2:
-                        logger.error(f"❌ Failed to reinitialize database connection pool: {str(e2)}")
                 if attempt < retries - 1:
                     time.sleep(2)
                     continue
                 raise e
     return wrapper
 
-# Cache the ai_enabled setting
-@with_db_retry
+# Served from the settings snapshot; no database read per call
 def get_ai_enabled():
-    if "ai_enabled" in settings_cache:
-        logger.info("✅ Retrieved ai_enabled from cache")
-        return settings_cache["ai_enabled"]
     try:
-        with get_db_connection() as conn:
-            c = conn.cursor()
-            c.execute("SELECT value, last_updated FROM settings WHERE key = %s", ("ai_enabled",))
-            result = c.fetchone()
-            global_ai_enabled = result['value'] if result else "1"
-            ai_toggle_timestamp = result['last_updated'] if result else "1970-01-01T00:00:00Z"
-            settings_cache["ai_enabled"] = (global_ai_enabled, ai_toggle_timestamp)
-            logger.info(f"✅ Cached ai_enabled: {global_ai_enabled}, last_updated: {ai_toggle_timestamp}")
-            release_db_connection(conn)
-        return settings_cache["ai_enabled"]
+        global_ai_enabled, ai_toggle_timestamp = settings_service.get("ai_enabled", Setting("1", "1970-01-01T00:00:00Z"))
+        return global_ai_enabled, ai_toggle_timestamp
     except Exception as e:
-        logger.error(f"❌ Failed to fetch ai_enabled from database: {str(e)}")
+        logger.error(f"❌ Failed to load ai_enabled setting: {str(e)}")
         return ("1", "1970-01-01T00:00:00Z")
 
-@with_db_retry
-def init_db():
-    logger.info("Initializing database")
-    with get_db_connection() as conn:
-        c = conn.cursor()
-
-        # Check if tables exist before creating them
-        c.execute("""
-            SELECT EXISTS (
-                SELECT FROM information_schema.tables 
-                WHERE table_name = 'conversations'
-            )
-        """)
-        conversations_table_exists = c.fetchone()[0]
-
-        c.execute("""
-            SELECT EXISTS (
-                SELECT FROM information_schema.tables 
-                WHERE table_name = 'messages'
-            )
-        """)
-        messages_table_exists = c.fetchone()[0]
-
-        c.execute("""
-            SELECT EXISTS (
-                SELECT FROM information_schema.tables 
-                WHERE table_name = 'agents'
-            )
-        """)
-        agents_table_exists = c.fetchone()[0]
-
-        c.execute("""
-            SELECT EXISTS (
-                SELECT FROM information_schema.tables 
-                WHERE table_name = 'settings'
-            )
-        """)
-        settings_table_exists = c.fetchone()[0]
-
-        # Create tables only if they don't exist
-        if not conversations_table_exists:
-            c.execute('''CREATE TABLE conversations (
-                id SERIAL PRIMARY KEY,
-                username TEXT NOT NULL,
-                chat_id TEXT NOT NULL,
-                channel TEXT NOT NULL,
-S
-                assigned_agent TEXT,
-                ai_enabled INTEGER DEFAULT 1,
-                needs_agent INTEGER DEFAULT 0,
-                booking_intent TEXT,
-                handoff_notified INTEGER DEFAULT 0,
-                visible_in_conversations INTEGER DEFAULT 1,
-                language TEXT DEFAULT 'en',
-                last_updated TEXT DEFAULT CURRENT_TIMESTAMP
-            )''')
-            logger.info("Created conversations table")
-        else:
-            # Migration: Add needs_agent, language, and other columns if they don't exist
-            c.execute("""
-                SELECT EXISTS (
-                    SELECT FROM information_schema.columns 
-                    WHERE table_name = 'conversations' AND column_name = 'needs_agent'
-                )
-            """)
-            needs_agent_exists = c.fetchone()[0]
-            if not needs_agent_exists:
-                c.execute("ALTER TABLE conversations ADD COLUMN needs_agent INTEGER DEFAULT 0")
-                logger.info("Added needs_agent column to conversations table")
-
-            c.execute("""
-                SELECT EXISTS (
-                    SELECT FROM information_schema.columns 
-                    WHERE table_name = 'conversations' AND column_name = 'language'
-                )
-            """)
-            language_exists = c.fetchone()[0]
-            if not language_exists:
-                c.execute("ALTER TABLE conversations ADD COLUMN language TEXT DEFAULT 'en'")
-                logger.info("Added language column to conversations table")
-
-            c.execute("""
-                SELECT EXISTS (
-                    SELECT FROM information_schema.columns 
-                    WHERE table_name = 'conversations' AND column_name = 'booking_intent'
-                )
-            """)
-            booking_intent_exists = c.fetchone()[0]
-            if not booking_intent_exists:
-                c.execute("ALTER TABLE conversations ADD COLUMN booking_intent TEXT")
-                logger.info("Added booking_intent column to conversations table")
-
-            c.execute("""
-                SELECT EXISTS (
-                    SELECT FROM information_schema.columns 
-                    WHERE table_name = 'conversations' AND column_name = 'handoff_notified'
-                )
-            """)
-            handoff_notified_exists = c.fetchone()[0]
-            if not handoff_notified_exists:
-                c.execute("ALTER TABLE conversations ADD COLUMN handoff_notified INTEGER DEFAULT 0")
-                logger.info("Added handoff_notified column to conversations table")
-
-        if not messages_table_exists:
-            c.execute('''CREATE TABLE messages (
-                id SERIAL PRIMARY KEY,
-                convo_id INTEGER NOT NULL,
-                username TEXT NOT NULL,
-                message TEXT NOT NULL,
-                sender TEXT NOT NULL,
-                timestamp TEXT DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (convo_id) REFERENCES conversations (id)
-            )''')
-            logger.info("Created messages table")
-
-        if not agents_table_exists:
-            c.execute('''CREATE TABLE agents (
-                id SERIAL PRIMARY KEY,
-                username TEXT NOT NULL UNIQUE
-            )''')
-            logger.info("Created agents table")
-        else:
-            # Migration: Drop password_hash and password columns if they exist
-            c.execute("""
-                SELECT EXISTS (
-                    SELECT FROM information_schema.columns 
-                    WHERE table_name = 'agents' AND column_name = 'password_hash'
-                )
-            """)
-            password_hash_exists = c.fetchone()[0]
-            if password_hash_exists:
-                c.execute("ALTER TABLE agents DROP COLUMN password_hash")
-                logger.info("Dropped password_hash column from agents table")
-
-            c.execute("""
-                SELECT EXISTS (
-                    SELECT FROM information_schema.columns 
-                    WHERE table_name = 'agents' AND column_name = 'password'
-                )
-            """)
-            password_exists = c.fetchone()[0]
-            if password_exists:
-                c.execute("ALTER TABLE agents DROP COLUMN password")
-                logger.info("Dropped password column from agents table")
-
-        if not settings_table_exists:
-            c.execute('''CREATE TABLE settings (
-                key TEXT PRIMARY KEY,
-                value TEXT NOT NULL,
-                last_updated TEXT DEFAULT CURRENT_TIMESTAMP
-            )''')
-            logger.info("Created settings table")
-        else:
-            # Migration: Add last_updated column if it doesn't exist
-            c.execute("""
-                SELECT EXISTS (
-                    SELECT FROM information_schema.columns 
-                    WHERE table_name = 'settings' AND column_name = 'last_updated'
-                )
-            """)
-            last_updated_exists = c.fetchone()[0]
-            if not last_updated_exists:
-                c.execute("ALTER TABLE settings ADD COLUMN last_updated TEXT DEFAULT CURRENT_TIMESTAMP")
-                logger.info("Added last_updated column to settings table")
-
-        # Create indexes for frequently queried columns
-        c.execute("CREATE INDEX IF NOT EXISTS idx_conversations_chat_id ON conversations (chat_id);")
-        logger.info("Created index idx_conversations_chat_id")
-
-        c.execute("CREATE INDEX IF NOT EXISTS idx_messages_convo_id ON messages (convo_id);")
-        logger.info("Created index idx_messages_convo_id")
-
-        c.execute("CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages (timestamp);")
-        logger.info("Created index idx_messages_timestamp")
-
-        c.execute("CREATE INDEX IF NOT EXISTS idx_settings_key ON settings (key);")
-        logger.info("Created index idx_settings_key")
-
-        # Seed initial data (only in development or if explicitly enabled)
-        if os.getenv("SEED_INITIAL_DATA", "false").lower() == "true":
-            c.execute("SELECT COUNT(*) FROM settings")
-            if c.fetchone()[0] == 0:
-                c.execute(
-                    "INSERT INTO settings (key, value, last_updated) VALUES (%s, %s, %s) ON CONFLICT (key) DO NOTHING",
-                    ('ai_enabled', '1', datetime.now(timezone.utc).isoformat())
-                )
-                logger.info("Inserted default settings")
-
-            c.execute("SELECT COUNT(*) FROM agents")
-            if c.fetchone()[0] == 0:
-                c.execute(
-                    "INSERT INTO agents (username) VALUES (%s) ON CONFLICT (username) DO NOTHING",
-                    ('admin',)
-                )
-                logger.info("Inserted default admin user")
+def check_schema_version():
+    """
+    Refuse to start against a database that has not been migrated to the schema
+    this code expects. Migrations are applied at deploy time with
+    ``python migrate.py upgrade``, so startup only reads the version number.
+    """
+    expected = latest_schema_version()
+    with db_lease() as conn:
+        current = current_schema_version(conn)
+    if current < expected:
+        logger.error(f"❌ Database schema is at version {current}, expected {expected}. Run 'python migrate.py upgrade'.")
+        raise RuntimeError(f"Database schema is at version {current}, expected {expected}")
+    logger.info(f"✅ Database schema at version {current}")
+
+check_schema_version()
+
+# Last N messages per conversation in Redis, used for LLM history and 'since' polling
+recent_messages = RecentMessageBuffer(
+    redis_client,
+    db_lease,
+    messages_generation_key,
+    size=int(os.getenv("RECENT_MESSAGES_SIZE", 50)),
+    ttl=int(os.getenv("RECENT_MESSAGES_TTL", 86400))
+)
 
-            c.execute("SELECT COUNT(*) FROM conversations WHERE channel = %s", ('whatsapp',))
-            if c.fetchone()[0] == 0:
-                logger.info("ℹ️ Inserting test conversations")
-                test_timestamp1 = "2025-03-22T00:00:00Z"
-                c.execute(
-                    "INSERT INTO conversations (username, chat_id, channel, assigned_agent, ai_enabled, needs_agent, booking_intent, last_updated, language) "
-                    "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING id",
-                    ('TestUser1', '123456789', 'whatsapp', None, 1, 0, None, test_timestamp1, 'en')
-                )
-                convo_id1 = c.fetchone()['id']
-                c.execute(
-                    "INSERT INTO messages (convo_id, username, message, sender, timestamp) VALUES (%s, %s, %s, %s, %s)",
-                    (convo_id1, 'TestUser1', 'Hello, I need help!', 'user', test_timestamp1)
-                )
-                test_timestamp2 = "2025-03-22T00:00:01Z"
-                c.execute(
-                    "INSERT INTO conversations (username, chat_id, channel, assigned_agent, ai_enabled, needs_agent, booking_intent, last_updated, language) "
-                    "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING id",
-                    ('TestUser2', '987654321', 'whatsapp', None, 1, 0, None, test_timestamp2, 'es')
-                )
-                convo_id2 = c.fetchone()['id']
-                c.execute(
-                    "INSERT INTO messages (convo_id, username, message, sender, timestamp) VALUES (%s, %s, %s, %s, %s)",
-                    (convo_id2, 'TestUser2', 'Hola, ¿puedo reservar una habitación?', 'user', test_timestamp2)
-                )
-                logger.info("Inserted test conversations")
+# Optional write-behind buffering of message inserts
+MESSAGE_WRITE_BEHIND = os.getenv("MESSAGE_WRITE_BEHIND", "false").lower() == "true"
+message_writer = None
+if MESSAGE_WRITE_BEHIND:
+    message_writer = MessageWriteBehind(
+        db_lease,
+        batch_size=int(os.getenv("MESSAGE_WRITE_BEHIND_BATCH_SIZE", 200)),
+        flush_interval=float(os.getenv("MESSAGE_WRITE_BEHIND_FLUSH_INTERVAL", 0.5)),
+        on_flush=lambda convo_ids: [bump_messages_generation(convo_id) for convo_id in convo_ids]
+    )
+    logger.info("✅ Message write-behind logging enabled")
+
+# Conversation flags cached in-process and in Redis, invalidated over pub/sub
+invalidation_bus = InvalidationBus(redis_client)
+conversation_state = ConversationStateCache(
+    db_lease,
+    redis_client,
+    invalidation_bus,
+    maxsize=int(os.getenv("CONVERSATION_STATE_CACHE_SIZE", 4096)),
+    local_ttl=float(os.getenv("CONVERSATION_STATE_LOCAL_TTL", 60)),
+    redis_ttl=int(os.getenv("CONVERSATION_STATE_REDIS_TTL", 600))
+)
+settings_service = SettingsService(
+    db_lease,
+    invalidation_bus,
+    poll_interval=float(os.getenv("SETTINGS_POLL_INTERVAL", 5))
+)
+invalidation_bus.start()
+settings_service.start()
 
-        conn.commit()
-        logger.info("✅ Database initialized")
-        release_db_connection(conn)
+def update_conversation(convo_id, **fields):
+    """Update columns of a conversation and invalidate its cached state if any of them are cached."""
+    assignments = ", ".join(f"{column} = %s" for column in fields)
+    with db_lease(autocommit=True) as conn:
+        c = conn.cursor()
+        c.execute(f"UPDATE conversations SET {assignments} WHERE id = %s", (*fields.values(), convo_id))
+    if CONVERSATION_STATE_FIELDS & fields.keys():
+        conversation_state.invalidate(convo_id)
 
 @with_db_retry
-def add_test_conversations():
-    if os.getenv("SEED_INITIAL_DATA", "false").lower() != "true":
-        logger.info("Skipping test conversations (SEED_INITIAL_DATA not enabled)")
-        return
-    try:
-        with get_db_connection() as conn:
-            c = conn.cursor()
-            c.execute("SELECT COUNT(*) FROM conversations WHERE channel = %s", ('test',))
-            count = c.fetchone()['count']
-            if count == 0:
-                for i in range(1, 6):
-                    c.execute(
-                        "INSERT INTO conversations (username, chat_id, channel, ai_enabled, needs_agent, visible_in_conversations, last_updated) "
-                        "VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id",
-                        (f"test_user_{i}", f"test_chat_{i}", "test", 1, 0, 0, datetime.now(timezone.utc).isoformat())
-                    )
-                    convo_id = c.fetchone()['id']
-                    c.execute(
-                        "INSERT INTO messages (convo_id, username, sender, message, timestamp) VALUES (%s, %s, %s, %s, %s)",
-                        (convo_id, f"test_user_{i}", "user", f"Test message {i}", datetime.now(timezone.utc).isoformat())
-                    )
-                conn.commit()
-                logger.info("✅ Added test conversations")
-            else:
-                logger.info("✅ Test conversations already exist, skipping insertion")
-            release_db_connection(conn)
-    except Exception as e:
-        logger.error(f"❌ Error adding test conversations: {e}")
-        raise
-
-# Initialize database and add test conversations
-init_db()
-add_test_conversations()
+def log_message(convo_id, username, message, sender, timestamp=None):
+    """
+    Log a message and return its ``(message_id, timestamp)``.
 
-@with_db_retry
-def log_message(convo_id, username, message, sender):
+    The message is appended to the conversation's recent-message buffer, and
+    its message cache generation is bumped once the row is written (for
+    write-behind, when the batch is flushed).
+    """
     try:
-        timestamp = datetime.now(timezone.utc).isoformat()
+        timestamp = timestamp or datetime.now(timezone.utc).isoformat()
         logger.info(f"Attempting to log message for convo_id {convo_id}: {message} (Sender: {sender}, Timestamp: {timestamp})")
-        with get_db_connection() as conn:
-            try:
-                c = conn.cursor()
-                c.execute("BEGIN")
-                c.execute(
-                    "INSERT INTO messages (convo_id, username, message, sender, timestamp) "
-                    "VALUES (%s, %s, %s, %s, %s) RETURNING id",
-                    (convo_id, username, message, sender, timestamp)
-                )
-                message_id = c.fetchone()['id']
-                c.execute("COMMIT")
-                logger.info(f"✅ Logged message for convo_id {convo_id}, message_id {message_id}: {message} (Sender: {sender})")
-                release_db_connection(conn)
-                return timestamp
-            except Exception as e:
-                c.execute("ROLLBACK")
-                logger.error(f"❌ Failed to log message for convo_id {convo_id}: {str(e)}")
-                raise
+        if message_writer is not None:
+            message_id, timestamp = message_writer.submit(convo_id, username, message, sender, timestamp)
+            recent_messages.append(convo_id, message_id, message, sender, timestamp)
+            logger.info(f"✅ Queued message for convo_id {convo_id}, message_id {message_id}: {message} (Sender: {sender})")
+            return message_id, timestamp
+        with db_lease(autocommit=True) as conn:
+            c = conn.cursor()
+            c.execute(
+                "INSERT INTO messages (convo_id, username, message, sender, timestamp) "
+                "VALUES (%s, %s, %s, %s, %s) RETURNING id",
+                (convo_id, username, message, sender, timestamp)
+            )
+            message_id = c.fetchone()['id']
+        recent_messages.append(convo_id, message_id, message, sender, timestamp)
+        bump_messages_generation(convo_id)
+        logger.info(f"✅ Logged message for convo_id {convo_id}, message_id {message_id}: {message} (Sender: {sender})")
+        return message_id, timestamp
     except Exception as e:
         logger.error(f"❌ Failed to log message for convo_id {convo_id}: {str(e)}")
         raise
@@ -673,12 +480,11 @@ class Agent(UserMixin):
 def load_user(agent_id):
     start_time = time.time()
     logger.info(f"Starting load_user for agent_id {agent_id}")
-    conn = None
     try:
-        conn = get_db_connection()
-        c = conn.cursor()
-        c.execute("SELECT id, username FROM agents WHERE id = %s", (agent_id,))
-        agent = c.fetchone()
+        with db_lease() as conn:
+            c = conn.cursor()
+            c.execute("SELECT id, username FROM agents WHERE id = %s", (agent_id,))
+            agent = c.fetchone()
         if agent:
             logger.info(f"Finished load_user for agent_id {agent_id} in {time.time() - start_time:.2f} seconds")
             return Agent(agent['id'], agent['username'])
@@ -687,8 +493,6 @@ def load_user(agent_id):
     except Exception as e:
         logger.error(f"❌ Error in load_user: {str(e)}")
         return None
-    finally:
-        release_db_connection(conn)
 
 @app.route("/login", methods=["GET", "POST"])
 @with_db_retry
@@ -726,7 +530,7 @@ def login():
             return jsonify({"message": "Missing username"}), 400
         
         logger.info(f"Attempting to log in user: {username}")
-        with get_db_connection() as conn:
+        with db_lease() as conn:
             c = conn.cursor()
             c.execute(
                 "SELECT id, username FROM agents WHERE username = %s",
@@ -739,11 +543,9 @@ def login():
                 login_user(agent_obj)
                 logger.info(f"✅ Login successful for agent: {agent['username']}")
                 next_page = request.args.get("next", "/conversations")
-                release_db_connection(conn)
                 logger.info(f"Finished /login (success) in {time.time() - start_time:.2f} seconds")
                 return jsonify({"message": "Login successful", "agent": agent['username'], "redirect": next_page})
             logger.error("❌ Invalid username in /login request")
-            release_db_connection(conn)
             logger.info(f"Finished /login (failed) in {time.time() - start_time:.2f} seconds")
             return jsonify({"message": "Invalid username"}), 401
     except Exception as e:
@@ -780,6 +582,49 @@ def check_auth():
         logger.error(f"❌ Error in /check-auth: {e}")
         return jsonify({"error": "Failed to check authentication"}), 500
 
+@app.route("/db-pool-stats", methods=["GET"])
+@login_required
+def db_pool_stats():
+    try:
+        stats = db_pool.stats()
+        if message_writer is not None:
+            stats["message_writer"] = message_writer.stats()
+        stats["conversation_state"] = conversation_state.stats()
+        stats["invalidation_bus"] = invalidation_bus.stats()
+        stats["settings"] = settings_service.stats()
+        stats["dashboard_cache"] = dashboard_cache.stats()
+        stats["calendar_pool"] = calendar_pool.stats()
+        stats["async_runtime"] = async_runtime.stats()
+        stats["openai_governor"] = dict(
+            openai_governor.stats(), cluster=summarize_governor_stats(redis_client.hgetall(GOVERNOR_STATS_KEY))
+        )
+        return jsonify(stats)
+    except Exception as e:
+        logger.error(f"❌ Error in /db-pool-stats: {e}")
+        return jsonify({"error": "Failed to fetch pool stats"}), 500
+
+@app.route("/llm-cache-stats", methods=["GET"])
+@login_required
+def llm_cache_stats():
+    try:
+        stats = summarize_stats(redis_client.hgetall(LLM_CACHE_STATS_KEY))
+        faq_stats = redis_client.hgetall(FAQ_STATS_KEY)
+        served = int(faq_stats.get("served", 0))
+        deferred = int(faq_stats.get("deferred", 0))
+        contextual = int(faq_stats.get("contextual", 0))
+        total = served + deferred + contextual
+        stats["local_faq"] = {
+            "pairs": len(faq_engine.pairs),
+            "served": served,
+            "deferred": deferred,
+            "contextual": contextual,
+            "served_rate": round(served / total, 3) if total else None,
+        }
+        return jsonify(stats)
+    except Exception as e:
+        logger.error(f"❌ Error in /llm-cache-stats: {e}")
+        return jsonify({"error": "Failed to fetch LLM cache stats"}), 500
+
 @app.route("/settings", methods=["GET", "POST"])
 @login_required
 def settings():
@@ -787,13 +632,9 @@ def settings():
     logger.info("Starting /settings endpoint")
     try:
         if request.method == "GET":
-            with get_db_connection() as conn:
-                c = conn.cursor()
-                c.execute("SELECT key, value, last_updated FROM settings")
-                settings = {row['key']: {'value': row['value'], 'last_updated': row['last_updated']} for row in c.fetchall()}
-                release_db_connection(conn)
-                logger.info(f"Finished /settings GET in {time.time() - start_time:.2f} seconds")
-                return jsonify({key: val['value'] for key, val in settings.items()})
+            settings = settings_service.snapshot()
+            logger.info(f"Finished /settings GET in {time.time() - start_time:.2f} seconds")
+            return jsonify({key: setting.value for key, setting in settings.items()})
 
         elif request.method == "POST":
             data = request.get_json()
@@ -804,22 +645,18 @@ def settings():
                 return jsonify({"error": "Missing key or value"}), 400
 
             current_timestamp = datetime.now(timezone.utc).isoformat()
-            with get_db_connection() as conn:
+            with db_lease() as conn:
                 c = conn.cursor()
-                c.execute("BEGIN")
                 c.execute(
                     "INSERT INTO settings (key, value, last_updated) VALUES (%s, %s, %s) "
                     "ON CONFLICT (key) DO UPDATE SET value = %s, last_updated = %s",
                     (key, value, current_timestamp, value, current_timestamp)
                 )
-                c.execute("COMMIT")
-                if key == "ai_enabled":
-                    settings_cache.pop("ai_enabled", None)
-                    logger.info("✅ Invalidated ai_enabled cache after update")
-                release_db_connection(conn)
-                socketio.emit("settings_updated", {key: value})
-                logger.info(f"Finished /settings POST in {time.time() - start_time:.2f} seconds")
-                return jsonify({"status": "success"})
+            settings_service.publish_change(key)
+            logger.info(f"✅ Published settings change for {key}")
+            socketio.emit("settings_updated", {key: value})
+            logger.info(f"Finished /settings POST in {time.time() - start_time:.2f} seconds")
+            return jsonify({"status": "success"})
     except Exception as e:
         logger.error(f"❌ Error in /settings: {str(e)}")
         return jsonify({"error": "Failed to update settings"}), 500
@@ -850,16 +687,30 @@ def index():
         logger.error(f"❌ Error rendering dashboard page: {e}")
         return jsonify({"error": "Failed to load dashboard page"}), 500
 
+# Summary columns maintained by the conversation_summary_on_message trigger
+CONVERSATION_SUMMARY_COLUMNS = "last_message, last_message_sender, last_message_at, message_count, unread_agent_count, waiting_since"
+
+def conversation_summary(row):
+    """Inbox preview fields for a conversations row selected with CONVERSATION_SUMMARY_COLUMNS."""
+    return {
+        "last_message": row["last_message"],
+        "last_message_sender": row["last_message_sender"],
+        "last_message_at": row["last_message_at"].isoformat() if row["last_message_at"] else None,
+        "message_count": row["message_count"],
+        "unread_count": row["unread_agent_count"],
+        "waiting_since": row["waiting_since"].isoformat() if row["waiting_since"] else None
+    }
+
 @app.route("/conversations", methods=["GET"])
 @login_required
 def get_conversations():
     start_time = time.time()
     logger.info("Starting /conversations endpoint")
     try:
-        with get_db_connection() as conn:
+        with db_lease() as conn:
             c = conn.cursor()
             c.execute(
-                "SELECT id, username, channel, assigned_agent, needs_agent, ai_enabled "
+                f"SELECT id, username, channel, assigned_agent, needs_agent, ai_enabled, {CONVERSATION_SUMMARY_COLUMNS} "
                 "FROM conversations "
                 "WHERE needs_agent = 1 "
                 "ORDER BY last_updated DESC"
@@ -871,17 +722,149 @@ def get_conversations():
                     "channel": row["channel"],
                     "assigned_agent": row["assigned_agent"],
                     "needs_agent": row["needs_agent"],
-                    "ai_enabled": row["ai_enabled"]
+                    "ai_enabled": row["ai_enabled"],
+                    **conversation_summary(row)
                 }
                 for row in c.fetchall()
             ]
-            release_db_connection(conn)
             logger.info(f"Finished /conversations in {time.time() - start_time:.2f} seconds")
             return jsonify(conversations)
     except Exception as e:
         logger.error(f"❌ Error in /conversations: {e}")
         return jsonify({"error": "Failed to fetch conversations"}), 500
 
+@app.route("/conversations/<convo_id>/read", methods=["POST"])
+@login_required
+def mark_conversation_read(convo_id):
+    start_time = time.time()
+    logger.info(f"Starting /conversations/{convo_id}/read endpoint")
+    try:
+        try:
+            convo_id = int(convo_id)
+            if convo_id <= 0:
+                raise ValueError("Conversation ID must be a positive integer")
+        except ValueError:
+            logger.error(f"❌ Invalid convo_id format: {convo_id}")
+            return jsonify({"error": "Invalid conversation ID format"}), 400
+
+        with db_lease(autocommit=True) as conn:
+            c = conn.cursor()
+            c.execute(
+                "UPDATE conversations SET unread_agent_count = 0 WHERE id = %s AND unread_agent_count <> 0",
+                (convo_id,)
+            )
+        logger.info(f"Finished /conversations/{convo_id}/read in {time.time() - start_time:.2f} seconds")
+        return jsonify({"status": "success"})
+    except Exception as e:
+        logger.error(f"❌ Error in /conversations/{convo_id}/read: {e}")
+        return jsonify({"error": "Failed to mark conversation as read"}), 500
+
+# Page sizes for /messages/<convo_id>
+MESSAGES_PAGE_SIZE = int(os.getenv("MESSAGES_PAGE_SIZE", 50))
+MESSAGES_MAX_PAGE_SIZE = 200
+
+def load_message_page(convo_id, limit, since=None, since_id=None, before=None, after=None, buffered=None):
+    """
+    Build one /messages/<convo_id> page, or return None if the conversation does
+    not exist. ``buffered`` holds the 'since' messages when the recent-message
+    buffer already covers them.
+    """
+    with db_lease() as conn:
+        c = conn.cursor()
+        # Check if the conversation exists and is visible
+        c.execute(
+            "SELECT username, visible_in_conversations FROM conversations WHERE id = %s",
+            (convo_id,)
+        )
+        convo = c.fetchone()
+        if not convo:
+            return None
+
+        if not convo["visible_in_conversations"]:
+            logger.info(f"Conversation {convo_id} is not visible")
+            return {"username": convo["username"], "messages": [], "has_more": False}
+
+        username = convo["username"]
+
+        # Cursor pages are range scans on idx_messages_convo_id_id and 'since'
+        # pages on idx_messages_convo_id_timestamp, in (timestamp, id) order so
+        # the last message's timestamp and id resume the page even when several
+        # messages share a timestamp. One extra row is fetched to tell whether
+        # another page exists.
+        if buffered is not None:
+            rows = buffered[:limit + 1]
+            logger.info(f"Serving messages for convo_id {convo_id} since {since} from the recent-message buffer")
+        elif since:
+            if since_id is not None:
+                c.execute(
+                    "SELECT id, message, sender, timestamp FROM messages "
+                    "WHERE convo_id = %s AND timestamp >= %s AND (timestamp, id) > (%s, %s) "
+                    "ORDER BY timestamp ASC, id ASC LIMIT %s",
+                    (convo_id, since, since, since_id, limit + 1)
+                )
+            else:
+                c.execute(
+                    "SELECT id, message, sender, timestamp FROM messages "
+                    "WHERE convo_id = %s AND timestamp > %s ORDER BY timestamp ASC, id ASC LIMIT %s",
+                    (convo_id, since, limit + 1)
+                )
+            logger.info(f"Fetching messages for convo_id {convo_id} since {since}")
+            rows = c.fetchall()
+        elif after is not None:
+            c.execute(
+                "SELECT id, message, sender, timestamp FROM messages "
+                "WHERE convo_id = %s AND id > %s ORDER BY id ASC LIMIT %s",
+                (convo_id, after, limit + 1)
+            )
+            logger.info(f"Fetching up to {limit} messages for convo_id {convo_id} after {after}")
+            rows = c.fetchall()
+        else:
+            if before is not None:
+                c.execute(
+                    "SELECT id, message, sender, timestamp FROM messages "
+                    "WHERE convo_id = %s AND id < %s ORDER BY id DESC LIMIT %s",
+                    (convo_id, before, limit + 1)
+                )
+                logger.info(f"Fetching up to {limit} messages for convo_id {convo_id} before {before}")
+            else:
+                c.execute(
+                    "SELECT id, message, sender, timestamp FROM messages "
+                    "WHERE convo_id = %s ORDER BY id DESC LIMIT %s",
+                    (convo_id, limit + 1)
+                )
+                logger.info(f"Fetching the latest {limit} messages for convo_id {convo_id}")
+            rows = c.fetchall()
+            # Pages are always returned oldest-first for rendering
+            has_more = len(rows) > limit
+            rows = list(reversed(rows[:limit]))
+
+    if since or after is not None:
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+    messages = [
+        {
+            "id": msg["id"],
+            "message": msg["message"],
+            "sender": msg["sender"],
+            "timestamp": msg["timestamp"] if isinstance(msg["timestamp"], str) else msg["timestamp"].isoformat()
+        }
+        for msg in rows
+    ]
+    logger.info(f"✅ Fetched {len(messages)} messages for convo_id {convo_id}")
+
+    # has_more refers to older messages for the default and 'before' pages and
+    # newer ones otherwise; 'since' pages continue from next_since and next_since_id
+    return {
+        "username": username,
+        "messages": messages,
+        "has_more": has_more,
+        "next_before": messages[0]["id"] if messages else before,
+        "next_after": messages[-1]["id"] if messages else after,
+        "next_since": messages[-1]["timestamp"] if messages else since,
+        "next_since_id": messages[-1]["id"] if messages else since_id
+    }
+
 @app.route("/messages/<convo_id>", methods=["GET"])
 @login_required
 def get_messages_for_conversation(convo_id):
@@ -904,77 +887,46 @@ def get_messages_for_conversation(convo_id):
                 logger.error(f"❌ Invalid 'since' timestamp format: {since}")
                 return jsonify({"error": "Invalid 'since' timestamp format"}), 400
 
-        # Check Redis cache first
-        cache_key = f"messages:{convo_id}:{since or 'full'}"
-        cached_messages = redis_get_sync(cache_key)
-        if cached_messages:
-            logger.info(f"Returning cached messages for convo_id {convo_id}")
-            cached_data = json.loads(cached_messages)
-            return jsonify({
-                "username": cached_data["username"],
-                "messages": cached_data["messages"]
-            })
-
-        with get_db_connection() as conn:
-            c = conn.cursor()
-            # Check if the conversation exists and is visible
-            c.execute(
-                "SELECT username, visible_in_conversations FROM conversations WHERE id = %s",
-                (convo_id,)
+        # Keyset pagination cursors are message ids; without one the newest page is
+        # returned. 'since_id' breaks timestamp ties for 'since' pages.
+        since_id = request.args.get("since_id", type=int)
+        before = request.args.get("before", type=int)
+        after = request.args.get("after", type=int)
+        limit = request.args.get("limit", MESSAGES_PAGE_SIZE, type=int)
+        invalid_cursor = any(
+            request.args.get(name) and value is None
+            for name, value in (("since_id", since_id), ("before", before), ("after", after))
+        )
+        if invalid_cursor or (since_id is not None and not since) or limit is None or not 1 <= limit <= MESSAGES_MAX_PAGE_SIZE:
+            logger.error(f"❌ Invalid pagination parameters for convo_id {convo_id}: {dict(request.args)}")
+            return jsonify({"error": "Invalid pagination parameters"}), 400
+        if sum((bool(since), before is not None, after is not None)) > 1:
+            logger.error(f"❌ Conflicting pagination parameters for convo_id {convo_id}: {dict(request.args)}")
+            return jsonify({"error": "Use only one of 'since', 'before' or 'after'"}), 400
+
+        # 'since' polling is served from the recent-message buffer when it covers
+        # the requested range. Other pages are cached per message generation, so
+        # a new message makes every waiting dashboard miss at once; the single
+        # flight cache lets one of them run the query. A missing conversation
+        # (None) is only cached for a second.
+        if since:
+            result = load_message_page(
+                convo_id, limit, since=since, since_id=since_id,
+                buffered=recent_messages.since(convo_id, since, since_id)
             )
-            convo = c.fetchone()
-            if not convo:
-                logger.error(f"❌ Conversation not found: {convo_id}")
-                release_db_connection(conn)
-                return jsonify({"error": "Conversation not found"}), 404
-
-            if not convo["visible_in_conversations"]:
-                logger.info(f"Conversation {convo_id} is not visible")
-                release_db_connection(conn)
-                return jsonify({"username": convo["username"], "messages": []})
-
-            username = convo["username"]
-
-            if since:
-                query = """
-                    SELECT message, sender, timestamp
-                    FROM messages
-                    WHERE convo_id = %s AND timestamp > %s
-                    ORDER BY timestamp ASC
-                """
-                c.execute(query, (convo_id, since))
-                logger.info(f"Fetching messages for convo_id {convo_id} since {since}")
-            else:
-                query = """
-                    SELECT message, sender, timestamp
-                    FROM messages
-                    WHERE convo_id = %s
-                    ORDER BY timestamp ASC
-                    LIMIT 50
-                """
-                c.execute(query, (convo_id,))
-                logger.info(f"Fetching up to 50 messages for convo_id {convo_id}")
-
-            messages = [
-                {
-                    "message": msg["message"],
-                    "sender": msg["sender"],
-                    "timestamp": msg["timestamp"] if isinstance(msg["timestamp"], str) else msg["timestamp"].isoformat()
-                }
-                for msg in c.fetchall()
-            ]
-            logger.info(f"✅ Fetched {len(messages)} messages for convo_id {convo_id}")
-
-            # Cache the result for 300 seconds (5 minutes)
-            cache_data = {"username": username, "messages": messages}
-            redis_setex_sync(cache_key, 300, json.dumps(cache_data))
-            release_db_connection(conn)
-
-            logger.info(f"Finished /messages/{convo_id} in {time.time() - start_time:.2f} seconds")
-            return jsonify({
-                "username": username,
-                "messages": messages
-            })
+        else:
+            generation = get_messages_generation(convo_id)
+            result = dashboard_cache.get_or_compute(
+                f"messages:{convo_id}:{generation}:{before or ''}:{after or ''}:{limit}",
+                lambda: load_message_page(convo_id, limit, before=before, after=after),
+                ttl=300
+            )
+        if result is None:
+            logger.error(f"❌ Conversation not found: {convo_id}")
+            return jsonify({"error": "Conversation not found"}), 404
+
+        logger.info(f"Finished /messages/{convo_id} in {time.time() - start_time:.2f} seconds")
+        return jsonify(result)
     except Exception as e:
         logger.error(f"❌ Error in /messages/{convo_id}: {str(e)}", exc_info=True)
         return jsonify({"error": "Failed to fetch messages"}), 500
@@ -999,15 +951,12 @@ def handoff():
             logger.error(f"❌ Invalid conversation_id format: {convo_id}")
             return jsonify({"error": "Invalid conversation ID format"}), 400
 
-        with get_db_connection() as conn:
-            c = conn.cursor()
-            c.execute("BEGIN")
-            c.execute(
-                "UPDATE conversations SET assigned_agent = %s, ai_enabled = %s, last_updated = %s WHERE id = %s",
-                (current_user.username, 0 if disable_ai else 1, datetime.now(timezone.utc).isoformat(), convo_id)
-            )
-            c.execute("COMMIT")
-            release_db_connection(conn)
+        update_conversation(
+            convo_id,
+            assigned_agent=current_user.username,
+            ai_enabled=0 if disable_ai else 1,
+            last_updated=datetime.now(timezone.utc).isoformat()
+        )
         socketio.emit("refresh_conversations", {"conversation_id": convo_id})
         logger.info(f"Finished /handoff in {time.time() - start_time:.2f} seconds")
         return jsonify({"message": "Conversation assigned successfully"})
@@ -1036,15 +985,13 @@ def handback_to_ai():
             logger.error(f"❌ Invalid conversation_id format: {convo_id}")
             return jsonify({"error": "Invalid conversation ID format"}), 400
 
-        with get_db_connection() as conn:
-            c = conn.cursor()
-            c.execute("BEGIN")
-            c.execute(
-                "UPDATE conversations SET assigned_agent = NULL, ai_enabled = %s, needs_agent = %s, last_updated = %s WHERE id = %s",
-                (1 if enable_ai else 0, 0 if clear_needs_agent else 1, datetime.now(timezone.utc).isoformat(), convo_id)
-            )
-            c.execute("COMMIT")
-            release_db_connection(conn)
+        update_conversation(
+            convo_id,
+            assigned_agent=None,
+            ai_enabled=1 if enable_ai else 0,
+            needs_agent=0 if clear_needs_agent else 1,
+            last_updated=datetime.now(timezone.utc).isoformat()
+        )
         socketio.emit("refresh_conversations", {"conversation_id": convo_id})
         logger.info(f"Finished /handback-to-ai in {time.time() - start_time:.2f} seconds")
         return jsonify({"message": "Conversation handed back to AI"})
@@ -1070,58 +1017,53 @@ def check_visibility():
             logger.error(f"❌ Invalid conversation_id format: {convo_id}")
             return jsonify({"error": "Invalid conversation ID format"}), 400
 
-        with get_db_connection() as conn:
-            c = conn.cursor()
-            c.execute(
-                "SELECT needs_agent FROM conversations WHERE id = %s",
-                (convo_id,)
-            )
-            result = c.fetchone()
-            release_db_connection(conn)
-            logger.info(f"Finished /check-visibility in {time.time() - start_time:.2f} seconds")
-            return jsonify({"visible": bool(result["needs_agent"])})
+        result = conversation_state.get(convo_id)
+        logger.info(f"Finished /check-visibility in {time.time() - start_time:.2f} seconds")
+        return jsonify({"visible": bool(result["needs_agent"])})
     except Exception as e:
         logger.error(f"❌ Error in /check-visibility: {e}")
         return jsonify({"error": "Failed to check visibility"}), 500
 
+def load_whatsapp_conversations():
+    with db_lease() as conn:
+        c = conn.cursor()
+        logger.info("Executing query to fetch conversations")
+        c.execute(
+            f"SELECT id, chat_id, username, last_updated, {CONVERSATION_SUMMARY_COLUMNS} "
+            "FROM conversations "
+            "WHERE channel = 'whatsapp' "
+            "ORDER BY last_updated DESC"
+        )
+        conversations = c.fetchall()
+    logger.info(f"Found {len(conversations)} WhatsApp conversations")
+    return [
+        {
+            "convo_id": convo["id"],
+            "chat_id": convo["chat_id"],
+            "username": convo["username"],
+            "last_updated": convo["last_updated"].isoformat() if convo["last_updated"] else None,
+            **conversation_summary(convo)
+        }
+        for convo in conversations
+    ]
+
 @app.route("/all-whatsapp-messages", methods=["GET"])
 @login_required
 def get_all_whatsapp_messages():
     start_time = time.time()
     logger.info("Starting /all-whatsapp-messages endpoint")
     try:
-        # Check Redis cache first
-        cache_key = "all_whatsapp_conversations"
-        cached_conversations = redis_get_sync(cache_key)
-        if cached_conversations:
-            logger.info("Returning cached WhatsApp conversations")
-            return jsonify({"conversations": json.loads(cached_conversations)})
-
-        with get_db_connection() as conn:
-            c = conn.cursor()
-            logger.info("Executing query to fetch conversations")
-            c.execute(
-                "SELECT id, chat_id, username, last_updated "
-                "FROM conversations "
-                "WHERE channel = 'whatsapp' "
-                "ORDER BY last_updated DESC"
-            )
-            conversations = c.fetchall()
-            logger.info(f"Found {len(conversations)} conversations: {[(c['id'], c['chat_id']) for c in conversations]}")
-            result = [
-                {
-                    "convo_id": convo["id"],
-                    "chat_id": convo["chat_id"],
-                    "username": convo["username"],
-                    "last_updated": convo["last_updated"]
-                }
-                for convo in conversations
-            ]
-            # Cache the result for 10 seconds
-            redis_setex_sync(cache_key, 10, json.dumps(result))
-            release_db_connection(conn)
-            logger.info(f"Finished /all-whatsapp-messages in {time.time() - start_time:.2f} seconds")
-            return jsonify({"conversations": result})
+        # Fresh for 10 seconds, then served stale for up to 30 more while one
+        # caller refreshes it; refreshed early during the last 2 seconds.
+        result = dashboard_cache.get_or_compute(
+            "all_whatsapp_conversations",
+            load_whatsapp_conversations,
+            ttl=10,
+            stale_ttl=30,
+            refresh_ahead=0.2
+        )
+        logger.info(f"Finished /all-whatsapp-messages in {time.time() - start_time:.2f} seconds")
+        return jsonify({"conversations": result})
     except Exception as e:
         logger.error(f"Error fetching all WhatsApp messages: {str(e)}", exc_info=True)
         return jsonify({"error": "Failed to fetch conversations"}), 500
@@ -1131,69 +1073,86 @@ def send_whatsapp_message(phone_number, text):
     logger.info(f"Offloading WhatsApp message to Celery task for {phone_number}")
     return send_whatsapp_message_task.delay(phone_number, text)
 
+def fetch_booked_nights(service, window):
+    """Booked nights of one ``(start, end)`` window from a live range query, or None if Google Calendar keeps failing."""
+    start, end = window
+    max_retries = 3
+    for attempt in range(max_retries):
+        try:
+            events = list_calendar_events(service, start, end)
+            return booked_nights(events, start, end)
+        except HttpError as e:
+            logger.error(f"❌ Google Calendar API error (Attempt {attempt + 1}/{max_retries}): {str(e)}")
+        except Exception as e:
+            logger.error(f"❌ Unexpected error in fetch_booked_nights (Attempt {attempt + 1}/{max_retries}): {str(e)}")
+        if attempt < max_retries - 1:
+            time.sleep(2 ** attempt)
+    return None
+
+def format_stay(start, end):
+    return f"{start.strftime('%B %d, %Y')} to {(end - timedelta(days=1)).strftime('%B %d, %Y')}"
+
 def check_availability(check_in, check_out):
+    """
+    Check whether every night from ``check_in`` to ``check_out`` is free and,
+    if not, suggest the nearest free stays of the same length.
+
+    The stay and the alternative search range around it are answered from the
+    calendar mirror kept by the sync task while it is fresh. Otherwise the
+    range is split into windows that are queried live in parallel, each on its
+    own pooled Calendar client, so the lookup costs about one round trip.
+    """
     start_time = time.time()
     logger.info(f"Starting check_availability from {check_in} to {check_out}")
-    max_retries = 3
-    current_date = check_in
-    while current_date < check_out:
-        start_time_dt = current_date.replace(hour=0, minute=0, second=0, microsecond=0).isoformat() + 'Z'
-        end_time_dt = (current_date + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0).isoformat() + 'Z'
-
-        for attempt in range(max_retries):
-            try:
-                events_result = service.events().list(
-                    calendarId='a33289c61cf358216690e7cc203d116cec4c44075788fab3f2b200f5bbcd89cc@group.calendar.google.com',
-                    timeMin=start_time_dt,
-                    timeMax=end_time_dt,
-                    singleEvents=True,
-                    orderBy='startTime'
-                ).execute()
-                events = events_result.get('items', [])
-
-                if any(event.get('summary') == "Fully Booked" for event in events):
-                    result = f"Sorry, the dates from {check_in.strftime('%B %d, %Y')} to {(check_out - timedelta(days=1)).strftime('%B %d, %Y')} are not available. We are fully booked on {current_date.strftime('%B %d, %Y')}."
-                    logger.info(f"Finished check_availability (not available) in {time.time() - start_time:.2f} seconds")
-                    return result
-                break
-            except HttpError as e:
-                logger.error(f"❌ Google Calendar API error (Attempt {attempt + 1}/{max_retries}): {str(e)}")
-                if attempt < max_retries - 1:
-                    time.sleep(2 ** attempt)
-                    continue
-                return "Sorry, I’m having trouble checking availability right now. I’ll connect you with a team member to assist you."
-            except Exception as e:
-                logger.error(f"❌ Unexpected error in check_availability (Attempt {attempt + 1}/{max_retries}): {str(e)}")
-                if attempt < max_retries - 1:
-                    time.sleep(2 ** attempt)
-                    continue
-                return "Sorry, I’m having trouble checking availability right now. I’ll connect you with a team member to assist you."
-        current_date += timedelta(days=1)
+    windows = search_windows(check_in, check_out)
+    source = "local"
+    complete = True
+    try:
+        with db_lease() as conn:
+            booked = local_booked_nights(conn, windows[0][0], windows[-1][1])
+    except Exception as e:
+        logger.error(f"❌ Error reading local calendar mirror: {str(e)}")
+        booked = None
+    if booked is None:
+        source = "live"
+        try:
+            results = calendar_pool.map(fetch_booked_nights, windows)
+        except Exception as e:
+            logger.error(f"❌ Error querying Google Calendar: {str(e)}")
+            results = [None] * len(windows)
+        # windows[1] is the requested stay; the others only feed the alternatives
+        if results[1] is None:
+            return "Sorry, I’m having trouble checking availability right now. I’ll connect you with a team member to assist you."
+        complete = None not in results
+        booked = sorted(night for nights in results if nights for night in nights)
+
+    stay_booked = [night for night in booked if check_in.date() <= night < check_out.date()]
+    if stay_booked:
+        result = f"Sorry, the dates from {format_stay(check_in, check_out)} are not available. We are fully booked on {stay_booked[0].strftime('%B %d, %Y')}."
+        alternatives = alternative_stays(booked, check_in, check_out) if complete else []
+        if alternatives:
+            result += f" The nearest available dates are {', or '.join(format_stay(start, end) for start, end in alternatives)}."
+        logger.info(f"Finished check_availability (not available, {len(alternatives)} alternatives, {source}) in {time.time() - start_time:.2f} seconds")
+        return result
 
-    result = f"Yes, the dates from {check_in.strftime('%B %d, %Y')} to {(check_out - timedelta(days=1)).strftime('%B %d, %Y')} are available."
-    logger.info(f"Finished check_availability (available) in {time.time() - start_time:.2f} seconds")
+    result = f"Yes, the dates from {format_stay(check_in, check_out)} are available."
+    logger.info(f"Finished check_availability (available, {source}) in {time.time() - start_time:.2f} seconds")
     return result
 
-# Semaphore to limit concurrent OpenAI API requests
-OPENAI_CONCURRENT_LIMIT = 20
-openai_semaphore = asyncio.Semaphore(OPENAI_CONCURRENT_LIMIT)
+# Cluster-wide OpenAI request, token and concurrency limits shared through Redis
+openai_governor = OpenAIGovernor(async_redis_client)
+# Upper bound on one ai_respond call, including tenacity retries
+AI_RESPOND_TIMEOUT = float(os.getenv("AI_RESPOND_TIMEOUT", 120))
 
 def detect_language(message, convo_id):
     start_time = time.time()
     logger.info(f"Starting detect_language for convo_id {convo_id}")
     try:
         # First, check if the conversation has a stored language
-        with get_db_connection() as conn:
-            c = conn.cursor()
-            c.execute(
-                "SELECT language FROM conversations WHERE id = %s",
-                (convo_id,)
-            )
-            result = c.fetchone()
-            if result and result['language']:
-                logger.info(f"Using stored language for convo_id {convo_id}: {result['language']}")
-                release_db_connection(conn)
-                return result['language']
+        result = conversation_state.get(convo_id)
+        if result and result['language']:
+            logger.info(f"Using stored language for convo_id {convo_id}: {result['language']}")
+            return result['language']
 
         # If no stored language, detect the language of the current message
         detected_lang = detect(message)
@@ -1201,14 +1160,15 @@ def detect_language(message, convo_id):
 
         # If detection confidence is low, check conversation history
         if detected_lang not in ['en', 'es']:
-            with get_db_connection() as conn:
+            with db_lease() as conn:
                 c = conn.cursor()
                 c.execute(
-                    "SELECT message FROM messages WHERE convo_id = %s ORDER BY timestamp DESC LIMIT 5",
+                    "SELECT message FROM messages "
+                    "WHERE convo_id = %s AND timestamp >= now() - interval '30 days' "
+                    "ORDER BY timestamp DESC LIMIT 5",
                     (convo_id,)
                 )
                 messages = c.fetchall()
-                release_db_connection(conn)
                 for msg in messages:
                     try:
                         hist_lang = detect(msg['message'])
@@ -1225,15 +1185,8 @@ def detect_language(message, convo_id):
             logger.info(f"Defaulting to English for convo_id {convo_id}")
 
         # Store the detected language in the conversations table
-        with get_db_connection() as conn:
-            c = conn.cursor()
-            c.execute(
-                "UPDATE conversations SET language = %s WHERE id = %s",
-                (detected_lang, convo_id)
-            )
-            conn.commit()
-            release_db_connection(conn)
-            logger.info(f"Stored detected language for convo_id {convo_id}: {detected_lang}")
+        update_conversation(convo_id, language=detected_lang)
+        logger.info(f"Stored detected language for convo_id {convo_id}: {detected_lang}")
 
         logger.info(f"Finished detect_language in {time.time() - start_time:.2f} seconds")
         return detected_lang
@@ -1241,27 +1194,23 @@ def detect_language(message, convo_id):
         logger.error(f"Error in detect_language for convo_id {convo_id}: {str(e)}")
         return 'en'
 
-# Update the ai_respond function with tenacity for retries
+# ai_respond runs on the shared async runtime loop, so every blocking call it
+# makes (database, sync Redis, Calendar, Socket.IO) goes through
+# asyncio.to_thread; a blocking call on the loop would stall every other
+# message in flight in the process.
 @retry(
     stop=stop_after_attempt(3),
     wait=wait_exponential(multiplier=1, min=4, max=10),
-    retry=retry_if_exception_type((RateLimitError, asyncio.TimeoutError))
+    retry=retry_if_exception_type(asyncio.TimeoutError)
 )
 async def ai_respond(message, convo_id):
     start_time = time.time()
     logger.info(f"Starting ai_respond for convo_id {convo_id}: {message}")
     try:
         # Detect language
-        language = detect_language(message, convo_id)
+        language = await asyncio.to_thread(detect_language, message, convo_id)
         is_spanish = (language == "es")
 
-        # Check cache for common messages
-        cache_key = f"ai_response:{message}:{convo_id}"
-        cached_response = await async_redis_client.get(cache_key)
-        if cached_response:
-            logger.info(f"Returning cached response for message: {message}")
-            return cached_response
-
         # Enhanced date parsing logic
         date_match = re.search(
             r'(?:are rooms available|availability|do you have any rooms|rooms available|what about|next week|this|'
@@ -1305,7 +1254,6 @@ async def ai_respond(message, convo_id):
                 else:
                     result = "I’m not sure which day you meant by 'this'. Can you specify, like 'this Friday' or 'este viernes'?" if not is_spanish else \
                              "No estoy seguro de qué día te refieres con 'este'. ¿Puedes especificar, como 'este viernes' o 'this Friday'?"
-                    await async_redis_client.setex(cache_key, 3600, result)
                     logger.info(f"Finished ai_respond (ambiguous 'this' date) in {time.time() - start_time:.2f} seconds")
                     return result
             else:
@@ -1322,7 +1270,6 @@ async def ai_respond(message, convo_id):
                 else:
                     result = "Sorry, I couldn’t understand the dates. Please use a format like 'March 20' or '20 de marzo'." if not is_spanish else \
                            "Lo siento, no entendí las fechas. Por favor, usa un formato como '20 de marzo' o 'March 20'."
-                    await async_redis_client.setex(cache_key, 3600, result)
                     logger.info(f"Finished ai_respond (date error) in {time.time() - start_time:.2f} seconds")
                     return result
 
@@ -1343,30 +1290,19 @@ async def ai_respond(message, convo_id):
             if check_out <= check_in:
                 result = "The check-out date must be after the check-in date. Please provide a valid range." if not is_spanish else \
                        "La fecha de salida debe ser posterior a la fecha de entrada. Por favor, proporciona un rango válido."
-                await async_redis_client.setex(cache_key, 3600, result)
                 logger.info(f"Finished ai_respond (invalid date range) in {time.time() - start_time:.2f} seconds")
                 return result
 
-            availability = check_availability(check_in, check_out)
+            availability = await asyncio.to_thread(check_availability, check_in, check_out)
             if "are available" in availability.lower():
                 booking_intent = f"{check_in.strftime('%Y-%m-%d')} to {check_out.strftime('%Y-%m-%d')}"
-                with get_db_connection() as conn:
-                    try:
-                        c = conn.cursor()
-                        c.execute("BEGIN")
-                        c.execute(
-                            "UPDATE conversations SET booking_intent = %s WHERE id = %s",
-                            (booking_intent, convo_id)
-                        )
-                        c.execute("COMMIT")
-                    finally:
-                        release_db_connection(conn)
+                await asyncio.to_thread(update_conversation, convo_id, booking_intent=booking_intent)
                 response = f"{availability} Would you like to proceed with the booking? I’ll need to connect you with a team member to finalize it." if not is_spanish else \
                            f"{availability.replace('are available', 'están disponibles')} ¿Te gustaría proceder con la reserva? Necesitaré conectarte con un miembro del equipo para finalizarla."
             else:
                 response = availability if not is_spanish else \
-                           availability.replace("are not available", "no están disponibles").replace("fully booked", "completamente reservado")
-            await async_redis_client.setex(cache_key, 3600, response)
+                           availability.replace("are not available", "no están disponibles").replace("fully booked", "completamente reservado") \
+                               .replace("The nearest available dates are", "Las fechas disponibles más cercanas son").replace(", or ", ", o ")
             logger.info(f"Finished ai_respond (availability check) in {time.time() - start_time:.2f} seconds")
             return response
 
@@ -1377,29 +1313,15 @@ async def ai_respond(message, convo_id):
         )
         if booking_match or "book" in message.lower() or "booking" in message.lower() or "reservar" in message.lower():
             # Check if we have partial booking info
-            with get_db_connection() as conn:
-                c = conn.cursor()
-                c.execute(
-                    "SELECT booking_intent FROM conversations WHERE id = %s",
-                    (convo_id,)
-                )
-                result = c.fetchone()
-                booking_intent = result['booking_intent'] if result else None
-                release_db_connection(conn)
+            result = await asyncio.to_thread(conversation_state.get, convo_id)
+            booking_intent = result['booking_intent'] if result else None
 
             if booking_match:
                 _, num_guests = booking_match.groups()
                 if num_guests:
                     # Store the number of guests in booking_intent
                     booking_intent = f"guests:{num_guests}" if not booking_intent else f"{booking_intent},guests:{num_guests}"
-                    with get_db_connection() as conn:
-                        c = conn.cursor()
-                        c.execute(
-                            "UPDATE conversations SET booking_intent = %s WHERE id = %s",
-                            (booking_intent, convo_id)
-                        )
-                        conn.commit()
-                        release_db_connection(conn)
+                    await asyncio.to_thread(update_conversation, convo_id, booking_intent=booking_intent)
 
             if not booking_intent or "guests" not in booking_intent or "to" not in booking_intent:
                 missing_info = []
@@ -1411,163 +1333,196 @@ async def ai_respond(message, convo_id):
 
                 result = f"I’d love to help with your booking! Can you tell me {', '.join(missing_info)}?" if not is_spanish else \
                          f"¡Me encantaría ayudarte con tu reserva! ¿Me puedes decir {', '.join(missing_info)}?"
-                await async_redis_client.setex(cache_key, 3600, result)
                 logger.info(f"Finished ai_respond (partial booking info) in {time.time() - start_time:.2f} seconds")
                 return result
 
-            with get_db_connection() as conn:
-                try:
-                    c = conn.cursor()
-                    c.execute("BEGIN")
-                    c.execute(
-                        "UPDATE conversations SET needs_agent = 1, last_updated = %s WHERE id = %s",
-                        (datetime.now(timezone.utc).isoformat(), convo_id)
-                    )
-                    c.execute("COMMIT")
-                finally:
-                    release_db_connection(conn)
-            socketio.emit("refresh_conversations", {"conversation_id": convo_id})
+            await asyncio.to_thread(update_conversation, convo_id, needs_agent=1, last_updated=datetime.now(timezone.utc).isoformat())
+            await asyncio.to_thread(socketio.emit, "refresh_conversations", {"conversation_id": convo_id})
             result = "I have all the details for your booking! I’ll connect you with a team member to finalize it for you." if not is_spanish else \
                    "¡Tengo todos los detalles para tu reserva! Te conectaré con un miembro del equipo para que la finalice por ti."
-            await async_redis_client.setex(cache_key, 3600, result)
             logger.info(f"Finished ai_respond (booking intent, needs agent) in {time.time() - start_time:.2f} seconds")
             return result
 
-        # Fetch conversation history from cache or database
-        history_cache_key = f"conversation_history:{convo_id}"
-        cached_history = await async_redis_client.get(history_cache_key)
-        if cached_history:
-            messages = json.loads(cached_history)
-            logger.info(f"Retrieved conversation history from cache for convo_id {convo_id}")
-        else:
-            with get_db_connection() as conn:
-                try:
-                    c = conn.cursor()
-                    c.execute(
-                        "SELECT message, sender, timestamp FROM messages WHERE convo_id = %s ORDER BY timestamp DESC LIMIT 10",
-                        (convo_id,)
-                    )
-                    messages = c.fetchall()
-                    await async_redis_client.setex(history_cache_key, 300, json.dumps([dict(msg) for msg in messages]))
-                    logger.info(f"Cached conversation history for convo_id {convo_id}")
-                finally:
-                    release_db_connection(conn)
-
-        # Build conversation history
+        # Standalone questions that closely match a reference Q&A pair are
+        # answered locally, skipping the history lookup and the OpenAI call.
+        # Short messages without a reasonable match ("yes please") depend on
+        # the conversation, so they are answered and cached with its history.
+        normalized_message = normalize_message(message)
+        cache_scope = classify_scope(normalized_message)
+        if cache_scope == SCOPE_FAQ:
+            faq_answer, confidence = faq_engine.answer(message, language)
+            if not faq_answer and confidence < faq_engine.shared_threshold:
+                cache_scope = SCOPE_CONTEXTUAL
+            try:
+                await async_redis_client.hincrby(
+                    FAQ_STATS_KEY, "served" if faq_answer else "deferred" if cache_scope == SCOPE_FAQ else "contextual", 1
+                )
+            except Exception as e:
+                logger.error(f"❌ Error updating FAQ engine stats: {str(e)}")
+            if faq_answer:
+                logger.info(f"Finished ai_respond (local FAQ answer, confidence={confidence}) in {time.time() - start_time:.2f} seconds")
+                return faq_answer
+
+        # Recent history, oldest first, from the conversation's ring buffer. The
+        # current message has already been logged, so it is dropped here and
+        # appended as the final user turn below. A coalesced WhatsApp turn is
+        # several logged messages joined by newlines; all of them are dropped.
+        buffered = await asyncio.to_thread(recent_messages.recent, convo_id)
+        pending = message
+        while buffered and buffered[-1]['sender'] == "user" and pending and pending.endswith(buffered[-1]['message']):
+            pending = pending[:-len(buffered[-1]['message'])].rstrip("\n")
+            buffered = buffered[:-1]
+
+        # History newer than the rolling summary, trimmed to the token budget.
+        # Turns that no longer fit are folded into the summary in the background.
+        state = await asyncio.to_thread(conversation_state.get, convo_id) or {}
+        history_summary = state.get('history_summary')
+        summary_through_id = state.get('history_summary_through_id') or 0
+        messages, overflow = fit_history(
+            [msg for msg in buffered if msg['id'] > summary_through_id], history_summary
+        )
+        if overflow:
+            await asyncio.to_thread(schedule_history_summary, convo_id, overflow[-1]['id'])
+
+        # Standalone questions are answered without history so the reply can be
+        # shared across conversations; everything else gets the full history.
+        # The system prompt carries only the reference sections retrieved for
+        # this turn (and, for contextual messages, the last few guest turns).
+        recent_user_turns = [msg['message'] for msg in messages if msg['sender'] == "user"][-2:]
+        system_prompt = prompt_builder.build(message, recent_user_turns if cache_scope != SCOPE_FAQ else ())
         conversation_history = [
-            {"role": "system", "content": TRAINING_DOCUMENT}
+            {"role": "system", "content": system_prompt}
         ]
-        for msg in messages:
-            message_text, sender, timestamp = msg['message'], msg['sender'], msg['timestamp']
-            role = "user" if sender == "user" else "assistant"
-            conversation_history.append({"role": role, "content": message_text})
+        if cache_scope == SCOPE_FAQ:
+            if any(msg['sender'] != "user" for msg in buffered) or history_summary:
+                conversation_history.append({"role": "system", "content": "This is a follow-up message in an ongoing conversation. Do not greet the guest again."})
+        else:
+            if history_summary:
+                conversation_history.append(summary_message(history_summary))
+            for msg in messages:
+                message_text, sender, timestamp = msg['message'], msg['sender'], msg['timestamp']
+                role = "user" if sender == "user" else "assistant"
+                conversation_history.append({"role": role, "content": message_text})
         conversation_history.append({"role": "user", "content": message})
 
-        # Call OpenAI API asynchronously with rate limiting
-        async with openai_semaphore:
+        cache_context = context_hash(OPENAI_MODEL, conversation_history[:-1])
+        cached_reply = await llm_cache.get(cache_scope, language, normalized_message, cache_context)
+        if cached_reply:
+            logger.info(f"Finished ai_respond (LLM cache hit, scope={cache_scope}) in {time.time() - start_time:.2f} seconds")
+            return cached_reply
+
+        # Call OpenAI API asynchronously with cluster-wide rate limiting
+        estimated_tokens = sum(estimate_tokens(msg["content"]) for msg in conversation_history) + 300
+        async with openai_governor.slot(estimated_tokens) as slot:
             response = await openai_client.chat.completions.create(
-                model="gpt-4o-mini",
+                model=OPENAI_MODEL,
                 messages=conversation_history,
                 max_tokens=300,
                 temperature=0.7
             )
+            if response.usage:
+                slot.used_tokens = response.usage.total_tokens
             ai_reply = response.choices[0].message.content.strip()
             logger.info(f"✅ AI reply: {ai_reply}")
+            if response.usage:
+                logger.info(
+                    f"OpenAI usage for convo_id {convo_id}: prompt_tokens={response.usage.prompt_tokens}, "
+                    f"completion_tokens={response.usage.completion_tokens}, total_tokens={response.usage.total_tokens}, "
+                    f"system_prompt_chars={len(system_prompt)}, queue_wait={slot.queue_wait:.2f}s"
+                )
             if "sorry" in ai_reply.lower() or "lo siento" in ai_reply.lower():
-                with get_db_connection() as conn:
-                    try:
-                        c = conn.cursor()
-                        c.execute("BEGIN")
-                        c.execute(
-                            "UPDATE conversations SET needs_agent = 1, last_updated = %s WHERE id = %s",
-                            (datetime.now(timezone.utc).isoformat(), convo_id)
-                        )
-                        c.execute("COMMIT")
-                    finally:
-                        release_db_connection(conn)
-                socketio.emit("refresh_conversations", {"conversation_id": convo_id})
-                await async_redis_client.setex(cache_key, 3600, ai_reply)
+                await asyncio.to_thread(update_conversation, convo_id, needs_agent=1, last_updated=datetime.now(timezone.utc).isoformat())
+                await asyncio.to_thread(socketio.emit, "refresh_conversations", {"conversation_id": convo_id})
                 logger.info(f"Finished ai_respond (AI sorry, needs agent) in {time.time() - start_time:.2f} seconds")
                 return ai_reply
-            await async_redis_client.setex(cache_key, 3600, ai_reply)
+            await llm_cache.set(cache_scope, language, normalized_message, cache_context, ai_reply)
             logger.info(f"Finished ai_respond (AI success) in {time.time() - start_time:.2f} seconds")
             return ai_reply
 
-    except RateLimitError as e:
-        logger.error(f"❌ OpenAI RateLimitError: {str(e)}")
-        raise
+    except (OpenAIDegraded, RateLimitError) as e:
+        # Answer at once instead of backing off inside a worker slot
+        if isinstance(e, RateLimitError):
+            logger.error(f"❌ OpenAI RateLimitError: {str(e)}")
+            retry_after = e.response.headers.get("retry-after", "")
+            await openai_governor.cool_down(float(retry_after) if retry_after.replace(".", "", 1).isdigit() else 10.0)
+        else:
+            logger.warning(f"⚠️ OpenAI degraded for convo_id {convo_id}: {str(e)}")
+        # Reset handoff_notified so the guest's next message gets the one-time handoff notice
+        await asyncio.to_thread(update_conversation, convo_id, needs_agent=1, handoff_notified=0, last_updated=datetime.now(timezone.utc).isoformat())
+        await asyncio.to_thread(socketio.emit, "refresh_conversations", {"conversation_id": convo_id})
+        result = "I’m sorry, we’re getting a lot of messages right now. I’ll connect you with a team member to assist you." if not is_spanish else \
+               "Lo siento, estamos recibiendo muchos mensajes en este momento. Te conectaré con un miembro del equipo para que te ayude."
+        logger.info(f"Finished ai_respond (OpenAI degraded, needs agent) in {time.time() - start_time:.2f} seconds")
+        return result
     except asyncio.TimeoutError as e:
         logger.error(f"❌ OpenAI API request timed out: {str(e)}")
         raise
     except APIError as e:
         logger.error(f"❌ OpenAI APIError: {str(e)}")
-        with get_db_connection() as conn:
-            try:
-                c = conn.cursor()
-                c.execute("BEGIN")
-                c.execute(
-                    "UPDATE conversations SET needs_agent = 1, last_updated = %s WHERE id = %s",
-                    (datetime.now(timezone.utc).isoformat(), convo_id)
-                )
-                c.execute("COMMIT")
-            finally:
-                release_db_connection(conn)
-        socketio.emit("refresh_conversations", {"conversation_id": convo_id})
+        await asyncio.to_thread(update_conversation, convo_id, needs_agent=1, last_updated=datetime.now(timezone.utc).isoformat())
+        await asyncio.to_thread(socketio.emit, "refresh_conversations", {"conversation_id": convo_id})
         result = "I’m sorry, I’m having trouble processing your request right now due to an API error. I’ll connect you with a team member to assist you." if not is_spanish else \
                "Lo siento, tengo problemas para procesar tu solicitud ahora mismo debido a un error de API. Te conectaré con un miembro del equipo para que te ayude."
-        await async_redis_client.setex(cache_key, 3600, result)
         logger.info(f"Finished ai_respond (APIError, needs agent) in {time.time() - start_time:.2f} seconds")
         return result
     except AuthenticationError as e:
         logger.error(f"❌ OpenAI AuthenticationError: {str(e)}")
-        with get_db_connection() as conn:
-            try:
-                c = conn.cursor()
-                c.execute("BEGIN")
-                c.execute(
-                    "UPDATE conversations SET needs_agent = 1, last_updated = %s WHERE id = %s",
-                    (datetime.now(timezone.utc).isoformat(), convo_id)
-                )
-                c.execute("COMMIT")
-            finally:
-                release_db_connection(conn)
-        socketio.emit("refresh_conversations", {"conversation_id": convo_id})
+        await asyncio.to_thread(update_conversation, convo_id, needs_agent=1, last_updated=datetime.now(timezone.utc).isoformat())
+        await asyncio.to_thread(socketio.emit, "refresh_conversations", {"conversation_id": convo_id})
         result = "I’m sorry, I’m having trouble authenticating with the AI service. I’ll connect you with a team member to assist you." if not is_spanish else \
                "Lo siento, tengo problemas para autenticarme con el servicio de IA. Te conectaré con un miembro del equipo para que te ayude."
-        await async_redis_client.setex(cache_key, 3600, result)
         logger.info(f"Finished ai_respond (AuthenticationError, needs agent) in {time.time() - start_time:.2f} seconds")
         return result
     except Exception as e:
         logger.error(f"❌ Error in ai_respond for convo_id {convo_id}: {str(e)}")
-        with get_db_connection() as conn:
-            try:
-                c = conn.cursor()
-                c.execute("BEGIN")
-                c.execute(
-                    "UPDATE conversations SET needs_agent = 1, last_updated = %s WHERE id = %s",
-                    (datetime.now(timezone.utc).isoformat(), convo_id)
-                )
-                c.execute("COMMIT")
-            finally:
-                release_db_connection(conn)
-        socketio.emit("refresh_conversations", {"conversation_id": convo_id})
+        await asyncio.to_thread(update_conversation, convo_id, needs_agent=1, last_updated=datetime.now(timezone.utc).isoformat())
+        await asyncio.to_thread(socketio.emit, "refresh_conversations", {"conversation_id": convo_id})
         result = "I’m sorry, I’m having trouble processing your request right now. I’ll connect you with a team member to assist you." if not is_spanish else \
                "Lo siento, tengo problemas para procesar tu solicitud ahora mismo. Te conectaré con un miembro del equipo para que te ayude."
-        await async_redis_client.setex(cache_key, 3600, result)
         logger.info(f"Finished ai_respond (general error, needs agent) in {time.time() - start_time:.2f} seconds")
         return result
 
-def ai_respond_sync(message, convo_id):
+def schedule_history_summary(convo_id, through_id):
+    """Queue a background update of the rolling history summary, at most one at a time per conversation."""
     try:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            result = loop.run_until_complete(ai_respond(message, convo_id))
-            return result
-        finally:
-            loop.close()
+        if redis_client.set(summary_pending_key(convo_id), through_id, nx=True, ex=SUMMARY_PENDING_TTL):
+            summarize_conversation_history.delay(convo_id, through_id)
+            logger.info(f"Queued history summary for convo_id {convo_id} through message {through_id}")
+    except Exception as e:
+        logger.error(f"❌ Error queueing history summary for convo_id {convo_id}: {str(e)}")
+
+async def summarize_history(summary, messages):
+    """Return ``summary`` updated with ``messages`` (oldest first)."""
+    prompt = summarization_prompt(summary, messages)
+    estimated_tokens = sum(estimate_tokens(msg["content"]) for msg in prompt) + SUMMARY_MAX_TOKENS
+    async with openai_governor.slot(estimated_tokens) as slot:
+        response = await openai_client.chat.completions.create(
+            model=OPENAI_MODEL,
+            messages=prompt,
+            max_tokens=SUMMARY_MAX_TOKENS,
+            temperature=0.3
+        )
+        if response.usage:
+            slot.used_tokens = response.usage.total_tokens
+    if response.usage:
+        logger.info(
+            f"OpenAI usage for history summary: prompt_tokens={response.usage.prompt_tokens}, "
+            f"completion_tokens={response.usage.completion_tokens}, total_tokens={response.usage.total_tokens}"
+        )
+    return response.choices[0].message.content.strip()
+
+def ai_respond_sync(message, convo_id, raise_errors=False):
+    """
+    Run ``ai_respond`` on the process's async runtime, so the OpenAI and Redis
+    connection pools are reused. Errors are logged and answered with an apology
+    unless ``raise_errors`` is set, for callers that handle them themselves.
+    """
+    try:
+        return async_runtime.run(ai_respond(message, convo_id), timeout=AI_RESPOND_TIMEOUT)
     except Exception as e:
         logger.error(f"❌ Error in ai_respond_sync for convo_id {convo_id}: {str(e)}")
+        if raise_errors:
+            raise
         return "I’m sorry, I’m having trouble processing your request right now. I’ll connect you with a team member to assist you."
 
 # Export both ai_respond and ai_respond_sync for use in tasks.py
@@ -1681,32 +1636,18 @@ def handle_agent_message(data):
             return
 
         # Verify the conversation exists and get the chat_id and channel
-        with get_db_connection() as conn:
-            c = conn.cursor()
-            c.execute(
-                "SELECT chat_id, channel, username FROM conversations WHERE id = %s",
-                (convo_id,)
-            )
-            convo = c.fetchone()
-            if not convo:
-                logger.error(f"Conversation not found: {convo_id}")
-                emit("error", {"message": "Conversation not found"})
-                return
+        convo = conversation_state.get(convo_id)
+        if not convo:
+            logger.error(f"Conversation not found: {convo_id}")
+            emit("error", {"message": "Conversation not found"})
+            return
 
-            chat_id = convo["chat_id"]
-            channel = convo["channel"]
-            username = convo["username"]
-            release_db_connection(conn)
+        chat_id = convo["chat_id"]
+        channel = convo["channel"]
+        username = convo["username"]
 
         # Log the agent's message
-        timestamp = log_message(convo_id, username, message, "agent")
-
-        # Invalidate message cache for this conversation
-        cache_key = f"messages:{convo_id}:*"
-        keys = redis_client.keys(cache_key)
-        if keys:
-            redis_client.delete(*keys)
-            logger.info(f"Invalidated message cache for convo_id {convo_id}")
+        _, timestamp = log_message(convo_id, username, message, "agent")
 
         # Emit the message to the room
         room = f"conversation_{convo_id}"
@@ -1753,34 +1694,20 @@ def handle_user_message(data):
             return
 
         # Verify the conversation exists and get the username, ai_enabled, and channel
-        with get_db_connection() as conn:
-            c = conn.cursor()
-            c.execute(
-                "SELECT username, ai_enabled, channel, needs_agent, handoff_notified FROM conversations WHERE id = %s",
-                (convo_id,)
-            )
-            convo = c.fetchone()
-            if not convo:
-                logger.error(f"Conversation not found: {convo_id}")
-                emit("error", {"message": "Conversation not found"})
-                return
-
-            username = convo["username"]
-            ai_enabled = convo["ai_enabled"]
-            channel = convo["channel"]
-            needs_agent = convo["needs_agent"]
-            handoff_notified = convo["handoff_notified"]
-            release_db_connection(conn)
+        convo = conversation_state.get(convo_id)
+        if not convo:
+            logger.error(f"Conversation not found: {convo_id}")
+            emit("error", {"message": "Conversation not found"})
+            return
 
-        # Log the user's message
-        timestamp = log_message(convo_id, username, message, "user")
+        username = convo["username"]
+        ai_enabled = convo["ai_enabled"]
+        channel = convo["channel"]
+        needs_agent = convo["needs_agent"]
+        handoff_notified = convo["handoff_notified"]
 
-        # Invalidate message cache for this conversation
-        cache_key = f"messages:{convo_id}:*"
-        keys = redis_client.keys(cache_key)
-        if keys:
-            redis_client.delete(*keys)
-            logger.info(f"Invalidated message cache for convo_id {convo_id}")
+        # Log the user's message
+        _, timestamp = log_message(convo_id, username, message, "user")
 
         # Emit the user's message to the room
         room = f"conversation_{convo_id}"
@@ -1798,14 +1725,7 @@ def handle_user_message(data):
 
         # Check if the conversation needs an agent and hasn't been notified yet
         if needs_agent and not handoff_notified:
-            with get_db_connection() as conn:
-                c = conn.cursor()
-                c.execute(
-                    "UPDATE conversations SET handoff_notified = 1, last_updated = %s WHERE id = %s",
-                    (datetime.now(timezone.utc).isoformat(), convo_id)
-                )
-                conn.commit()
-                release_db_connection(conn)
+            update_conversation(convo_id, handoff_notified=1, last_updated=datetime.now(timezone.utc).isoformat())
             socketio.emit("refresh_conversations", {"conversation_id": convo_id})
             logger.info(f"Notified agent for convo_id {convo_id} due to needs_agent")
 
@@ -1818,14 +1738,7 @@ def handle_user_message(data):
         global_ai_enabled, _ = get_ai_enabled()
         if global_ai_enabled != "1":
             logger.info(f"Global AI is disabled, skipping AI response for convo_id {convo_id}")
-            with get_db_connection() as conn:
-                c = conn.cursor()
-                c.execute(
-                    "UPDATE conversations SET needs_agent = 1, last_updated = %s WHERE id = %s",
-                    (datetime.now(timezone.utc).isoformat(), convo_id)
-                )
-                conn.commit()
-                release_db_connection(conn)
+            update_conversation(convo_id, needs_agent=1, last_updated=datetime.now(timezone.utc).isoformat())
             socketio.emit("refresh_conversations", {"conversation_id": convo_id})
             return
 
@@ -1833,14 +1746,7 @@ def handle_user_message(data):
         ai_reply = ai_respond_sync(message, convo_id)
 
         # Log the AI's response
-        ai_timestamp = log_message(convo_id, username, ai_reply, "ai")
-
-        # Invalidate message cache again after AI response
-        cache_key = f"messages:{convo_id}:*"
-        keys = redis_client.keys(cache_key)
-        if keys:
-            redis_client.delete(*keys)
-            logger.info(f"Invalidated message cache for convo_id {convo_id} after AI response")
+        _, ai_timestamp = log_message(convo_id, username, ai_reply, "ai")
 
         # Emit the AI's response to the room
         emit(
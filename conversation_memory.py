@@ -0,0 +1,77 @@
+"""
+Token-budgeted conversation history with a rolling summary.
+
+``fit_history`` keeps the newest messages that fit in ``HISTORY_TOKEN_BUDGET``
+tokens, after reserving room for the conversation's summary. The summary is
+stored on the conversation (``history_summary``) together with
+``history_summary_through_id``, the id of the newest message it covers. When
+messages newer than that no longer fit, a Celery task folds them into the
+summary in the background, so later prompts carry the summary in place of
+those turns.
+
+Token counts are estimated at about four characters per token, plus a fixed
+per-message overhead, which is close enough for budgeting without a tokenizer
+dependency.
+"""
+import logging
+import math
+import os
+
+logger = logging.getLogger("chat_server")
+
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", 1200))
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", 200))
+# Older messages are summarized in batches of at most this many
+SUMMARY_BATCH_SIZE = int(os.getenv("SUMMARY_BATCH_SIZE", 200))
+SUMMARY_PENDING_TTL = 120
+# Seconds one summarization call may take before the task retries
+SUMMARY_TIMEOUT = float(os.getenv("SUMMARY_TIMEOUT", 60))
+
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain a running summary of a conversation between a hotel guest and the Amapola Resort "
+    "assistant. Update the existing summary with the new messages. Keep every detail that matters for "
+    "later turns: the guest's name, dates, number of guests, room type, requests, and anything promised "
+    "to them. Drop greetings and small talk. Write at most 120 words in the guest's language."
+)
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text or "") / 4) + MESSAGE_OVERHEAD_TOKENS
+
+
+def summary_pending_key(convo_id):
+    return f"summary_pending:{convo_id}"
+
+
+def fit_history(messages, summary=None, budget=HISTORY_TOKEN_BUDGET):
+    """
+    Split ``messages`` (oldest first) into ``(kept, overflow)``: the newest
+    messages that fit in ``budget`` tokens once the summary is accounted for,
+    and the older ones that did not fit.
+    """
+    remaining = budget - (estimate_tokens(summary) if summary else 0)
+    start = len(messages)
+    while start > 0:
+        cost = estimate_tokens(messages[start - 1]['message'])
+        if cost > remaining:
+            break
+        remaining -= cost
+        start -= 1
+    return messages[start:], messages[:start]
+
+
+def summary_message(summary):
+    return {"role": "system", "content": f"Summary of the earlier conversation: {summary}"}
+
+
+def summarization_prompt(summary, messages):
+    """Build the chat messages asking the model to fold ``messages`` into ``summary``."""
+    transcript = "\n".join(
+        f"{'Guest' if msg['sender'] == 'user' else 'Assistant'}: {msg['message']}" for msg in messages
+    )
+    return [
+        {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+        {"role": "user", "content": f"Existing summary:\n{summary or '(none)'}\n\nNew messages:\n{transcript}"},
+    ]
@@ -0,0 +1,141 @@
+import json
+import logging
+import threading
+
+from cachetools import TTLCache
+
+logger = logging.getLogger("chat_server")
+
+# Conversation columns read on every inbound message
+STATE_FIELDS = frozenset({
+    "id", "chat_id", "channel", "username", "ai_enabled", "needs_agent",
+    "assigned_agent", "handoff_notified", "language", "booking_intent",
+    "history_summary", "history_summary_through_id",
+})
+INVALIDATION_CHANNEL = "conversation_state:invalidate"
+
+
+class ConversationStateCache:
+    """
+    Two-tier cache of per-conversation flags.
+
+    Reads go to an in-process LRU first, then to Redis, then to Postgres.
+    Writers call ``invalidate`` after committing, which bumps the
+    conversation's generation in Redis (``conversation_state_gen:<id>``) and
+    publishes the id on the invalidation bus so every process drops its local
+    copy. Redis entries are keyed by generation, so a reader that loaded a row
+    just before a write can only populate a key nobody will read again.
+
+    The local TTL bounds staleness if an invalidation message is missed while
+    the bus is reconnecting.
+
+    Args:
+        lease (callable): Returns a context manager yielding a pooled connection.
+        redis_client: Synchronous redis client created with ``decode_responses=True``.
+        bus (InvalidationBus): Used to publish and receive invalidations.
+        maxsize (int): Conversations held in the in-process tier.
+        local_ttl (float): Seconds a local entry may be served.
+        redis_ttl (int): Seconds a Redis entry lives.
+    """
+
+    def __init__(self, lease, redis_client, bus, maxsize=4096, local_ttl=60, redis_ttl=600):
+        self._lease = lease
+        self._redis = redis_client
+        self._bus = bus
+        self.redis_ttl = redis_ttl
+        self._local = TTLCache(maxsize=maxsize, ttl=local_ttl)
+        self._lock = threading.Lock()
+        # Bumped on every local invalidation so a load that raced with one is not cached
+        self._epoch = 0
+        self._local_hits = 0
+        self._redis_hits = 0
+        self._misses = 0
+        bus.subscribe(INVALIDATION_CHANNEL, self._on_invalidate, on_reset=self.clear_local)
+
+    @staticmethod
+    def _generation_key(convo_id):
+        return f"conversation_state_gen:{convo_id}"
+
+    def get(self, convo_id):
+        """Return the conversation's state as a dict, or None if it does not exist."""
+        convo_id = int(convo_id)
+        with self._lock:
+            state = self._local.get(convo_id)
+            if state is not None:
+                self._local_hits += 1
+                return dict(state)
+            epoch = self._epoch
+
+        redis_key = None
+        try:
+            generation = self._redis.get(self._generation_key(convo_id)) or "0"
+            redis_key = f"conversation_state:{convo_id}:{generation}"
+            cached = self._redis.get(redis_key)
+        except Exception as e:
+            logger.error(f"❌ Error reading conversation state for convo_id {convo_id} from Redis: {str(e)}")
+            cached = None
+
+        if cached:
+            state = json.loads(cached)
+            with self._lock:
+                self._redis_hits += 1
+        else:
+            with self._lease() as conn:
+                c = conn.cursor()
+                c.execute(
+                    f"SELECT {', '.join(sorted(STATE_FIELDS))} FROM conversations WHERE id = %s",
+                    (convo_id,)
+                )
+                row = c.fetchone()
+            with self._lock:
+                self._misses += 1
+            if row is None:
+                return None
+            state = dict(row)
+            if redis_key is not None:
+                try:
+                    self._redis.setex(redis_key, self.redis_ttl, json.dumps(state))
+                except Exception as e:
+                    logger.error(f"❌ Error caching conversation state for convo_id {convo_id}: {str(e)}")
+
+        with self._lock:
+            if self._epoch == epoch:
+                self._local[convo_id] = state
+        return dict(state)
+
+    def prime(self, convo_id, state):
+        """Store state just read from the database (e.g. by an upsert's RETURNING) in the local tier."""
+        with self._lock:
+            self._local[int(convo_id)] = {field: state[field] for field in STATE_FIELDS}
+
+    def invalidate(self, convo_id):
+        """Drop cached state for a conversation in every process. Call after the write has committed."""
+        convo_id = int(convo_id)
+        self._drop_local(convo_id)
+        try:
+            self._redis.incr(self._generation_key(convo_id))
+        except Exception as e:
+            logger.error(f"❌ Error bumping conversation state generation for convo_id {convo_id}: {str(e)}")
+        self._bus.publish(INVALIDATION_CHANNEL, str(convo_id))
+
+    def _drop_local(self, convo_id):
+        with self._lock:
+            self._epoch += 1
+            self._local.pop(convo_id, None)
+
+    def _on_invalidate(self, data):
+        self._drop_local(int(data))
+
+    def clear_local(self):
+        with self._lock:
+            self._epoch += 1
+            self._local.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "local_size": len(self._local),
+                "local_hits": self._local_hits,
+                "redis_hits": self._redis_hits,
+                "misses": self._misses,
+            }
@@ -0,0 +1,389 @@
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.pool import PoolError
+
+logger = logging.getLogger("chat_server")
+
+
+class PoolTimeout(PoolError):
+    """Raised when no connection became available within the checkout timeout."""
+
+
+def make_psycopg2_green():
+    """
+    Install a psycopg2 wait callback that yields to the gevent hub.
+
+    psycopg2 is a C extension, so ``monkey.patch_all()`` does not reach its
+    socket I/O and a slow query would block every greenlet in the worker. With
+    the callback installed, libpq runs in non-blocking mode and each wait on the
+    server socket parks only the calling greenlet.
+
+    Only installed when gevent has patched ``socket``. ``chat_server`` (and so
+    every web and Celery process, which import it) always patches; a
+    standalone script that uses the pool without ``monkey.patch_all()`` would
+    only get a poll loop around every query. Returns whether it was installed.
+    """
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    if not monkey.is_module_patched("socket"):
+        return False
+    from gevent.socket import wait_read, wait_write
+
+    def gevent_wait_callback(conn, timeout=None):
+        while True:
+            state = conn.poll()
+            if state == extensions.POLL_OK:
+                break
+            elif state == extensions.POLL_READ:
+                wait_read(conn.fileno(), timeout=timeout)
+            elif state == extensions.POLL_WRITE:
+                wait_write(conn.fileno(), timeout=timeout)
+            else:
+                raise psycopg2.OperationalError(f"Bad result from poll: {state!r}")
+
+    extensions.set_wait_callback(gevent_wait_callback)
+    return True
+
+
+class _Lease:
+    __slots__ = ("conn", "owner", "since", "warned")
+
+    def __init__(self, conn, owner):
+        self.conn = conn
+        self.owner = owner
+        self.since = time.monotonic()
+        self.warned = False
+
+
+class BlockingConnectionPool:
+    """
+    Bounded PostgreSQL connection pool whose callers wait for a free connection
+    instead of failing immediately when every connection is checked out.
+
+    The pool only uses ``threading`` primitives, so under ``monkey.patch_all()``
+    waiting callers are parked greenlets and in Celery prefork processes they are
+    plain threads. Connections are health-checked based on idle time and age
+    rather than with a ``SELECT 1`` on every checkout, and broken connections are
+    replaced one at a time instead of rebuilding the whole pool.
+
+    Args:
+        minconn (int): Connections opened eagerly when the pool is created.
+        maxconn (int): Hard upper bound on open connections.
+        max_waiters (int): Callers allowed to queue for a connection before new
+            checkouts are rejected outright.
+        checkout_timeout (float): Seconds a caller waits before ``PoolTimeout``.
+        idle_check_after (float): Connections idle for longer than this are
+            pinged before being handed out.
+        max_lifetime (float): Connections older than this are closed and
+            reopened on checkout.
+        lease_warn_after (float): Leases held longer than this are logged.
+        lease_reclaim_after (float): Leases held longer than this are forcibly
+            reclaimed by the reaper: the connection is closed and its slot freed.
+        **connect_kwargs: Passed to ``psycopg2.connect``.
+    """
+
+    def __init__(self, minconn, maxconn, max_waiters=50, checkout_timeout=10.0,
+                 idle_check_after=30.0, max_lifetime=1800.0, lease_warn_after=5.0,
+                 lease_reclaim_after=60.0, **connect_kwargs):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("Invalid pool size: require 0 <= minconn <= maxconn and maxconn >= 1")
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.max_waiters = max_waiters
+        self.checkout_timeout = checkout_timeout
+        self.idle_check_after = idle_check_after
+        self.max_lifetime = max_lifetime
+        self.lease_warn_after = lease_warn_after
+        self.lease_reclaim_after = lease_reclaim_after
+        self._connect_kwargs = connect_kwargs
+
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._in_use = {}
+        self._reclaimed = set()
+        self._meta = {}
+        self._reaper = None
+        self._size = 0
+        self._waiters = 0
+        self._closed = False
+
+        # Stats
+        self._checkouts = 0
+        self._checkout_times = deque()
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._timeouts = 0
+        self._rejected = 0
+        self._replaced = 0
+        self._lease_count = 0
+        self._lease_total = 0.0
+        self._lease_max = 0.0
+        self._leases_reclaimed = 0
+
+        for _ in range(minconn):
+            self._size += 1
+            try:
+                conn = self._connect()
+            except Exception:
+                self._size -= 1
+                raise
+            self._idle.append(conn)
+
+    def _connect(self):
+        conn = psycopg2.connect(**self._connect_kwargs)
+        now = time.monotonic()
+        self._meta[id(conn)] = {"created": now, "last_used": now}
+        return conn
+
+    def _close_quietly(self, conn):
+        self._meta.pop(id(conn), None)
+        try:
+            if not conn.closed:
+                conn.close()
+        except Exception as e:
+            logger.warning(f"Error while closing pooled connection: {str(e)}")
+
+    def _replace(self, conn, reason):
+        """Close ``conn`` and open a new connection in the same slot."""
+        logger.warning(f"Replacing pooled database connection ({reason})")
+        self._close_quietly(conn)
+        new_conn = self._connect()
+        with self._cond:
+            self._replaced += 1
+        return new_conn
+
+    def _ensure_healthy(self, conn):
+        meta = self._meta.get(id(conn))
+        now = time.monotonic()
+        if conn.closed or meta is None:
+            return self._replace(conn, "connection closed")
+        if self.max_lifetime and now - meta["created"] > self.max_lifetime:
+            return self._replace(conn, "max lifetime exceeded")
+        if self.idle_check_after is not None and now - meta["last_used"] > self.idle_check_after:
+            try:
+                with conn.cursor() as c:
+                    c.execute("SELECT 1")
+                conn.rollback()
+            except Exception as e:
+                return self._replace(conn, f"idle health check failed: {str(e)}")
+        return conn
+
+    def getconn(self, timeout=None, owner=None):
+        """
+        Check out a connection, waiting up to ``timeout`` seconds (defaults to
+        ``checkout_timeout``) for one to be returned when the pool is at capacity.
+        ``owner`` labels the lease in warnings about long-held connections.
+        """
+        timeout = self.checkout_timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+        conn = None
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolError("connection pool is closed")
+                if self._idle:
+                    # LIFO keeps recently used connections hot and lets surplus ones age out
+                    conn = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    self._size += 1
+                    break
+                if self._waiters >= self.max_waiters:
+                    self._rejected += 1
+                    raise PoolError(f"connection pool exhausted: {self._waiters} callers already waiting")
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(f"timed out after {timeout:.1f}s waiting for a database connection")
+                self._waiters += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiters -= 1
+
+        try:
+            conn = self._connect() if conn is None else self._ensure_healthy(conn)
+        except Exception:
+            # The slot was reserved for us; give it back so waiters can retry
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+        waited = time.monotonic() - start
+        with self._cond:
+            self._in_use[id(conn)] = _Lease(conn, owner)
+            self._checkouts += 1
+            now = time.monotonic()
+            self._checkout_times.append(now)
+            while now - self._checkout_times[0] > 60:
+                self._checkout_times.popleft()
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        return conn
+
+    def putconn(self, conn, close=False):
+        """Return a connection to the pool, discarding it if it is broken or ``close`` is set."""
+        with self._cond:
+            lease = self._in_use.pop(id(conn), None)
+            if lease is None:
+                if id(conn) in self._reclaimed:
+                    self._reclaimed.discard(id(conn))
+                    logger.warning("Connection returned after its lease was force-reclaimed")
+                else:
+                    logger.warning("Attempted to return a connection that is not checked out from this pool")
+                return
+            held = time.monotonic() - lease.since
+            self._lease_count += 1
+            self._lease_total += held
+            self._lease_max = max(self._lease_max, held)
+        if self.lease_warn_after is not None and held > self.lease_warn_after:
+            logger.warning(f"Database connection held for {held:.2f}s by {lease.owner or 'unknown'}")
+
+        if not close and not conn.closed:
+            status = conn.get_transaction_status()
+            if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                close = True
+            elif status != extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except Exception:
+                    close = True
+
+        if close or conn.closed or self._closed:
+            self._close_quietly(conn)
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            return
+
+        meta = self._meta.get(id(conn))
+        if meta is not None:
+            meta["last_used"] = time.monotonic()
+        with self._cond:
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def discard(self, conn):
+        """Close a checked-out connection and free its slot."""
+        self.putconn(conn, close=True)
+
+    @contextmanager
+    def connection(self, owner=None, timeout=None, autocommit=False):
+        """
+        Lease a connection for the duration of a ``with`` block.
+
+        The transaction is committed when the block exits normally and rolled
+        back when it raises; the connection always goes back to the pool. With
+        ``autocommit`` each statement commits on its own, which saves the
+        BEGIN/COMMIT round trips for single-statement work.
+        """
+        conn = self.getconn(timeout=timeout, owner=owner)
+        try:
+            if autocommit:
+                conn.autocommit = True
+            yield conn
+            if not conn.closed:
+                conn.commit()
+        except Exception:
+            try:
+                if not conn.closed:
+                    conn.rollback()
+            except Exception:
+                pass
+            raise
+        finally:
+            if autocommit and not conn.closed:
+                try:
+                    conn.autocommit = False
+                except Exception:
+                    # putconn discards closed connections
+                    conn.close()
+            self.putconn(conn)
+
+    def reap_leases(self):
+        """
+        Log leases held beyond ``lease_warn_after`` and force-reclaim those held
+        beyond ``lease_reclaim_after`` by closing the connection and freeing its
+        slot. Returns the number of reclaimed leases.
+        """
+        now = time.monotonic()
+        expired = []
+        with self._cond:
+            for key, lease in list(self._in_use.items()):
+                held = now - lease.since
+                if self.lease_reclaim_after is not None and held > self.lease_reclaim_after:
+                    del self._in_use[key]
+                    self._reclaimed.add(key)
+                    expired.append((lease, held))
+                elif self.lease_warn_after is not None and held > self.lease_warn_after and not lease.warned:
+                    lease.warned = True
+                    logger.warning(f"Database connection leased by {lease.owner or 'unknown'} has been held for {held:.2f}s")
+        for lease, held in expired:
+            logger.error(f"❌ Force-reclaiming database connection leased by {lease.owner or 'unknown'} after {held:.2f}s")
+            self._close_quietly(lease.conn)
+            with self._cond:
+                self._size -= 1
+                self._leases_reclaimed += 1
+                self._cond.notify()
+        return len(expired)
+
+    def start_lease_reaper(self, interval=5.0):
+        """Start a daemon thread that calls ``reap_leases`` every ``interval`` seconds."""
+        if self._reaper is not None:
+            return
+
+        def run():
+            while not self._closed:
+                time.sleep(interval)
+                try:
+                    self.reap_leases()
+                except Exception as e:
+                    logger.error(f"❌ Error in connection lease reaper: {str(e)}")
+
+        self._reaper = threading.Thread(target=run, name="db-lease-reaper", daemon=True)
+        self._reaper.start()
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            self._close_quietly(conn)
+
+    def stats(self):
+        """Return a snapshot of pool usage counters."""
+        now = time.monotonic()
+        with self._cond:
+            while self._checkout_times and now - self._checkout_times[0] > 60:
+                self._checkout_times.popleft()
+            return {
+                "size": self._size,
+                "maxconn": self.maxconn,
+                "in_use": len(self._in_use),
+                "idle": len(self._idle),
+                "waiters": self._waiters,
+                "checkouts": self._checkouts,
+                "checkouts_per_sec": round(len(self._checkout_times) / 60.0, 3),
+                "avg_wait_ms": round(self._wait_total / self._checkouts * 1000, 3) if self._checkouts else 0.0,
+                "max_wait_ms": round(self._wait_max * 1000, 3),
+                "timeouts": self._timeouts,
+                "rejected": self._rejected,
+                "replaced": self._replaced,
+                "avg_lease_ms": round(self._lease_total / self._lease_count * 1000, 3) if self._lease_count else 0.0,
+                "max_lease_ms": round(self._lease_max * 1000, 3),
+                "oldest_lease_ms": round(max((now - l.since for l in self._in_use.values()), default=0.0) * 1000, 3),
+                "leases_reclaimed": self._leases_reclaimed,
+            }
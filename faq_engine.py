@@ -0,0 +1,165 @@
+"""
+Local answers for questions covered by the Q&A pairs in qa_reference.txt.
+
+The reference document is parsed at startup into Q&A pairs, each with an
+English and a Spanish question and answer. Both questions are indexed with
+BM25. A guest message is answered locally when its best match clears
+``FAQ_MATCH_THRESHOLD``. Confidence is the match's BM25 score divided by the
+score the matched question would get against itself, so it is comparable
+across questions of different lengths, scaled down by the square of the
+share of message words the question does not cover.
+
+Messages whose best match clears only ``FAQ_SHARED_THRESHOLD`` are still
+treated as standalone questions: they go to OpenAI without the conversation
+history and share one cache entry across conversations. Anything less
+confident (e.g. "yes please") keeps the full history.
+
+The document's other sections (room types, amenities, booking policy) are
+deliberately not indexed here. Their bullets are English-only noun phrases,
+not replies, so they cannot be served verbatim; and as evidence that a
+message is standalone they misfire on short follow-ups such as "standard
+room" or "by credit card", which name a resort item but only make sense with
+the history. They reach the model through ``prompt_builder`` retrieval.
+"""
+import logging
+import math
+import os
+import re
+from collections import Counter, namedtuple
+
+from llm_cache import normalize_message
+
+logger = logging.getLogger("chat_server")
+
+FAQ_MATCH_THRESHOLD = float(os.getenv("FAQ_MATCH_THRESHOLD", 0.5))
+FAQ_SHARED_THRESHOLD = float(os.getenv("FAQ_SHARED_THRESHOLD", 0.3))
+FAQ_STATS_KEY = "faq_engine:stats"
+
+STOPWORDS = frozenset("""
+a an the is are am be do does did you your yours we our i me my to of in on at for with and or can
+could would will what whats which how there it its this that any have has
+el la los las un una unos unas es son de del en al a y o que como cual cuales hay tienen tiene
+ofrecen ustedes usted su sus mi me por para con se lo le les puedo puede
+""".split())
+
+QAPair = namedtuple("QAPair", ["question_en", "question_es", "answer_en", "answer_es"])
+Match = namedtuple("Match", ["pair", "confidence"])
+
+QA_LINE_RE = re.compile(r"^(Q|A) \((English|Spanish)\):\s*(.+)$")
+
+
+def tokenize(text):
+    """Normalized content words of ``text``, with a light plural strip so "rooms" matches "room"."""
+    tokens = []
+    for token in normalize_message(text).split():
+        if token in STOPWORDS or len(token) < 2:
+            continue
+        if len(token) > 3 and token.endswith("s"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def parse_qa_pairs(text):
+    """Extract the ``Q (English)/Q (Spanish)/A (English)/A (Spanish)`` blocks from the reference document."""
+    pairs = []
+    current = {}
+    for line in text.splitlines():
+        match = QA_LINE_RE.match(line.strip())
+        if not match:
+            continue
+        kind, language, content = match.groups()
+        field = f"{'question' if kind == 'Q' else 'answer'}_{'en' if language == 'English' else 'es'}"
+        if field == "question_en" and current:
+            pairs.append(current)
+            current = {}
+        current[field] = content.strip()
+    if current:
+        pairs.append(current)
+    return [
+        QAPair(p.get("question_en", ""), p.get("question_es", ""), p.get("answer_en", ""), p.get("answer_es", ""))
+        for p in pairs
+        if p.get("answer_en") or p.get("answer_es")
+    ]
+
+
+class BM25Index:
+    """Okapi BM25 over a fixed list of documents, each given as a token list."""
+
+    def __init__(self, documents, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.term_freqs = [Counter(doc) for doc in documents]
+        self.lengths = [len(doc) for doc in documents]
+        self.avg_length = sum(self.lengths) / len(self.lengths) if documents else 0
+        doc_freq = Counter(term for doc in documents for term in set(doc))
+        n = len(documents)
+        self.idf = {term: math.log(1 + (n - df + 0.5) / (df + 0.5)) for term, df in doc_freq.items()}
+
+    def score(self, query_tokens, index):
+        freqs = self.term_freqs[index]
+        length_norm = self.k1 * (1 - self.b + self.b * self.lengths[index] / self.avg_length)
+        score = 0.0
+        for term in query_tokens:
+            tf = freqs.get(term)
+            if tf:
+                score += self.idf[term] * tf * (self.k1 + 1) / (tf + length_norm)
+        return score
+
+    def search(self, query_tokens, k=1):
+        """Return up to ``k`` ``(index, score)`` pairs with a positive score, best first."""
+        scores = [(index, self.score(query_tokens, index)) for index in range(len(self.term_freqs))]
+        scores = [item for item in scores if item[1] > 0]
+        scores.sort(key=lambda item: item[1], reverse=True)
+        return scores[:k]
+
+
+class FAQEngine:
+    """
+    Args:
+        reference_text (str): Contents of qa_reference.txt.
+        threshold (float): Minimum confidence, between 0 and 1, to answer locally.
+        shared_threshold (float): Minimum confidence to answer through OpenAI
+            without the conversation history.
+    """
+
+    def __init__(self, reference_text, threshold=FAQ_MATCH_THRESHOLD, shared_threshold=FAQ_SHARED_THRESHOLD):
+        self.threshold = threshold
+        self.shared_threshold = shared_threshold
+        self.pairs = parse_qa_pairs(reference_text)
+        # One document per question and language, mapped back to its pair
+        self._doc_pairs = []
+        documents = []
+        for pair_index, pair in enumerate(self.pairs):
+            for question in (pair.question_en, pair.question_es):
+                if question:
+                    documents.append(tokenize(question))
+                    self._doc_pairs.append(pair_index)
+        self._index = BM25Index(documents)
+        self._self_scores = [self._index.score(doc, i) for i, doc in enumerate(documents)]
+        logger.info(f"✅ Indexed {len(self.pairs)} FAQ pairs ({len(documents)} questions)")
+
+    def match(self, message):
+        """Return the best ``Match`` for ``message``, or None if nothing matches at all."""
+        tokens = tokenize(message)
+        if not tokens:
+            return None
+        results = self._index.search(tokens, k=1)
+        if not results:
+            return None
+        doc_index, score = results[0]
+        # Penalize message words the question does not cover, so "do you have
+        # a pool table?" is not answered with the pool FAQ.
+        coverage = sum(1 for token in tokens if token in self._index.term_freqs[doc_index]) / len(tokens)
+        confidence = min(1.0, score / self._self_scores[doc_index]) * coverage ** 2
+        return Match(self.pairs[self._doc_pairs[doc_index]], round(confidence, 3))
+
+    def answer(self, message, language):
+        """Return ``(answer, confidence)`` if the best match clears the threshold, else ``(None, confidence)``."""
+        match = self.match(message)
+        if match is None:
+            return None, 0.0
+        if match.confidence < self.threshold:
+            return None, match.confidence
+        answer = match.pair.answer_es if language == "es" else match.pair.answer_en
+        return (answer or match.pair.answer_en or match.pair.answer_es), match.confidence
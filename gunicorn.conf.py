@@ -18,3 +18,10 @@ threads = 50
 # Timeout for worker processes
 # Keeping at 120 seconds (2 minutes) since it’s already sufficient
 timeout = 120
+
+# Flush buffered message inserts (MESSAGE_WRITE_BEHIND) before a worker exits
+def worker_exit(server, worker):
+    import sys
+    chat_server = sys.modules.get("chat_server")
+    if chat_server is not None and chat_server.message_writer is not None:
+        chat_server.message_writer.close()
@@ -0,0 +1,86 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger("chat_server")
+
+
+class InvalidationBus:
+    """
+    Redis pub/sub fan-out of cache invalidations to every web and worker process.
+
+    Each process runs one listener thread (a greenlet under gevent) that
+    dispatches messages to the callbacks registered with ``subscribe``.
+    Messages published while a process is disconnected are lost, so after
+    every (re)subscription the ``on_reset`` callbacks run and caches should
+    drop whatever they hold.
+
+    Args:
+        redis_client: Synchronous redis client created with ``decode_responses=True``.
+        reconnect_delay (float): Seconds to wait before resubscribing after an error.
+    """
+
+    def __init__(self, redis_client, reconnect_delay=1.0):
+        self._redis = redis_client
+        self.reconnect_delay = reconnect_delay
+        self._callbacks = {}
+        self._resets = []
+        self._thread = None
+        self._lock = threading.Lock()
+        self.connected = False
+        self._received = 0
+        self._reconnects = 0
+
+    def subscribe(self, channel, callback, on_reset=None):
+        """Call ``callback(data)`` for every message on ``channel``. Must be called before ``start``."""
+        self._callbacks.setdefault(channel, []).append(callback)
+        if on_reset is not None:
+            self._resets.append(on_reset)
+
+    def publish(self, channel, data):
+        try:
+            self._redis.publish(channel, data)
+        except Exception as e:
+            logger.error(f"❌ Failed to publish invalidation on {channel}: {str(e)}")
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="invalidation-bus", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(*self._callbacks)
+                self.connected = True
+                logger.info(f"✅ Subscribed to invalidation channels: {', '.join(self._callbacks)}")
+                for on_reset in self._resets:
+                    on_reset()
+                for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    self._received += 1
+                    for callback in self._callbacks.get(message["channel"], []):
+                        try:
+                            callback(message["data"])
+                        except Exception as e:
+                            logger.error(f"❌ Invalidation callback failed for {message['channel']}: {str(e)}")
+            except Exception as e:
+                logger.warning(f"⚠️ Invalidation subscription lost, reconnecting in {self.reconnect_delay}s: {str(e)}")
+            finally:
+                self.connected = False
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
+            self._reconnects += 1
+            time.sleep(self.reconnect_delay)
+
+    def stats(self):
+        return {
+            "connected": self.connected,
+            "received": self._received,
+            "reconnects": self._reconnects,
+        }
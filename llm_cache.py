@@ -0,0 +1,115 @@
+"""
+Shared cache of OpenAI replies.
+
+Entries are keyed on the normalized guest message, the conversation language
+and a hash of everything else sent to the model, so two guests asking the
+same standalone question share one reply while a follow-up only hits when
+its context is identical.
+
+Messages are classified into one of two scopes:
+
+* ``faq``: short, self-contained questions ("what time is check-in?"). They
+  are answered from the system prompt alone, without conversation history, so
+  the reply is safe to share across conversations. Kept for
+  ``LLM_CACHE_FAQ_TTL`` seconds.
+* ``contextual``: anything that refers to earlier turns or carries personal
+  details (numbers, "yes", "that one"). The full history is part of the
+  context hash. Kept for ``LLM_CACHE_CONTEXTUAL_TTL`` seconds.
+
+Hit/miss/store counters are kept per scope in the ``llm_cache:stats`` hash so
+they aggregate across processes.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import unicodedata
+
+logger = logging.getLogger("chat_server")
+
+SCOPE_FAQ = "faq"
+SCOPE_CONTEXTUAL = "contextual"
+
+LLM_CACHE_FAQ_TTL = int(os.getenv("LLM_CACHE_FAQ_TTL", 86400))
+LLM_CACHE_CONTEXTUAL_TTL = int(os.getenv("LLM_CACHE_CONTEXTUAL_TTL", 600))
+LLM_CACHE_STATS_KEY = "llm_cache:stats"
+
+FAQ_MAX_LENGTH = 120
+# Words that only make sense relative to earlier turns
+CONTEXT_WORDS = frozenset({
+    "it", "that", "this", "those", "these", "them", "they", "same", "also", "else",
+    "yes", "no", "ok", "okay", "sure", "then", "one", "again",
+    "eso", "esa", "ese", "esto", "esta", "este", "esos", "esas", "ahi", "alli", "mismo", "misma",
+    "tambien", "si", "vale", "claro", "entonces", "otra", "otro",
+})
+
+
+def normalize_message(message):
+    """Case-fold, strip accents and punctuation, and collapse whitespace."""
+    text = unicodedata.normalize("NFKD", message.casefold())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+
+def classify_scope(normalized):
+    """Return ``SCOPE_FAQ`` for standalone questions and ``SCOPE_CONTEXTUAL`` otherwise."""
+    if not normalized or len(normalized) > FAQ_MAX_LENGTH or re.search(r"\d", normalized):
+        return SCOPE_CONTEXTUAL
+    if CONTEXT_WORDS.intersection(normalized.split()):
+        return SCOPE_CONTEXTUAL
+    return SCOPE_FAQ
+
+
+def context_hash(*parts):
+    """Stable hash of the JSON-serializable prompt parts that accompany the guest message."""
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+class LLMResponseCache:
+    """
+    Args:
+        redis_client: Async redis client created with ``decode_responses=True``.
+    """
+
+    def __init__(self, redis_client, faq_ttl=LLM_CACHE_FAQ_TTL, contextual_ttl=LLM_CACHE_CONTEXTUAL_TTL):
+        self._redis = redis_client
+        self.ttls = {SCOPE_FAQ: faq_ttl, SCOPE_CONTEXTUAL: contextual_ttl}
+
+    @staticmethod
+    def key(scope, language, normalized, context):
+        message_hash = hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:24]
+        return f"llm_cache:{scope}:{language}:{message_hash}:{context}"
+
+    async def get(self, scope, language, normalized, context):
+        try:
+            reply = await self._redis.get(self.key(scope, language, normalized, context))
+            await self._redis.hincrby(LLM_CACHE_STATS_KEY, f"{scope}:{'hits' if reply else 'misses'}", 1)
+            return reply
+        except Exception as e:
+            logger.error(f"❌ Error reading LLM cache: {str(e)}")
+            return None
+
+    async def set(self, scope, language, normalized, context, reply):
+        try:
+            await self._redis.setex(self.key(scope, language, normalized, context), self.ttls[scope], reply)
+            await self._redis.hincrby(LLM_CACHE_STATS_KEY, f"{scope}:stores", 1)
+        except Exception as e:
+            logger.error(f"❌ Error writing LLM cache: {str(e)}")
+
+
+def summarize_stats(raw):
+    """Turn the ``llm_cache:stats`` hash into per-scope counts and hit rates."""
+    summary = {}
+    for scope in (SCOPE_FAQ, SCOPE_CONTEXTUAL):
+        hits = int(raw.get(f"{scope}:hits", 0))
+        misses = int(raw.get(f"{scope}:misses", 0))
+        summary[scope] = {
+            "hits": hits,
+            "misses": misses,
+            "stores": int(raw.get(f"{scope}:stores", 0)),
+            "hit_rate": round(hits / (hits + misses), 3) if hits + misses else None,
+        }
+    return summary
@@ -0,0 +1,305 @@
+"""
+Monthly partitions of the ``messages`` table and archival of expired months.
+
+``messages`` is range-partitioned by ``timestamp`` into one partition per
+calendar month (UTC), named ``messages_pYYYYMM``, plus ``messages_default`` as
+a catch-all that should stay empty. Partitions are created ahead of time by
+the ``maintain_message_partitions`` Celery beat task. If rows for a month
+reached ``messages_default`` before its partition existed (e.g. beat was down,
+or a far-future timestamp), they are moved into the new partition as it is
+created, since Postgres refuses to create a partition whose range overlaps
+rows in the default partition.
+
+Only queries that filter on ``timestamp`` are pruned to the matching
+partitions. The keyset pagination and recent-history queries filter on
+``(convo_id, id)``, so they probe ``idx_messages_convo_id_id`` in every
+partition: one index lookup per month kept in the database.
+
+Once every row of a partition is older than ``MESSAGE_RETENTION_MONTHS`` full
+months, the partition is written to ``MESSAGE_ARCHIVE_DIR/messages_pYYYYMM.csv.gz``
+and dropped. The archive directory must be on persistent storage. Archived
+messages can be read back with the export command:
+
+    python message_archive.py partitions                  # create upcoming partitions and list them
+    python message_archive.py archive                     # archive expired partitions now
+    python message_archive.py list                        # list archive files
+    python message_archive.py export --convo-id 42 --since 2024-01-01 --until 2024-07-01 > out.csv
+"""
+import argparse
+import csv
+import gzip
+import logging
+import os
+import re
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+logger = logging.getLogger("chat_server")
+
+# 0 keeps every partition in the database
+MESSAGE_RETENTION_MONTHS = int(os.getenv("MESSAGE_RETENTION_MONTHS", 0))
+MESSAGE_PARTITIONS_AHEAD = int(os.getenv("MESSAGE_PARTITIONS_AHEAD", 3))
+MESSAGE_ARCHIVE_DIR = Path(os.getenv("MESSAGE_ARCHIVE_DIR", Path(__file__).parent.absolute() / "var" / "archive"))
+
+PARTITION_NAME_RE = re.compile(r"^messages_p(\d{4})(\d{2})$")
+ARCHIVE_FILE_RE = re.compile(r"^messages_p(\d{4})(\d{2})\.csv\.gz$")
+ARCHIVE_COLUMNS = ["id", "convo_id", "username", "message", "sender", "timestamp"]
+
+
+def month_start(value):
+    return datetime(value.year, value.month, 1, tzinfo=timezone.utc)
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def partition_name(month):
+    return f"messages_p{month.year:04d}{month.month:02d}"
+
+
+def list_partitions(conn):
+    """Return ``[(name, month_start)]`` for the monthly partitions of ``messages``, oldest first."""
+    c = conn.cursor()
+    c.execute(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE pg_inherits.inhparent = 'messages'::regclass"
+    )
+    partitions = []
+    for row in c.fetchall():
+        match = PARTITION_NAME_RE.match(row[0])
+        if match:
+            partitions.append((row[0], datetime(int(match.group(1)), int(match.group(2)), 1, tzinfo=timezone.utc)))
+    partitions.sort(key=lambda partition: partition[1])
+    return partitions
+
+
+def ensure_partitions(conn, start=None, months_ahead=MESSAGE_PARTITIONS_AHEAD):
+    """
+    Create monthly partitions from ``start`` (default: the current month) through
+    ``months_ahead`` months past the current month. Returns the names created.
+    """
+    current = month_start(datetime.now(timezone.utc))
+    month = month_start(start) if start else current
+    last = add_months(current, months_ahead)
+    existing = {name for name, _ in list_partitions(conn)}
+    created = []
+    c = conn.cursor()
+    while month <= last:
+        name = partition_name(month)
+        if name not in existing:
+            c.execute(
+                "SELECT EXISTS (SELECT 1 FROM messages_default WHERE timestamp >= %s AND timestamp < %s)",
+                (month, add_months(month, 1))
+            )
+            if c.fetchone()[0]:
+                moved = create_partition_from_default(conn, name, month)
+                logger.warning(f"⚠️ Created message partition {name} and moved {moved} messages into it from messages_default")
+            else:
+                c.execute(
+                    f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF messages FOR VALUES FROM (%s) TO (%s)",
+                    (month, add_months(month, 1))
+                )
+                logger.info(f"Created message partition {name}")
+            created.append(name)
+        month = add_months(month, 1)
+    return created
+
+
+def create_partition_from_default(conn, name, month):
+    """
+    Create the partition for ``month`` when ``messages_default`` already holds
+    rows in its range: the partition is built as a standalone table, the rows
+    are moved into it and it is attached, all in one transaction (the caller's,
+    unless ``conn`` is in autocommit mode). Attaching validates that no rows of
+    the range are left in the default partition. Returns the rows moved.
+    """
+    own_transaction = conn.autocommit
+    if own_transaction:
+        conn.autocommit = False
+    try:
+        c = conn.cursor()
+        c.execute("LOCK TABLE messages_default IN ACCESS EXCLUSIVE MODE")
+        c.execute(f"CREATE TABLE {name} (LIKE messages INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+        c.execute(
+            f"WITH moved AS (DELETE FROM messages_default WHERE timestamp >= %s AND timestamp < %s RETURNING *) "
+            f"INSERT INTO {name} SELECT * FROM moved",
+            (month, add_months(month, 1))
+        )
+        moved = c.rowcount
+        c.execute(
+            f"ALTER TABLE messages ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)",
+            (month, add_months(month, 1))
+        )
+        if own_transaction:
+            conn.commit()
+    except Exception:
+        if own_transaction:
+            conn.rollback()
+        raise
+    finally:
+        if own_transaction:
+            conn.autocommit = True
+    return moved
+
+
+def archive_partition(conn, name, archive_dir=MESSAGE_ARCHIVE_DIR):
+    """
+    Write one partition to ``archive_dir/<name>.csv.gz`` and drop it.
+
+    The partition is locked against writes while it is copied. The archive file
+    is complete and renamed into place before the partition is detached, and
+    the detach and drop commit together, so an interrupted run can simply be
+    retried. Returns the number of rows archived.
+    """
+    archive_dir = Path(archive_dir)
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    path = archive_dir / f"{name}.csv.gz"
+    partial = archive_dir / f"{name}.csv.gz.partial"
+
+    autocommit = conn.autocommit
+    conn.autocommit = False
+    try:
+        c = conn.cursor()
+        c.execute(f"LOCK TABLE {name} IN SHARE MODE")
+        c.execute(f"SELECT COUNT(*) FROM {name}")
+        expected = c.fetchone()[0]
+        with gzip.open(partial, "wt", encoding="utf-8", newline="") as f:
+            c.copy_expert(
+                "COPY (SELECT id, convo_id, username, message, sender, "
+                "to_char(timestamp AT TIME ZONE 'UTC', 'YYYY-MM-DD\"T\"HH24:MI:SS.US\"+00:00\"') AS timestamp "
+                f"FROM {name} ORDER BY id) TO STDOUT WITH (FORMAT csv, HEADER true)",
+                f
+            )
+            copied = c.rowcount
+        # rowcount is -1 when the driver does not report COPY row counts
+        if copied not in (-1, expected):
+            raise RuntimeError(f"Copied {copied} of {expected} rows from {name}")
+        with open(partial, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(partial, path)
+
+        c.execute(f"ALTER TABLE messages DETACH PARTITION {name}")
+        c.execute(f"DROP TABLE {name}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.autocommit = autocommit
+        if partial.exists():
+            partial.unlink()
+    logger.info(f"✅ Archived {expected} messages from {name} to {path}")
+    return expected
+
+
+def archive_expired_partitions(conn, retention_months=MESSAGE_RETENTION_MONTHS, archive_dir=MESSAGE_ARCHIVE_DIR):
+    """
+    Archive every partition whose month ended more than ``retention_months``
+    full months ago. Returns ``{partition_name: rows_archived}``.
+    """
+    if retention_months <= 0:
+        logger.info("Message retention disabled (MESSAGE_RETENTION_MONTHS=0), nothing to archive")
+        return {}
+    cutoff = add_months(month_start(datetime.now(timezone.utc)), -retention_months)
+    archived = {}
+    for name, month in list_partitions(conn):
+        if add_months(month, 1) > cutoff:
+            break
+        archived[name] = archive_partition(conn, name, archive_dir)
+    return archived
+
+
+def list_archives(archive_dir=MESSAGE_ARCHIVE_DIR):
+    """Return ``[(month_start, path)]`` for the archive files in ``archive_dir``, oldest first."""
+    archive_dir = Path(archive_dir)
+    if not archive_dir.is_dir():
+        return []
+    archives = []
+    for path in archive_dir.iterdir():
+        match = ARCHIVE_FILE_RE.match(path.name)
+        if match:
+            archives.append((datetime(int(match.group(1)), int(match.group(2)), 1, tzinfo=timezone.utc), path))
+    archives.sort()
+    return archives
+
+
+def export_archived_messages(out, convo_id=None, since=None, until=None, archive_dir=MESSAGE_ARCHIVE_DIR):
+    """
+    Write archived messages as CSV to ``out``, filtered by conversation and by
+    ``since <= timestamp < until``. Only archive files for months overlapping
+    the range are opened. Returns the number of rows written.
+    """
+    writer = csv.writer(out)
+    writer.writerow(ARCHIVE_COLUMNS)
+    written = 0
+    for month, path in list_archives(archive_dir):
+        if since and add_months(month, 1) <= since:
+            continue
+        if until and month >= until:
+            continue
+        with gzip.open(path, "rt", encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                if convo_id is not None and int(row["convo_id"]) != convo_id:
+                    continue
+                timestamp = datetime.fromisoformat(row["timestamp"])
+                if (since and timestamp < since) or (until and timestamp >= until):
+                    continue
+                writer.writerow([row[column] for column in ARCHIVE_COLUMNS])
+                written += 1
+    return written
+
+
+def parse_utc(value):
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Manage message partitions and archives")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("partitions", help="create upcoming partitions and list them")
+    archive_parser = subparsers.add_parser("archive", help="archive partitions past the retention period")
+    archive_parser.add_argument("--retention-months", type=int, default=MESSAGE_RETENTION_MONTHS)
+    subparsers.add_parser("list", help="list archive files")
+    export_parser = subparsers.add_parser("export", help="write archived messages to CSV")
+    export_parser.add_argument("--convo-id", type=int)
+    export_parser.add_argument("--since", type=parse_utc, help="ISO date or timestamp, inclusive (UTC if no offset)")
+    export_parser.add_argument("--until", type=parse_utc, help="ISO date or timestamp, exclusive (UTC if no offset)")
+    export_parser.add_argument("--output", help="output file (default: stdout)")
+    args = parser.parse_args(argv)
+
+    if args.command == "list":
+        for month, path in list_archives():
+            print(f"{month:%Y-%m}: {path} ({path.stat().st_size} bytes)")
+        return
+    if args.command == "export":
+        if args.output:
+            with open(args.output, "w", encoding="utf-8", newline="") as out:
+                written = export_archived_messages(out, args.convo_id, args.since, args.until)
+        else:
+            written = export_archived_messages(sys.stdout, args.convo_id, args.since, args.until)
+        logger.info(f"Exported {written} archived messages")
+        return
+
+    from migrate import connect
+    conn = connect()
+    conn.autocommit = True
+    try:
+        if args.command == "partitions":
+            ensure_partitions(conn)
+            for name, month in list_partitions(conn):
+                print(f"{month:%Y-%m}: {name}")
+        elif args.command == "archive":
+            archived = archive_expired_partitions(conn, args.retention_months)
+            logger.info(f"Archived {len(archived)} partition(s), {sum(archived.values())} messages")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
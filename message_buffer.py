@@ -0,0 +1,159 @@
+import json
+import logging
+from datetime import datetime, timezone
+
+import redis
+
+logger = logging.getLogger("chat_server")
+
+
+# KEYS: buffer list, pending list
+# ARGV: entry, size, ttl (s)
+# Returns 1 if the entry was appended to the buffer, 0 if it was parked in the pending list
+APPEND_SCRIPT = """
+local target = KEYS[1]
+local appended = 1
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    target = KEYS[2]
+    appended = 0
+end
+redis.call('RPUSH', target, ARGV[1])
+redis.call('LTRIM', target, -tonumber(ARGV[2]), -1)
+redis.call('EXPIRE', target, ARGV[3])
+return appended
+"""
+
+
+def _parse_timestamp(value):
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+class RecentMessageBuffer:
+    """
+    Per-conversation ring buffer of the most recent messages in a Redis list.
+
+    Writers ``append`` every logged message to the buffer if it exists, or
+    otherwise to a pending list (one atomic script). Readers hydrate a missing
+    buffer from the last ``size`` rows in Postgres merged with the pending list,
+    which holds messages the write-behind writer has not flushed yet. The
+    hydration is written in a MULTI/EXEC that WATCHes the conversation's
+    message generation and pending list and is abandoned if a message was
+    logged in the meantime, so a concurrent append is never lost. Writers must
+    append before bumping the generation.
+
+    Entries are ``{"id", "message", "sender", "timestamp"}`` dicts and are
+    returned oldest-first, de-duplicated by id.
+
+    Args:
+        redis_client: Synchronous redis client created with ``decode_responses=True``.
+        lease (callable): Returns a context manager yielding a pooled connection.
+        generation_key (callable): Maps a convo_id to its message generation key.
+        size (int): Messages kept per conversation.
+        ttl (int): Seconds an idle buffer lives.
+    """
+
+    def __init__(self, redis_client, lease, generation_key, size=50, ttl=86400):
+        self._redis = redis_client
+        self._lease = lease
+        self._generation_key = generation_key
+        self.size = size
+        self.ttl = ttl
+        self._append = redis_client.register_script(APPEND_SCRIPT)
+
+    @staticmethod
+    def _key(convo_id):
+        return f"recent_messages:{convo_id}"
+
+    @staticmethod
+    def _pending_key(convo_id):
+        return f"recent_messages_pending:{convo_id}"
+
+    def append(self, convo_id, message_id, message, sender, timestamp):
+        if not isinstance(timestamp, str):
+            timestamp = timestamp.isoformat()
+        entry = json.dumps({"id": message_id, "message": message, "sender": sender, "timestamp": timestamp})
+        try:
+            self._append(keys=[self._key(convo_id), self._pending_key(convo_id)], args=[entry, self.size, self.ttl])
+        except Exception as e:
+            logger.error(f"❌ Error appending to recent message buffer for convo_id {convo_id}: {str(e)}")
+
+    def _load(self, convo_id):
+        with self._lease() as conn:
+            c = conn.cursor()
+            c.execute(
+                "SELECT id, message, sender, timestamp FROM messages WHERE convo_id = %s ORDER BY id DESC LIMIT %s",
+                (convo_id, self.size)
+            )
+            rows = c.fetchall()
+        return [
+            {"id": row["id"], "message": row["message"], "sender": row["sender"], "timestamp": row["timestamp"].isoformat()}
+            for row in reversed(rows)
+        ]
+
+    def _hydrate(self, convo_id):
+        key = self._key(convo_id)
+        pending_key = self._pending_key(convo_id)
+        generation_key = self._generation_key(convo_id)
+        try:
+            generation = self._redis.get(generation_key)
+            pending = self._redis.lrange(pending_key, 0, -1)
+        except Exception as e:
+            logger.error(f"❌ Error reading recent message state for convo_id {convo_id}: {str(e)}")
+            return self._load(convo_id)
+        entries = {entry["id"]: entry for entry in self._load(convo_id)}
+        for item in pending:
+            entry = json.loads(item)
+            entries.setdefault(entry["id"], entry)
+        entries = [entries[message_id] for message_id in sorted(entries)][-self.size:]
+        if not entries:
+            return entries
+        try:
+            with self._redis.pipeline() as pipe:
+                pipe.watch(generation_key, pending_key)
+                if pipe.get(generation_key) != generation or pipe.llen(pending_key) != len(pending):
+                    return entries
+                pipe.multi()
+                pipe.delete(key, pending_key)
+                pipe.rpush(key, *[json.dumps(entry) for entry in entries])
+                pipe.expire(key, self.ttl)
+                pipe.execute()
+            logger.info(f"Hydrated recent message buffer for convo_id {convo_id} with {len(entries)} messages")
+        except redis.WatchError:
+            logger.info(f"Skipped hydrating recent message buffer for convo_id {convo_id}: a message was logged concurrently")
+        except Exception as e:
+            logger.error(f"❌ Error hydrating recent message buffer for convo_id {convo_id}: {str(e)}")
+        return entries
+
+    def recent(self, convo_id, count=None):
+        """Return up to ``count`` (default: all buffered) most recent messages, oldest first."""
+        try:
+            raw = self._redis.lrange(self._key(convo_id), 0, -1)
+        except Exception as e:
+            logger.error(f"❌ Error reading recent message buffer for convo_id {convo_id}: {str(e)}")
+            raw = None
+        if raw:
+            entries = {}
+            for item in raw:
+                entry = json.loads(item)
+                entries[entry["id"]] = entry
+            entries = [entries[message_id] for message_id in sorted(entries)]
+        else:
+            entries = self._hydrate(convo_id)
+        return entries[-count:] if count else entries
+
+    def since(self, convo_id, since, since_id=None):
+        """
+        Return the buffered messages after the ``(since, since_id)`` cursor in
+        ``(timestamp, id)`` order, or None if the buffer may not hold all of
+        them. Without ``since_id`` every message at ``since`` is skipped.
+        """
+        entries = self.recent(convo_id)
+        cursor = (_parse_timestamp(since), float("inf") if since_id is None else since_id)
+
+        def position(entry):
+            return (_parse_timestamp(entry["timestamp"]), entry["id"])
+
+        if len(entries) >= self.size and position(entries[0]) > cursor:
+            return None
+        return sorted((entry for entry in entries if position(entry) > cursor), key=position)
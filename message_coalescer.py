@@ -0,0 +1,136 @@
+"""
+Per-chat coalescing of inbound WhatsApp messages into one AI turn.
+
+Guests often send several short messages in a row. Each message is still
+logged and shown to agents immediately, but instead of answering it the
+worker appends it to ``coalesce:<chat_id>`` in Redis and schedules a flush
+once the chat has been quiet for ``WHATSAPP_COALESCE_WINDOW`` seconds. Every
+new message pushes the deadline back, up to ``WHATSAPP_COALESCE_MAX_WAIT``
+seconds after the first message of the turn. The flush atomically takes all
+pending messages, so exactly one flush answers them; flushes that run before
+the deadline find nothing to do yet and are rescheduled. A flush that fails
+before its reply is queued puts the messages back with ``restore``, ahead of
+anything that arrived in the meantime.
+
+Deadlines use the Redis server clock, so workers with skewed clocks agree.
+A window of 0 disables coalescing.
+"""
+import json
+import logging
+import os
+
+logger = logging.getLogger("chat_server")
+
+WHATSAPP_COALESCE_WINDOW = float(os.getenv("WHATSAPP_COALESCE_WINDOW", 1.5))
+WHATSAPP_COALESCE_MAX_WAIT = float(os.getenv("WHATSAPP_COALESCE_MAX_WAIT", 5.0))
+# Pending messages are dropped if no flush picks them up within this many seconds
+COALESCE_TTL = 300
+
+# KEYS: pending list, turn state hash
+# ARGV: entry, window (ms), max wait (ms), ttl (s)
+# Returns milliseconds until the turn's deadline
+ADD_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) * 1000 + math.floor(tonumber(now_parts[2]) / 1000)
+redis.call('RPUSH', KEYS[1], ARGV[1])
+local first = tonumber(redis.call('HGET', KEYS[2], 'first'))
+if not first then
+    first = now
+    redis.call('HSET', KEYS[2], 'first', first)
+end
+local deadline = math.min(now + tonumber(ARGV[2]), first + tonumber(ARGV[3]))
+redis.call('HSET', KEYS[2], 'deadline', deadline)
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+redis.call('EXPIRE', KEYS[2], ARGV[4])
+return deadline - now
+"""
+
+# KEYS: pending list, turn state hash
+# Returns {0, ms until deadline} while the window is open, {0, -1} if nothing
+# is pending, or {1, entries...} after removing the pending messages
+TAKE_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) * 1000 + math.floor(tonumber(now_parts[2]) / 1000)
+local deadline = tonumber(redis.call('HGET', KEYS[2], 'deadline'))
+if deadline and now < deadline then
+    return {0, deadline - now}
+end
+local entries = redis.call('LRANGE', KEYS[1], 0, -1)
+redis.call('DEL', KEYS[1], KEYS[2])
+if #entries == 0 then
+    return {0, -1}
+end
+local result = {1}
+for i = 1, #entries do
+    result[i + 1] = entries[i]
+end
+return result
+"""
+
+# KEYS: pending list, turn state hash
+# ARGV: ttl (s), entries... (oldest first)
+RESTORE_SCRIPT = """
+for i = #ARGV, 2, -1 do
+    redis.call('LPUSH', KEYS[1], ARGV[i])
+end
+if redis.call('HEXISTS', KEYS[2], 'first') == 0 then
+    local now_parts = redis.call('TIME')
+    redis.call('HSET', KEYS[2], 'first', tonumber(now_parts[1]) * 1000 + math.floor(tonumber(now_parts[2]) / 1000))
+end
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+return #ARGV - 1
+"""
+
+
+class MessageCoalescer:
+    """
+    Args:
+        redis_client: Synchronous redis client created with ``decode_responses=True``.
+        window (float): Quiet period in seconds that ends a turn.
+        max_wait (float): Longest a turn stays open after its first message.
+    """
+
+    def __init__(self, redis_client, window=WHATSAPP_COALESCE_WINDOW, max_wait=WHATSAPP_COALESCE_MAX_WAIT):
+        self._redis = redis_client
+        self.window = window
+        self.max_wait = max_wait
+        self._add = redis_client.register_script(ADD_SCRIPT)
+        self._take = redis_client.register_script(TAKE_SCRIPT)
+        self._restore = redis_client.register_script(RESTORE_SCRIPT)
+
+    @property
+    def enabled(self):
+        return self.window > 0
+
+    @staticmethod
+    def _keys(chat_id):
+        return [f"coalesce:{chat_id}", f"coalesce_turn:{chat_id}"]
+
+    def add(self, chat_id, message, timestamp):
+        """Queue a message for the chat's current turn and return seconds until the turn may be flushed."""
+        entry = json.dumps({"message": message, "timestamp": timestamp})
+        delay_ms = self._add(
+            keys=self._keys(chat_id),
+            args=[entry, int(self.window * 1000), int(self.max_wait * 1000), COALESCE_TTL]
+        )
+        return max(int(delay_ms), 0) / 1000
+
+    def take(self, chat_id):
+        """
+        Return ``(messages, retry_in)``: the pending messages (oldest first) once
+        the turn's deadline has passed, otherwise ``None`` and the seconds left
+        (or ``None`` if nothing is pending).
+        """
+        result = self._take(keys=self._keys(chat_id))
+        if int(result[0]) == 1:
+            return [json.loads(entry) for entry in result[1:]], None
+        remaining = int(result[1])
+        return None, (remaining / 1000 if remaining >= 0 else None)
+
+    def restore(self, chat_id, messages):
+        """Put messages returned by ``take`` back at the front of the chat's pending turn."""
+        if not messages:
+            return
+        entries = [json.dumps({"message": entry["message"], "timestamp": entry["timestamp"]}) for entry in messages]
+        self._restore(keys=self._keys(chat_id), args=[COALESCE_TTL] + entries)
@@ -0,0 +1,204 @@
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+logger = logging.getLogger("chat_server")
+
+INSERT_SQL = "INSERT INTO messages (id, convo_id, username, message, sender, timestamp) VALUES %s"
+# Errors caused by the row itself; retrying the same row can never succeed
+REJECTED_ERRORS = (psycopg2.DataError, psycopg2.IntegrityError)
+
+
+class MessageWriteBehind:
+    """
+    Buffers message inserts in-process and writes them in batches.
+
+    Message ids are reserved from the ``messages`` id sequence in blocks, so
+    ``submit`` can hand the id and timestamp back to the caller immediately
+    without touching the database. A background thread flushes the buffer with
+    a single ``execute_values`` INSERT when ``batch_size`` rows are waiting or
+    ``flush_interval`` seconds have passed, and ``close`` (registered with
+    ``atexit``) flushes whatever is left on shutdown.
+
+    If a batch INSERT fails, the rows are retried one at a time so a single bad
+    row cannot block the rest of the buffer. Rows rejected by the database
+    (data or integrity errors) are logged and kept in ``rejected`` (up to
+    ``max_rejected``); on any other error the unwritten rows go back to the
+    front of the buffer for the next flush.
+
+    Ids are only monotonic within a process: two workers holding different
+    blocks can commit messages slightly out of id order.
+
+    Args:
+        lease (callable): Returns a context manager yielding a pooled connection.
+        batch_size (int): Rows that trigger an immediate flush.
+        flush_interval (float): Maximum seconds a row waits before being flushed.
+        id_block_size (int): Sequence values reserved per round trip.
+        max_buffer (int): Rows buffered before ``submit`` flushes synchronously,
+            bounding memory when the database is unavailable.
+        on_flush (callable): Called with the set of conversation ids written by
+            each successful flush, e.g. to invalidate caches.
+        max_rejected (int): Rejected rows kept in memory for inspection.
+    """
+
+    def __init__(self, lease, batch_size=200, flush_interval=0.5, id_block_size=100, max_buffer=10000, on_flush=None,
+                 max_rejected=1000):
+        self._lease = lease
+        self._on_flush = on_flush
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.id_block_size = id_block_size
+        self.max_buffer = max_buffer
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._buffer = deque()
+        self._ids = deque()
+        self.rejected = deque(maxlen=max_rejected)
+        self._sequence = None
+        self._closed = False
+
+        self._flushed = 0
+        self._flushes = 0
+        self._failures = 0
+        self._rejected = 0
+
+        self._thread = threading.Thread(target=self._run, name="message-write-behind", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _reserve_ids(self):
+        with self._lease() as conn:
+            c = conn.cursor()
+            if self._sequence is None:
+                c.execute("SELECT pg_get_serial_sequence('messages', 'id')")
+                self._sequence = c.fetchone()[0]
+            c.execute("SELECT nextval(%s) FROM generate_series(1, %s)", (self._sequence, self.id_block_size))
+            return [row[0] for row in c.fetchall()]
+
+    def _next_id(self):
+        with self._lock:
+            if self._ids:
+                return self._ids.popleft()
+        ids = self._reserve_ids()
+        with self._lock:
+            self._ids.extend(ids[1:])
+        return ids[0]
+
+    def submit(self, convo_id, username, message, sender, timestamp):
+        """Queue a message insert and return its ``(message_id, timestamp)``."""
+        if self._closed:
+            raise RuntimeError("message writer is closed")
+        message_id = self._next_id()
+        with self._lock:
+            self._buffer.append((message_id, convo_id, username, message, sender, timestamp))
+            pending = len(self._buffer)
+        if pending >= self.max_buffer:
+            logger.warning(f"Message write-behind buffer holds {pending} rows, flushing synchronously")
+            self.flush()
+        elif pending >= self.batch_size:
+            self._wakeup.set()
+        return message_id, timestamp
+
+    def _insert(self, rows):
+        with self._lease() as conn:
+            c = conn.cursor()
+            execute_values(c, INSERT_SQL, rows, page_size=len(rows))
+
+    def _insert_each(self, rows):
+        """
+        Insert ``rows`` one per transaction after a failed batch and return
+        ``(written, error)``. Rejected rows are set aside; on any other error the
+        unwritten rows are put back at the front of the buffer and returned as
+        ``error``.
+        """
+        written = []
+        for index, row in enumerate(rows):
+            try:
+                self._insert([row])
+            except REJECTED_ERRORS as e:
+                with self._lock:
+                    self.rejected.append(row)
+                    self._rejected += 1
+                logger.error(f"❌ Dropping buffered message {row[0]} for conversation {row[1]}: {str(e)}")
+                continue
+            except Exception as e:
+                with self._lock:
+                    self._buffer.extendleft(reversed(rows[index:]))
+                return written, e
+            written.append(row)
+        return written, None
+
+    def flush(self):
+        """Write all buffered rows, falling back to one row at a time if the batch fails."""
+        with self._flush_lock:
+            with self._lock:
+                rows = list(self._buffer)
+                self._buffer.clear()
+            if not rows:
+                return 0
+            error = None
+            try:
+                self._insert(rows)
+                written = rows
+            except Exception as e:
+                with self._lock:
+                    self._failures += 1
+                logger.error(f"❌ Failed to flush {len(rows)} buffered messages, retrying one at a time: {str(e)}")
+                written, error = self._insert_each(rows)
+            if written:
+                with self._lock:
+                    self._flushed += len(written)
+                    self._flushes += 1
+                logger.info(f"✅ Flushed {len(written)} buffered messages")
+                if self._on_flush is not None:
+                    try:
+                        self._on_flush({row[1] for row in written})
+                    except Exception as e:
+                        logger.error(f"❌ Error in message write-behind flush callback: {str(e)}")
+            if error is not None:
+                with self._lock:
+                    pending = len(self._buffer)
+                logger.error(f"❌ Failed to write buffered messages, {pending} kept for the next flush: {str(error)}")
+                raise error
+            return len(written)
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                # Already logged; rows stay buffered for the next attempt
+                time.sleep(self.flush_interval)
+
+    def close(self):
+        """Stop the background thread and flush remaining rows."""
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        try:
+            self.flush()
+        except Exception:
+            with self._lock:
+                lost = len(self._buffer)
+            logger.error(f"❌ {lost} buffered messages could not be written on shutdown")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending": len(self._buffer),
+                "reserved_ids": len(self._ids),
+                "flushed": self._flushed,
+                "flushes": self._flushes,
+                "failures": self._failures,
+                "rejected": self._rejected,
+            }
@@ -0,0 +1,212 @@
+"""
+Versioned schema migrations.
+
+Migrations live in ``migrations/NNNN_description.py`` and define
+``upgrade(conn)``. They are applied in order and recorded in the
+``schema_version`` table. A migration runs inside a single transaction
+together with its version row unless it sets ``TRANSACTIONAL = False``, in
+which case it gets an autocommit connection (needed for batched backfills and
+CREATE INDEX CONCURRENTLY) and must be safe to re-run if interrupted.
+
+Run once per deploy, before the web and worker processes start:
+
+    python migrate.py upgrade     # apply pending migrations (default)
+    python migrate.py status      # show applied and pending migrations
+    python migrate.py seed        # insert development data (requires SEED_INITIAL_DATA=true)
+
+Application processes only call ``current_version`` at startup.
+"""
+import argparse
+import importlib.util
+import logging
+import os
+import re
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+import psycopg2
+from psycopg2.extras import DictCursor
+
+logger = logging.getLogger("chat_server")
+
+MIGRATIONS_DIR = Path(__file__).parent.absolute() / "migrations"
+MIGRATION_FILE_RE = re.compile(r"^(\d{4})_(\w+)\.py$")
+# Arbitrary application-wide key for pg_advisory_lock so only one process migrates at a time
+MIGRATION_LOCK_ID = 727001
+
+
+def discover_migrations():
+    """Return ``[(version, name, path)]`` for every migration file, sorted by version."""
+    migrations = []
+    for path in MIGRATIONS_DIR.iterdir():
+        match = MIGRATION_FILE_RE.match(path.name)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), path))
+    migrations.sort()
+    versions = [version for version, _, _ in migrations]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError(f"Duplicate migration versions in {MIGRATIONS_DIR}")
+    return migrations
+
+
+def latest_version():
+    migrations = discover_migrations()
+    return migrations[-1][0] if migrations else 0
+
+
+def current_version(conn):
+    """Return the highest applied migration version, or 0 if none have been recorded."""
+    c = conn.cursor()
+    c.execute("SELECT to_regclass('schema_version') IS NOT NULL")
+    if not c.fetchone()[0]:
+        return 0
+    c.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    return c.fetchone()[0]
+
+
+def load_migration(path):
+    spec = importlib.util.spec_from_file_location(f"migrations.{path.stem}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def connect():
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        raise ValueError("DATABASE_URL environment variable is not set")
+    database_url = database_url.replace("postgres://", "postgresql://", 1)
+    return psycopg2.connect(
+        database_url,
+        sslmode=os.getenv("DATABASE_SSLMODE", "require"),
+        connect_timeout=10,
+        cursor_factory=DictCursor
+    )
+
+
+def upgrade(conn):
+    """Apply all pending migrations. Returns the list of applied versions."""
+    conn.autocommit = True
+    c = conn.cursor()
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    """)
+    c.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+    applied = []
+    try:
+        current = current_version(conn)
+        for version, name, path in discover_migrations():
+            if version <= current:
+                continue
+            module = load_migration(path)
+            transactional = getattr(module, "TRANSACTIONAL", True)
+            logger.info(f"Applying migration {version:04d}_{name} (transactional={transactional})")
+            if transactional:
+                conn.autocommit = False
+                try:
+                    module.upgrade(conn)
+                    conn.cursor().execute(
+                        "INSERT INTO schema_version (version, name) VALUES (%s, %s)",
+                        (version, name)
+                    )
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                finally:
+                    conn.autocommit = True
+            else:
+                module.upgrade(conn)
+                conn.cursor().execute(
+                    "INSERT INTO schema_version (version, name) VALUES (%s, %s)",
+                    (version, name)
+                )
+            applied.append(version)
+            logger.info(f"✅ Applied migration {version:04d}_{name}")
+    finally:
+        conn.cursor().execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+    return applied
+
+
+def status(conn):
+    current = current_version(conn)
+    for version, name, _ in discover_migrations():
+        state = "applied" if version <= current else "pending"
+        print(f"{version:04d}_{name}: {state}")
+
+
+def seed(conn):
+    """Insert default settings, an admin agent and test conversations into an empty database."""
+    if os.getenv("SEED_INITIAL_DATA", "false").lower() != "true":
+        logger.info("Skipping seed data (SEED_INITIAL_DATA not enabled)")
+        return
+    now = datetime.now(timezone.utc).isoformat()
+    with conn:
+        c = conn.cursor()
+        c.execute(
+            "INSERT INTO settings (key, value, last_updated) VALUES (%s, %s, %s) ON CONFLICT (key) DO NOTHING",
+            ('ai_enabled', '1', now)
+        )
+        c.execute("INSERT INTO agents (username) VALUES (%s) ON CONFLICT (username) DO NOTHING", ('admin',))
+
+        c.execute("SELECT COUNT(*) FROM conversations WHERE channel = %s", ('whatsapp',))
+        if c.fetchone()[0] == 0:
+            for username, chat_id, message, timestamp, language in [
+                ('TestUser1', '123456789', 'Hello, I need help!', "2025-03-22T00:00:00Z", 'en'),
+                ('TestUser2', '987654321', 'Hola, ¿puedo reservar una habitación?', "2025-03-22T00:00:01Z", 'es'),
+            ]:
+                c.execute(
+                    "INSERT INTO conversations (username, chat_id, channel, ai_enabled, needs_agent, last_updated, language) "
+                    "VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id",
+                    (username, chat_id, 'whatsapp', 1, 0, timestamp, language)
+                )
+                convo_id = c.fetchone()['id']
+                c.execute(
+                    "INSERT INTO messages (convo_id, username, message, sender, timestamp) VALUES (%s, %s, %s, %s, %s)",
+                    (convo_id, username, message, 'user', timestamp)
+                )
+            logger.info("Inserted test WhatsApp conversations")
+
+        c.execute("SELECT COUNT(*) FROM conversations WHERE channel = %s", ('test',))
+        if c.fetchone()[0] == 0:
+            for i in range(1, 6):
+                c.execute(
+                    "INSERT INTO conversations (username, chat_id, channel, ai_enabled, needs_agent, visible_in_conversations, last_updated) "
+                    "VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id",
+                    (f"test_user_{i}", f"test_chat_{i}", "test", 1, 0, 0, now)
+                )
+                convo_id = c.fetchone()['id']
+                c.execute(
+                    "INSERT INTO messages (convo_id, username, sender, message, timestamp) VALUES (%s, %s, %s, %s, %s)",
+                    (convo_id, f"test_user_{i}", "user", f"Test message {i}", now)
+                )
+            logger.info("Inserted test conversations")
+    logger.info("✅ Seed data applied")
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Apply versioned schema migrations")
+    parser.add_argument("command", nargs="?", default="upgrade", choices=["upgrade", "status", "seed"])
+    args = parser.parse_args(argv)
+
+    conn = connect()
+    try:
+        if args.command == "upgrade":
+            applied = upgrade(conn)
+            logger.info(f"Schema at version {latest_version()} ({len(applied)} migration(s) applied)")
+        elif args.command == "status":
+            status(conn)
+        elif args.command == "seed":
+            seed(conn)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
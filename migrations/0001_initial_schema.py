@@ -0,0 +1,57 @@
+"""Baseline schema. Idempotent so it can be applied to databases created by the old init_db()."""
+import logging
+
+logger = logging.getLogger("chat_server")
+
+
+def upgrade(conn):
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS conversations (
+        id SERIAL PRIMARY KEY,
+        username TEXT NOT NULL,
+        chat_id TEXT NOT NULL,
+        channel TEXT NOT NULL,
+        assigned_agent TEXT,
+        ai_enabled INTEGER DEFAULT 1,
+        needs_agent INTEGER DEFAULT 0,
+        booking_intent TEXT,
+        handoff_notified INTEGER DEFAULT 0,
+        visible_in_conversations INTEGER DEFAULT 1,
+        language TEXT DEFAULT 'en',
+        last_updated TEXT DEFAULT CURRENT_TIMESTAMP
+    )''')
+    # Columns added to conversations over time
+    c.execute("ALTER TABLE conversations ADD COLUMN IF NOT EXISTS needs_agent INTEGER DEFAULT 0")
+    c.execute("ALTER TABLE conversations ADD COLUMN IF NOT EXISTS language TEXT DEFAULT 'en'")
+    c.execute("ALTER TABLE conversations ADD COLUMN IF NOT EXISTS booking_intent TEXT")
+    c.execute("ALTER TABLE conversations ADD COLUMN IF NOT EXISTS handoff_notified INTEGER DEFAULT 0")
+    c.execute("ALTER TABLE conversations ADD COLUMN IF NOT EXISTS visible_in_conversations INTEGER DEFAULT 1")
+
+    c.execute('''CREATE TABLE IF NOT EXISTS messages (
+        id SERIAL PRIMARY KEY,
+        convo_id INTEGER NOT NULL,
+        username TEXT NOT NULL,
+        message TEXT NOT NULL,
+        sender TEXT NOT NULL,
+        timestamp TEXT DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (convo_id) REFERENCES conversations (id)
+    )''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS agents (
+        id SERIAL PRIMARY KEY,
+        username TEXT NOT NULL UNIQUE
+    )''')
+    # Agents authenticate by username only
+    c.execute("ALTER TABLE agents DROP COLUMN IF EXISTS password_hash")
+    c.execute("ALTER TABLE agents DROP COLUMN IF EXISTS password")
+
+    c.execute('''CREATE TABLE IF NOT EXISTS settings (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL,
+        last_updated TEXT DEFAULT CURRENT_TIMESTAMP
+    )''')
+    c.execute("ALTER TABLE settings ADD COLUMN IF NOT EXISTS last_updated TEXT DEFAULT CURRENT_TIMESTAMP")
+
+    c.execute("CREATE INDEX IF NOT EXISTS idx_messages_convo_id ON messages (convo_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_settings_key ON settings (key)")
+    logger.info("Applied baseline schema")
@@ -0,0 +1,29 @@
+"""One conversation per (chat_id, channel) so ingestion can upsert with ON CONFLICT."""
+import logging
+
+logger = logging.getLogger("chat_server")
+
+
+def upgrade(conn):
+    c = conn.cursor()
+    # Fold duplicate conversations into the oldest one before enforcing uniqueness
+    c.execute("""
+        UPDATE messages m SET convo_id = d.keep_id
+        FROM (
+            SELECT id, MIN(id) OVER (PARTITION BY chat_id, channel) AS keep_id
+            FROM conversations
+        ) d
+        WHERE m.convo_id = d.id AND d.id <> d.keep_id
+    """)
+    c.execute("""
+        DELETE FROM conversations c
+        USING (
+            SELECT id, MIN(id) OVER (PARTITION BY chat_id, channel) AS keep_id
+            FROM conversations
+        ) d
+        WHERE c.id = d.id AND d.id <> d.keep_id
+    """)
+    logger.info(f"Merged {c.rowcount} duplicate conversations")
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_conversations_chat_id_channel ON conversations (chat_id, channel)")
+    # Covered by the unique (chat_id, channel) index
+    c.execute("DROP INDEX IF EXISTS idx_conversations_chat_id")
@@ -0,0 +1,93 @@
+"""
+Convert TEXT timestamps to timestamptz and add range-scan indexes for message
+history and the agent dashboard.
+"""
+import logging
+
+logger = logging.getLogger("chat_server")
+
+# Runs in autocommit mode: the backfill commits per batch and the indexes are
+# built with CREATE INDEX CONCURRENTLY.
+TRANSACTIONAL = False
+
+TIMESTAMP_COLUMNS = [("messages", "timestamp"), ("conversations", "last_updated")]
+BACKFILL_BATCH_SIZE = 5000
+
+
+def migrate_timestamp_column(conn, table, column):
+    """
+    Convert a TEXT timestamp column to timestamptz without holding a long table lock.
+
+    A shadow column is kept in sync by a trigger while existing rows are
+    backfilled in small autocommitted batches; the final swap only locks the
+    table long enough to convert stragglers and rename the columns.
+    """
+    shadow = f"{column}_tz"
+    trigger_fn = f"{table}_{shadow}_sync"
+    c = conn.cursor()
+    c.execute(
+        "SELECT data_type FROM information_schema.columns WHERE table_name = %s AND column_name = %s",
+        (table, column)
+    )
+    result = c.fetchone()
+    if not result or result['data_type'] != 'text':
+        return
+    logger.info(f"Migrating {table}.{column} from TEXT to timestamptz")
+    c.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {shadow} TIMESTAMPTZ")
+    c.execute(f"""
+        CREATE OR REPLACE FUNCTION {trigger_fn}() RETURNS trigger AS $$
+        BEGIN
+            NEW.{shadow} := NEW.{column}::timestamptz;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    c.execute(f"DROP TRIGGER IF EXISTS {trigger_fn} ON {table}")
+    c.execute(f"CREATE TRIGGER {trigger_fn} BEFORE INSERT OR UPDATE OF {column} ON {table} FOR EACH ROW EXECUTE FUNCTION {trigger_fn}()")
+    backfilled = 0
+    while True:
+        c.execute(
+            f"UPDATE {table} SET {shadow} = {column}::timestamptz "
+            f"WHERE id IN (SELECT id FROM {table} WHERE {shadow} IS NULL AND {column} IS NOT NULL LIMIT %s)",
+            (BACKFILL_BATCH_SIZE,)
+        )
+        if c.rowcount == 0:
+            break
+        backfilled += c.rowcount
+    logger.info(f"Backfilled {backfilled} rows of {table}.{shadow}")
+
+    conn.autocommit = False
+    try:
+        c.execute(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE")
+        c.execute(f"UPDATE {table} SET {shadow} = {column}::timestamptz WHERE {shadow} IS NULL AND {column} IS NOT NULL")
+        c.execute(f"DROP TRIGGER IF EXISTS {trigger_fn} ON {table}")
+        c.execute(f"DROP FUNCTION IF EXISTS {trigger_fn}()")
+        c.execute(f"ALTER TABLE {table} DROP COLUMN {column}")
+        c.execute(f"ALTER TABLE {table} RENAME COLUMN {shadow} TO {column}")
+        c.execute(f"ALTER TABLE {table} ALTER COLUMN {column} SET DEFAULT now()")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.autocommit = True
+    logger.info(f"✅ Migrated {table}.{column} to timestamptz")
+
+
+def upgrade(conn):
+    for table, column in TIMESTAMP_COLUMNS:
+        migrate_timestamp_column(conn, table, column)
+
+    c = conn.cursor()
+    # Range scans for /messages history and the agent dashboard. Built
+    # concurrently so writes are not blocked on large tables.
+    c.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_messages_convo_id_timestamp ON messages (convo_id, timestamp)")
+    logger.info("Created index idx_messages_convo_id_timestamp")
+    c.execute(
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_conversations_needs_agent_last_updated "
+        "ON conversations (last_updated DESC) WHERE needs_agent = 1"
+    )
+    logger.info("Created index idx_conversations_needs_agent_last_updated")
+    # Superseded by idx_messages_convo_id_timestamp
+    c.execute("DROP INDEX CONCURRENTLY IF EXISTS idx_messages_convo_id")
+    c.execute("DROP INDEX CONCURRENTLY IF EXISTS idx_messages_timestamp")
@@ -0,0 +1,12 @@
+"""Keyset pagination of message history by (convo_id, id)."""
+import logging
+
+logger = logging.getLogger("chat_server")
+
+TRANSACTIONAL = False
+
+
+def upgrade(conn):
+    c = conn.cursor()
+    c.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_messages_convo_id_id ON messages (convo_id, id)")
+    logger.info("Created index idx_messages_convo_id_id")
@@ -0,0 +1,83 @@
+"""
+Per-conversation summary columns maintained by a trigger on every message
+insert, so the agent inbox can be rendered from the conversations table alone.
+"""
+import logging
+
+logger = logging.getLogger("chat_server")
+
+
+def upgrade(conn):
+    c = conn.cursor()
+    c.execute("ALTER TABLE conversations ADD COLUMN IF NOT EXISTS last_message TEXT")
+    c.execute("ALTER TABLE conversations ADD COLUMN IF NOT EXISTS last_message_sender TEXT")
+    c.execute("ALTER TABLE conversations ADD COLUMN IF NOT EXISTS last_message_at TIMESTAMPTZ")
+    c.execute("ALTER TABLE conversations ADD COLUMN IF NOT EXISTS message_count INTEGER NOT NULL DEFAULT 0")
+    # Guest messages since an agent last replied or opened the conversation
+    c.execute("ALTER TABLE conversations ADD COLUMN IF NOT EXISTS unread_agent_count INTEGER NOT NULL DEFAULT 0")
+    # Time of the oldest guest message that has not been answered yet
+    c.execute("ALTER TABLE conversations ADD COLUMN IF NOT EXISTS waiting_since TIMESTAMPTZ")
+
+    c.execute("""
+        CREATE OR REPLACE FUNCTION conversation_summary_on_message() RETURNS trigger AS $$
+        BEGIN
+            UPDATE conversations SET
+                last_message = CASE WHEN last_message_at IS NULL OR NEW.timestamp >= last_message_at
+                                    THEN NEW.message ELSE last_message END,
+                last_message_sender = CASE WHEN last_message_at IS NULL OR NEW.timestamp >= last_message_at
+                                           THEN NEW.sender ELSE last_message_sender END,
+                last_message_at = GREATEST(last_message_at, NEW.timestamp),
+                message_count = message_count + 1,
+                unread_agent_count = CASE NEW.sender
+                                         WHEN 'user' THEN unread_agent_count + 1
+                                         WHEN 'agent' THEN 0
+                                         ELSE unread_agent_count END,
+                waiting_since = CASE WHEN NEW.sender = 'user' THEN COALESCE(waiting_since, NEW.timestamp)
+                                     ELSE NULL END
+            WHERE id = NEW.convo_id;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    c.execute("DROP TRIGGER IF EXISTS conversation_summary_on_message ON messages")
+    c.execute("""
+        CREATE TRIGGER conversation_summary_on_message
+        AFTER INSERT ON messages
+        FOR EACH ROW EXECUTE FUNCTION conversation_summary_on_message()
+    """)
+
+    # Backfill existing conversations
+    c.execute("""
+        UPDATE conversations c SET
+            last_message = latest.message,
+            last_message_sender = latest.sender,
+            last_message_at = latest.timestamp,
+            message_count = counts.total,
+            unread_agent_count = counts.unread,
+            waiting_since = counts.waiting_since
+        FROM (
+            SELECT DISTINCT ON (convo_id) convo_id, message, sender, timestamp
+            FROM messages
+            ORDER BY convo_id, timestamp DESC, id DESC
+        ) latest
+        JOIN (
+            SELECT m.convo_id,
+                   COUNT(*) AS total,
+                   COUNT(*) FILTER (WHERE m.sender = 'user' AND m.timestamp > COALESCE(r.last_agent, '-infinity')) AS unread,
+                   MIN(m.timestamp) FILTER (WHERE m.sender = 'user' AND m.timestamp > COALESCE(r.last_reply, '-infinity')) AS waiting_since
+            FROM messages m
+            LEFT JOIN (
+                SELECT convo_id,
+                       MAX(timestamp) FILTER (WHERE sender = 'agent') AS last_agent,
+                       MAX(timestamp) FILTER (WHERE sender <> 'user') AS last_reply
+                FROM messages
+                GROUP BY convo_id
+            ) r ON r.convo_id = m.convo_id
+            GROUP BY m.convo_id
+        ) counts ON counts.convo_id = latest.convo_id
+        WHERE c.id = latest.convo_id
+    """)
+    logger.info(f"Backfilled summaries for {c.rowcount} conversations")
+
+    # Inbox listing for /all-whatsapp-messages
+    c.execute("CREATE INDEX IF NOT EXISTS idx_conversations_channel_last_updated ON conversations (channel, last_updated DESC)")
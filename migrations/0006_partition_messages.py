@@ -0,0 +1,99 @@
+"""
+Range-partition messages by month so history queries, indexes and vacuum only
+touch recent partitions and expired months can be archived by dropping a table.
+
+The whole migration runs in one transaction that holds an ACCESS EXCLUSIVE
+lock on messages from the start, so every read and write of messages (and so
+message logging and the dashboard) blocks until it commits. The copy and the
+index builds take most of that time: 1M messages (236 MB with indexes) took
+17 s on a local Postgres 16 with default settings, and the time grows roughly
+linearly with the table size. Estimate from ``pg_total_relation_size('messages')``
+and run it in a maintenance window with the web and worker processes stopped.
+
+The partition DDL is written out here rather than imported from
+message_archive so the migration does not change when that module does.
+"""
+import logging
+from datetime import datetime, timezone
+
+logger = logging.getLogger("chat_server")
+
+# Monthly partitions are created through this many months past the current one;
+# after this migration the maintain_message_partitions beat task keeps ahead.
+PARTITIONS_AHEAD = 3
+
+
+def _month_start(value):
+    return datetime(value.year, value.month, 1, tzinfo=timezone.utc)
+
+
+def _add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def upgrade(conn):
+    c = conn.cursor()
+    c.execute("SELECT relkind FROM pg_class WHERE oid = 'messages'::regclass")
+    if c.fetchone()[0] == 'p':
+        return
+
+    c.execute("LOCK TABLE messages IN ACCESS EXCLUSIVE MODE")
+    c.execute("SELECT pg_get_serial_sequence('messages', 'id')")
+    sequence = c.fetchone()[0]
+    c.execute("ALTER TABLE messages RENAME TO messages_unpartitioned")
+    c.execute("ALTER TABLE messages_unpartitioned RENAME CONSTRAINT messages_pkey TO messages_unpartitioned_pkey")
+    c.execute("DROP INDEX IF EXISTS idx_messages_convo_id_timestamp")
+    c.execute("DROP INDEX IF EXISTS idx_messages_convo_id_id")
+
+    # The partition key must be part of the primary key; ids still come from
+    # the original sequence, so they stay unique on their own.
+    c.execute(f"""
+        CREATE TABLE messages (
+            id INTEGER NOT NULL DEFAULT nextval('{sequence}'),
+            convo_id INTEGER NOT NULL REFERENCES conversations (id),
+            username TEXT NOT NULL,
+            message TEXT NOT NULL,
+            sender TEXT NOT NULL,
+            timestamp TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (id, timestamp)
+        ) PARTITION BY RANGE (timestamp)
+    """)
+    c.execute(f"ALTER SEQUENCE {sequence} OWNED BY messages.id")
+    # Catch-all so an insert never fails for lack of a partition; kept empty by
+    # creating monthly partitions ahead of time.
+    c.execute("CREATE TABLE messages_default PARTITION OF messages DEFAULT")
+
+    c.execute("SELECT MIN(timestamp) FROM messages_unpartitioned")
+    oldest = c.fetchone()[0]
+    current = _month_start(datetime.now(timezone.utc))
+    month = _month_start(oldest) if oldest else current
+    last = _add_months(current, PARTITIONS_AHEAD)
+    created = 0
+    while month <= last:
+        c.execute(
+            f"CREATE TABLE messages_p{month.year:04d}{month.month:02d} PARTITION OF messages "
+            f"FOR VALUES FROM (%s) TO (%s)",
+            (month, _add_months(month, 1))
+        )
+        created += 1
+        month = _add_months(month, 1)
+    logger.info(f"Created {created} monthly message partitions")
+
+    c.execute(
+        "INSERT INTO messages (id, convo_id, username, message, sender, timestamp) "
+        "SELECT id, convo_id, username, message, sender, COALESCE(timestamp, now()) FROM messages_unpartitioned"
+    )
+    logger.info(f"Copied {c.rowcount} messages into the partitioned table")
+    c.execute("DROP TABLE messages_unpartitioned")
+
+    # Created on the parent so every partition, present and future, gets them
+    c.execute("CREATE INDEX idx_messages_convo_id_timestamp ON messages (convo_id, timestamp)")
+    c.execute("CREATE INDEX idx_messages_convo_id_id ON messages (convo_id, id)")
+
+    # Recreated after the copy so existing rows are not counted twice in the summaries
+    c.execute("""
+        CREATE TRIGGER conversation_summary_on_message
+        AFTER INSERT ON messages
+        FOR EACH ROW EXECUTE FUNCTION conversation_summary_on_message()
+    """)
@@ -0,0 +1,15 @@
+"""
+Rolling summary of older turns, used by ai_respond in place of history that
+no longer fits the prompt's token budget.
+"""
+import logging
+
+logger = logging.getLogger("chat_server")
+
+
+def upgrade(conn):
+    c = conn.cursor()
+    c.execute("ALTER TABLE conversations ADD COLUMN IF NOT EXISTS history_summary TEXT")
+    # Id of the newest message folded into the summary
+    c.execute("ALTER TABLE conversations ADD COLUMN IF NOT EXISTS history_summary_through_id BIGINT NOT NULL DEFAULT 0")
+    logger.info("Added conversations.history_summary and conversations.history_summary_through_id")
@@ -0,0 +1,28 @@
+"""
+Local mirror of the nights booked in the resort's Google Calendar, kept up to
+date by the calendar sync task so availability checks can skip the API.
+"""
+import logging
+
+logger = logging.getLogger("chat_server")
+
+
+def upgrade(conn):
+    c = conn.cursor()
+    # One row per night covered by a "Fully Booked" event
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS calendar_booked_nights (
+            night DATE NOT NULL,
+            event_id TEXT NOT NULL,
+            PRIMARY KEY (night, event_id)
+        )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_calendar_booked_nights_event_id ON calendar_booked_nights (event_id)")
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS calendar_sync_state (
+            calendar_id TEXT PRIMARY KEY,
+            sync_token TEXT,
+            last_synced_at TIMESTAMPTZ
+        )
+    """)
+    logger.info("Created calendar_booked_nights and calendar_sync_state")
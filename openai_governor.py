@@ -0,0 +1,242 @@
+"""
+Cluster-wide OpenAI rate limiting.
+
+Every web and worker process acquires a slot from Redis before calling
+OpenAI. One Lua script checks, atomically:
+
+* a cooldown key, set for ``retry-after`` seconds when OpenAI answers 429;
+* a sorted set of in-flight calls (``OPENAI_MAX_CONCURRENCY``), whose scores
+  are expiry times so slots of crashed processes free themselves;
+* two token buckets refilled continuously, one for requests per minute
+  (``OPENAI_RPM_LIMIT``) and one for estimated tokens per minute
+  (``OPENAI_TPM_LIMIT``).
+
+A denied caller waits for the hinted time only while its total wait stays
+under ``OPENAI_MAX_QUEUE_WAIT`` seconds; otherwise it gets ``OpenAIDegraded``
+at once instead of sleeping in a worker. On release the token bucket is
+corrected with the call's actual usage. The OpenAI client must be created
+with ``max_retries=0`` so the SDK does not retry (and sleep out) 429s itself
+inside a held slot.
+
+Queue waits and outcomes are counted in the ``openai_governor:stats`` hash.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger("chat_server")
+
+OPENAI_RPM_LIMIT = int(os.getenv("OPENAI_RPM_LIMIT", 500))
+OPENAI_TPM_LIMIT = int(os.getenv("OPENAI_TPM_LIMIT", 200000))
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", 20))
+OPENAI_MAX_QUEUE_WAIT = float(os.getenv("OPENAI_MAX_QUEUE_WAIT", 2.0))
+OPENAI_SLOT_TTL = float(os.getenv("OPENAI_SLOT_TTL", 60))
+GOVERNOR_STATS_KEY = "openai_governor:stats"
+
+RPM_KEY = "openai_governor:rpm"
+TPM_KEY = "openai_governor:tpm"
+INFLIGHT_KEY = "openai_governor:inflight"
+COOLDOWN_KEY = "openai_governor:cooldown"
+
+# KEYS: rpm bucket, tpm bucket, in-flight zset, cooldown, stats hash
+# ARGV: rpm limit, tpm limit, max concurrency, token cost, slot id, slot ttl (ms), queue wait so far (ms)
+# Returns {granted, wait_ms, reason}; grants are counted in the stats hash
+ACQUIRE_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) * 1000 + math.floor(tonumber(now_parts[2]) / 1000)
+
+local cooldown = redis.call('PTTL', KEYS[4])
+if cooldown > 0 then
+    return {0, cooldown, 'cooldown'}
+end
+
+redis.call('ZREMRANGEBYSCORE', KEYS[3], '-inf', now)
+if redis.call('ZCARD', KEYS[3]) >= tonumber(ARGV[3]) then
+    local oldest = redis.call('ZRANGE', KEYS[3], 0, 0, 'WITHSCORES')
+    return {0, math.min(math.max(tonumber(oldest[2]) - now, 10), 100), 'concurrency'}
+end
+
+local function level(key, limit)
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or limit
+    local ts = tonumber(state[2]) or now
+    return math.min(limit, tokens + (now - ts) * limit / 60000)
+end
+
+local rpm_limit = tonumber(ARGV[1])
+local tpm_limit = tonumber(ARGV[2])
+local cost = math.min(tonumber(ARGV[4]), tpm_limit)
+local requests = level(KEYS[1], rpm_limit)
+local tokens = level(KEYS[2], tpm_limit)
+
+local wait = 0
+if requests < 1 then
+    wait = math.max(wait, (1 - requests) * 60000 / rpm_limit)
+end
+if tokens < cost then
+    wait = math.max(wait, (cost - tokens) * 60000 / tpm_limit)
+end
+if wait > 0 then
+    return {0, math.ceil(wait), 'rate'}
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(requests - 1), 'ts', now)
+redis.call('HSET', KEYS[2], 'tokens', tostring(tokens - cost), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], 120000)
+redis.call('PEXPIRE', KEYS[2], 120000)
+redis.call('ZADD', KEYS[3], now + tonumber(ARGV[6]), ARGV[5])
+redis.call('PEXPIRE', KEYS[3], tonumber(ARGV[6]) * 2)
+redis.call('HINCRBY', KEYS[5], 'acquired', 1)
+redis.call('HINCRBY', KEYS[5], 'queue_wait_ms', ARGV[7])
+return {1, 0, 'ok'}
+"""
+
+# KEYS: tpm bucket, in-flight zset
+# ARGV: slot id, token refund (negative when the call used more than estimated), tpm limit
+RELEASE_SCRIPT = """
+redis.call('ZREM', KEYS[2], ARGV[1])
+local refund = tonumber(ARGV[2])
+if refund ~= 0 then
+    local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens'))
+    if tokens then
+        redis.call('HSET', KEYS[1], 'tokens', tostring(math.min(tokens + refund, tonumber(ARGV[3]))))
+    end
+end
+return 1
+"""
+
+
+class OpenAIDegraded(Exception):
+    """Raised when an OpenAI slot is not available within the queue-wait budget."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f"OpenAI capacity exhausted ({reason}), retry in {retry_after:.1f}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class OpenAISlot:
+    """Handed to the caller inside ``OpenAIGovernor.slot``; set ``used_tokens`` from ``response.usage``."""
+
+    __slots__ = ("slot_id", "estimated_tokens", "used_tokens", "queue_wait")
+
+    def __init__(self, slot_id, estimated_tokens, queue_wait):
+        self.slot_id = slot_id
+        self.estimated_tokens = estimated_tokens
+        self.used_tokens = None
+        self.queue_wait = queue_wait
+
+
+class OpenAIGovernor:
+    """
+    Args:
+        redis_client: Async redis client created with ``decode_responses=True``.
+        rpm_limit (int): Requests per minute across the cluster.
+        tpm_limit (int): Tokens per minute across the cluster.
+        max_concurrency (int): Concurrent OpenAI calls across the cluster.
+        max_queue_wait (float): Seconds a caller may wait before ``OpenAIDegraded``.
+        slot_ttl (float): Seconds before the slot of a call that never released expires.
+    """
+
+    def __init__(self, redis_client, rpm_limit=OPENAI_RPM_LIMIT, tpm_limit=OPENAI_TPM_LIMIT,
+                 max_concurrency=OPENAI_MAX_CONCURRENCY, max_queue_wait=OPENAI_MAX_QUEUE_WAIT,
+                 slot_ttl=OPENAI_SLOT_TTL):
+        self._redis = redis_client
+        self.rpm_limit = rpm_limit
+        self.tpm_limit = tpm_limit
+        self.max_concurrency = max_concurrency
+        self.max_queue_wait = max_queue_wait
+        self.slot_ttl = slot_ttl
+        self._acquire = redis_client.register_script(ACQUIRE_SCRIPT)
+        self._release = redis_client.register_script(RELEASE_SCRIPT)
+        self._lock = threading.Lock()
+        self._stats = {"acquired": 0, "queued": 0, "degraded": 0, "unguarded": 0, "wait_total": 0.0, "wait_max": 0.0}
+
+    def _record(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                if name == "wait":
+                    self._stats["wait_total"] += value
+                    self._stats["wait_max"] = max(self._stats["wait_max"], value)
+                else:
+                    self._stats[name] += value
+
+    async def _count(self, field, amount=1):
+        try:
+            await self._redis.hincrby(GOVERNOR_STATS_KEY, field, amount)
+        except Exception as e:
+            logger.error(f"❌ Error updating OpenAI governor stats: {str(e)}")
+
+    async def acquire(self, estimated_tokens):
+        """Return an ``OpenAISlot``, waiting at most ``max_queue_wait`` seconds, or raise ``OpenAIDegraded``."""
+        slot_id = uuid.uuid4().hex
+        start = time.monotonic()
+        while True:
+            try:
+                granted, wait_ms, reason = await self._acquire(
+                    keys=[RPM_KEY, TPM_KEY, INFLIGHT_KEY, COOLDOWN_KEY, GOVERNOR_STATS_KEY],
+                    args=[self.rpm_limit, self.tpm_limit, self.max_concurrency, estimated_tokens,
+                          slot_id, int(self.slot_ttl * 1000), int((time.monotonic() - start) * 1000)]
+                )
+            except Exception as e:
+                # Without Redis there is nothing to coordinate with; call OpenAI unguarded
+                logger.error(f"❌ Error acquiring OpenAI slot, proceeding without rate limiting: {str(e)}")
+                self._record(unguarded=1)
+                return OpenAISlot(None, estimated_tokens, time.monotonic() - start)
+            waited = time.monotonic() - start
+            if granted:
+                self._record(acquired=1, queued=1 if waited > 0 else 0, wait=waited)
+                return OpenAISlot(slot_id, estimated_tokens, waited)
+            if waited + wait_ms / 1000 > self.max_queue_wait:
+                self._record(degraded=1)
+                await self._count(f"degraded:{reason}")
+                raise OpenAIDegraded(reason, wait_ms / 1000)
+            await asyncio.sleep(wait_ms / 1000)
+
+    async def release(self, slot):
+        if slot.slot_id is None:
+            return
+        refund = slot.estimated_tokens - slot.used_tokens if slot.used_tokens is not None else 0
+        try:
+            await self._release(keys=[TPM_KEY, INFLIGHT_KEY], args=[slot.slot_id, refund, self.tpm_limit])
+        except Exception as e:
+            logger.error(f"❌ Error releasing OpenAI slot: {str(e)}")
+
+    @asynccontextmanager
+    async def slot(self, estimated_tokens):
+        """Hold an OpenAI slot for the duration of an ``async with`` block."""
+        slot = await self.acquire(estimated_tokens)
+        try:
+            yield slot
+        finally:
+            await self.release(slot)
+
+    async def cool_down(self, seconds):
+        """Stop every process from calling OpenAI for ``seconds`` (after a 429)."""
+        try:
+            await self._redis.set(COOLDOWN_KEY, "1", px=int(seconds * 1000), nx=True)
+            logger.warning(f"⚠️ OpenAI rate limited, pausing calls cluster-wide for {seconds:.1f} seconds")
+        except Exception as e:
+            logger.error(f"❌ Error setting OpenAI cooldown: {str(e)}")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["wait_total"] = round(stats["wait_total"], 3)
+        stats["wait_max"] = round(stats["wait_max"], 3)
+        stats["avg_wait_ms"] = round(stats["wait_total"] / stats["acquired"] * 1000, 2) if stats["acquired"] else None
+        return stats
+
+
+def summarize_stats(raw):
+    """Turn the ``openai_governor:stats`` hash into cluster-wide counts and the average queue wait."""
+    acquired = int(raw.get("acquired", 0))
+    return {
+        "acquired": acquired,
+        "avg_queue_wait_ms": round(int(raw.get("queue_wait_ms", 0)) / acquired, 2) if acquired else None,
+        "degraded": {field.split(":", 1)[1]: int(value) for field, value in raw.items() if field.startswith("degraded:")},
+    }
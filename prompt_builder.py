@@ -0,0 +1,106 @@
+"""
+System prompt assembly from the sections of qa_reference.txt that matter for
+the current turn.
+
+The reference document is split on its ``**Heading**`` lines. The text before
+the first section is the persona header; it and the ``PROMPT_PINNED_SECTIONS``
+go into every prompt. Every other section is chunked further: Q&A sections
+into single Q&A pairs, example conversations into single examples. The chunks
+are indexed with BM25, and each prompt gets the ``PROMPT_TOP_K`` chunks that
+best match the guest's message and recent turns, in document order.
+"""
+import logging
+import os
+import re
+from collections import namedtuple
+
+from faq_engine import BM25Index, tokenize
+
+logger = logging.getLogger("chat_server")
+
+PROMPT_TOP_K = int(os.getenv("PROMPT_TOP_K", 4))
+PROMPT_PINNED_SECTIONS = [
+    name.strip() for name in os.getenv("PROMPT_PINNED_SECTIONS", "Business Information,Instructions for AI").split(",")
+    if name.strip()
+]
+
+Chunk = namedtuple("Chunk", ["section", "text"])
+
+HEADING_RE = re.compile(r"^\*\*([^*]+)\*\*$")
+EXAMPLE_RE = re.compile(r"^Example \d+")
+
+
+def split_sections(document):
+    """Return ``[(heading, body)]`` in document order; the first heading is the document title."""
+    sections = []
+    heading, lines = None, []
+    for line in document.splitlines():
+        stripped = line.strip()
+        match = HEADING_RE.match(stripped)
+        if match:
+            sections.append((heading, "\n".join(lines).strip()))
+            heading, lines = match.group(1).strip(), []
+        else:
+            lines.append(stripped)
+    sections.append((heading, "\n".join(lines).strip()))
+    return [(heading, body) for heading, body in sections if heading or body]
+
+
+def _split_blocks(body):
+    """Split a Q&A section on blank lines and an example section on ``Example N`` lines."""
+    blocks, current = [], []
+    for line in body.splitlines():
+        if not line or EXAMPLE_RE.match(line):
+            if current:
+                blocks.append("\n".join(current))
+            current = [line] if line else []
+        else:
+            current.append(line)
+    if current:
+        blocks.append("\n".join(current))
+    return blocks
+
+
+class PromptBuilder:
+    """
+    Args:
+        document (str): Contents of qa_reference.txt.
+        top_k (int): Retrieved chunks per prompt, on top of the pinned sections.
+        pinned_sections (list): Headings always included in full.
+    """
+
+    def __init__(self, document, top_k=PROMPT_TOP_K, pinned_sections=PROMPT_PINNED_SECTIONS):
+        self.top_k = top_k
+        sections = split_sections(document)
+        # The title's body is the persona paragraph
+        self.header = sections[0][1] if sections else ""
+        self.pinned = []
+        self.chunks = []
+        for heading, body in sections[1:]:
+            if not body:
+                continue
+            if heading in pinned_sections:
+                self.pinned.append(f"**{heading}**\n{body}")
+            else:
+                self.chunks.extend(Chunk(heading, block) for block in _split_blocks(body))
+        self._index = BM25Index([tokenize(f"{chunk.section} {chunk.text}") for chunk in self.chunks])
+        logger.info(f"✅ Indexed {len(self.chunks)} reference chunks for prompt assembly ({len(self.pinned)} pinned sections)")
+
+    def retrieve(self, message, context=()):
+        """Return the indexes of the best chunks for ``message`` and the recent ``context`` turns, in document order."""
+        tokens = tokenize(" ".join([message, *context]))
+        if not tokens:
+            return []
+        return sorted(index for index, _ in self._index.search(tokens, k=self.top_k))
+
+    def build(self, message, context=()):
+        """Return the system prompt for ``message``: persona header, pinned sections and retrieved chunks."""
+        parts = [self.header, *self.pinned]
+        section = None
+        for index in self.retrieve(message, context):
+            chunk = self.chunks[index]
+            if chunk.section != section:
+                parts.append(f"**{chunk.section}**")
+                section = chunk.section
+            parts.append(chunk.text)
+        return "\n\n".join(part for part in parts if part)
@@ -0,0 +1,102 @@
+import logging
+import threading
+import time
+from collections import namedtuple
+from types import MappingProxyType
+
+logger = logging.getLogger("chat_server")
+
+SETTINGS_CHANNEL = "settings:changed"
+
+Setting = namedtuple("Setting", ["value", "last_updated"])
+
+
+class SettingsService:
+    """
+    Process-wide, read-only snapshot of the ``settings`` table.
+
+    The whole table is loaded into an immutable mapping that is swapped
+    atomically on reload, so readers never touch the database or take a lock.
+    Writers call ``publish_change`` after committing; every process reloads
+    when the change arrives over the invalidation bus, and again whenever the
+    bus (re)subscribes. Polling every ``poll_interval`` seconds only happens
+    while the bus is disconnected.
+
+    Args:
+        lease (callable): Returns a context manager yielding a pooled connection.
+        bus (InvalidationBus): Used to publish and receive change notifications.
+        poll_interval (float): Seconds between reloads while pub/sub is down.
+    """
+
+    def __init__(self, lease, bus, poll_interval=5.0):
+        self._lease = lease
+        self._bus = bus
+        self.poll_interval = poll_interval
+        self._snapshot = None
+        self._loaded_at = None
+        self._reload_lock = threading.Lock()
+        self._poller = None
+        self._reloads = 0
+        self._polls = 0
+        bus.subscribe(SETTINGS_CHANNEL, self._on_change, on_reset=self._reload_quietly)
+
+    def snapshot(self):
+        """Return the current settings as an immutable ``{key: Setting}`` mapping."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            snapshot = self.reload()
+        return snapshot
+
+    def get(self, key, default=None):
+        """Return the ``Setting`` for ``key``, or ``default`` if it is not set."""
+        return self.snapshot().get(key, default)
+
+    def reload(self):
+        with self._reload_lock:
+            with self._lease() as conn:
+                c = conn.cursor()
+                c.execute("SELECT key, value, last_updated FROM settings")
+                snapshot = MappingProxyType({
+                    row["key"]: Setting(row["value"], row["last_updated"]) for row in c.fetchall()
+                })
+            self._snapshot = snapshot
+            self._loaded_at = time.time()
+            self._reloads += 1
+        logger.info(f"✅ Loaded settings snapshot ({len(snapshot)} keys)")
+        return snapshot
+
+    def _reload_quietly(self):
+        try:
+            self.reload()
+        except Exception as e:
+            logger.error(f"❌ Failed to reload settings snapshot: {str(e)}")
+
+    def _on_change(self, key):
+        logger.info(f"Settings change notification for {key}")
+        self._reload_quietly()
+
+    def publish_change(self, key):
+        """Reload this process and notify all others. Call after the settings write has committed."""
+        self._reload_quietly()
+        self._bus.publish(SETTINGS_CHANNEL, key)
+
+    def start(self):
+        if self._poller is None:
+            self._poller = threading.Thread(target=self._poll, name="settings-poller", daemon=True)
+            self._poller.start()
+
+    def _poll(self):
+        while True:
+            time.sleep(self.poll_interval)
+            if not self._bus.connected:
+                self._polls += 1
+                self._reload_quietly()
+
+    def stats(self):
+        snapshot = self._snapshot
+        return {
+            "keys": len(snapshot) if snapshot is not None else 0,
+            "age_seconds": round(time.time() - self._loaded_at, 1) if self._loaded_at else None,
+            "reloads": self._reloads,
+            "polled_reloads": self._polls,
+        }
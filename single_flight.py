@@ -0,0 +1,174 @@
+import json
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+
+logger = logging.getLogger("chat_server")
+
+# Deletes the lock only if it is still held by the caller's token
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class SingleFlightCache:
+    """
+    Redis cache that lets only one caller recompute a given key at a time.
+
+    Values are stored as ``{"value", "expires"}`` envelopes. ``expires`` is the
+    soft expiry; the Redis TTL additionally covers ``stale_ttl`` seconds during
+    which the stale value is still served while one caller refreshes it in the
+    background. Within the last ``refresh_ahead`` fraction of ``ttl`` a fresh
+    value is refreshed early in the same way, so hot keys normally never miss.
+
+    On a true miss, callers in the same process share one in-flight
+    computation (a Future). Across processes a ``lock:<key>`` in Redis elects
+    one computer. The others poll for its result for up to ``wait_timeout``
+    seconds before computing it themselves.
+
+    A ``None`` result (e.g. "not found") is kept for at most ``none_ttl``
+    seconds and never served stale, so a record created right after a miss is
+    seen almost at once. It is still written so that waiting processes pick it
+    up instead of timing out; ``none_ttl=0`` does not cache it at all.
+
+    Args:
+        redis_client: Synchronous redis client created with ``decode_responses=True``.
+        lock_ttl (float): Seconds before an abandoned recompute lock expires.
+        wait_timeout (float): Seconds to wait for another process's result.
+        poll_interval (float): Seconds between polls while waiting.
+        none_ttl (float): Seconds a ``None`` result is cached.
+    """
+
+    def __init__(self, redis_client, lock_ttl=10.0, wait_timeout=5.0, poll_interval=0.05, none_ttl=1.0):
+        self._redis = redis_client
+        self.lock_ttl = lock_ttl
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self.none_ttl = none_ttl
+        self._release = redis_client.register_script(RELEASE_LOCK_SCRIPT)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "stale_hits": 0, "misses": 0, "coalesced": 0, "computes": 0, "refreshes": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _read(self, key):
+        try:
+            raw = self._redis.get(key)
+        except Exception as e:
+            logger.error(f"❌ Error reading cache key {key}: {str(e)}")
+            return None
+        return json.loads(raw) if raw else None
+
+    def _write(self, key, value, ttl, stale_ttl):
+        if value is None:
+            if not self.none_ttl:
+                return
+            ttl, stale_ttl = min(ttl, self.none_ttl), 0
+        envelope = {"value": value, "expires": time.time() + ttl}
+        try:
+            self._redis.set(key, json.dumps(envelope), px=int((ttl + stale_ttl) * 1000))
+        except Exception as e:
+            logger.error(f"❌ Error writing cache key {key}: {str(e)}")
+
+    def _acquire(self, key):
+        token = uuid.uuid4().hex
+        try:
+            if self._redis.set(f"lock:{key}", token, nx=True, px=int(self.lock_ttl * 1000)):
+                return token
+        except Exception as e:
+            logger.error(f"❌ Error acquiring recompute lock for {key}: {str(e)}")
+            # Without Redis there is nothing to coordinate with; compute locally
+            return token
+        return None
+
+    def _release_lock(self, key, token):
+        try:
+            self._release(keys=[f"lock:{key}"], args=[token])
+        except Exception as e:
+            logger.error(f"❌ Error releasing recompute lock for {key}: {str(e)}")
+
+    def _refresh_in_background(self, key, compute, ttl, stale_ttl):
+        token = self._acquire(key)
+        if token is None:
+            return
+
+        def refresh():
+            try:
+                self._write(key, compute(), ttl, stale_ttl)
+                self._count("refreshes")
+            except Exception as e:
+                logger.error(f"❌ Background refresh of {key} failed: {str(e)}")
+            finally:
+                self._release_lock(key, token)
+
+        threading.Thread(target=refresh, name=f"refresh:{key}", daemon=True).start()
+
+    def get_or_compute(self, key, compute, ttl, stale_ttl=0, refresh_ahead=0.0):
+        """
+        Return the cached value for ``key``, calling ``compute()`` (which must
+        return a JSON-serializable value) at most once across all callers when
+        it is missing.
+        """
+        envelope = self._read(key)
+        if envelope is not None:
+            remaining = envelope["expires"] - time.time()
+            if remaining > ttl * refresh_ahead:
+                self._count("hits")
+                return envelope["value"]
+            self._count("stale_hits" if remaining <= 0 else "hits")
+            self._refresh_in_background(key, compute, ttl, stale_ttl)
+            return envelope["value"]
+
+        self._count("misses")
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+        if not owner:
+            self._count("coalesced")
+            return future.result()
+
+        try:
+            value = self._compute_once(key, compute, ttl, stale_ttl)
+            future.set_result(value)
+            return value
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _compute_once(self, key, compute, ttl, stale_ttl):
+        token = self._acquire(key)
+        if token is None:
+            # Another process is computing; wait for its result
+            deadline = time.time() + self.wait_timeout
+            while time.time() < deadline:
+                time.sleep(self.poll_interval)
+                envelope = self._read(key)
+                if envelope is not None:
+                    self._count("coalesced")
+                    return envelope["value"]
+            logger.warning(f"⚠️ Timed out waiting for {key} to be computed elsewhere, computing locally")
+        try:
+            value = compute()
+            self._count("computes")
+            self._write(key, value, ttl, stale_ttl)
+            return value
+        finally:
+            if token is not None:
+                self._release_lock(key, token)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, inflight=len(self._inflight))
@@ -12,6 +12,10 @@ let currentConversationId = null;
 let currentFilter = 'unassigned';
 let currentChannel = null;
 let currentAgent = null;
+// Cursor for loading older messages of the open conversation
+let oldestMessageId = null;
+let hasOlderMessages = false;
+let loadingOlderMessages = false;
 
 // Check authentication status on page load
 document.addEventListener('DOMContentLoaded', () => {
@@ -379,7 +383,11 @@ async function fetchConversations() {
             const convoInfo = document.createElement('span');
             // Display AI enabled status in the UI
             const aiStatus = convo.ai_enabled ? '(AI Enabled)' : '(AI Disabled)';
-            convoInfo.textContent = `${convo.username} (${convo.channel}): Assigned to ${convo.assigned_agent || 'unassigned'} ${aiStatus}`;
+            const unread = convo.unread_count ? ` [${convo.unread_count} unread]` : '';
+            convoInfo.textContent = `${convo.username} (${convo.channel}): Assigned to ${convo.assigned_agent || 'unassigned'} ${aiStatus}${unread}`;
+            if (convo.last_message) {
+                convoInfo.title = `${convo.last_message_sender}: ${convo.last_message}`;
+            }
             convoInfo.onclick = () => loadConversation(convo.id);
             convoInfo.style.cursor = 'pointer';
             convoContainer.appendChild(convoInfo);
@@ -554,6 +562,11 @@ function loadConversation(convoId) {
     // Join the Socket.IO room for this conversation
     socket.emit('join_conversation', { conversation_id: convoId });
 
+    fetch(`/conversations/${convoId}/read`, {
+        method: 'POST',
+        credentials: 'include'
+    }).catch(error => console.error('Error marking conversation as read:', error));
+
     fetch(`/messages/${convoId}`, {
         credentials: 'include'
     })
@@ -567,6 +580,8 @@ function loadConversation(convoId) {
             const messages = data.messages;
             const username = data.username;
             chatBox.innerHTML = '';
+            oldestMessageId = data.next_before;
+            hasOlderMessages = data.has_more;
 
             messages.forEach(msg => {
                 appendMessage(msg);
@@ -581,11 +596,61 @@ function loadConversation(convoId) {
         .catch(error => console.error('Error loading messages:', error));
 }
 
+// Fetch the page of messages before the oldest one shown and prepend it
+function loadOlderMessages() {
+    if (!currentConversationId || !hasOlderMessages || loadingOlderMessages || oldestMessageId === null) return;
+    const chatBox = document.getElementById('chatBox');
+    if (!chatBox) return;
+
+    const convoId = currentConversationId;
+    loadingOlderMessages = true;
+    fetch(`/messages/${convoId}?before=${oldestMessageId}`, {
+        credentials: 'include'
+    })
+        .then(response => {
+            if (!response.ok) {
+                throw new Error(`HTTP error! Status: ${response.status}, StatusText: ${response.statusText}`);
+            }
+            return response.json();
+        })
+        .then(data => {
+            if (convoId !== currentConversationId) return;
+            const previousHeight = chatBox.scrollHeight;
+            const fragment = document.createDocumentFragment();
+            data.messages.forEach(msg => fragment.appendChild(createMessageElement(msg)));
+            chatBox.insertBefore(fragment, chatBox.firstChild);
+            // Keep the viewport on the message the agent was reading
+            chatBox.scrollTop = chatBox.scrollHeight - previousHeight;
+            oldestMessageId = data.next_before;
+            hasOlderMessages = data.has_more;
+        })
+        .catch(error => console.error('Error loading older messages:', error))
+        .finally(() => {
+            loadingOlderMessages = false;
+        });
+}
+
+document.addEventListener('DOMContentLoaded', () => {
+    const chatBox = document.getElementById('chatBox');
+    if (chatBox) {
+        chatBox.addEventListener('scroll', () => {
+            if (chatBox.scrollTop === 0) {
+                loadOlderMessages();
+            }
+        });
+    }
+});
+
 // Helper function to append a message to the chat box
 function appendMessage(msg) {
     const chatBox = document.getElementById('chatBox');
     if (!chatBox) return;
 
+    chatBox.appendChild(createMessageElement(msg));
+    chatBox.scrollTop = chatBox.scrollHeight;
+}
+
+function createMessageElement(msg) {
     const div = document.createElement('div');
     const isUser = msg.sender === 'user';
     const isAgent = msg.sender === 'agent';
@@ -600,9 +665,7 @@ function appendMessage(msg) {
     const timeMatch = msg.timestamp.match(/\d{2}:\d{2}/);
     timestampSpan.textContent = timeMatch ? timeMatch[0] : msg.timestamp;
     div.appendChild(timestampSpan);
-
-    chatBox.appendChild(div);
-    chatBox.scrollTop = chatBox.scrollHeight;
+    return div;
 }
 
 function sendMessage() {
@@ -1,12 +1,16 @@
 import os
 import sys
+import time
 import logging
+import concurrent.futures
 from pathlib import Path
 from celery import Celery
+from celery.schedules import crontab
+from celery.signals import worker_process_shutdown
 from datetime import datetime, timezone
 from twilio.rest import Client
 from twilio.base.exceptions import TwilioRestException
-import asyncio
+from calendar_availability import CALENDAR_SYNC_INTERVAL
 
 # Add the project root directory to the Python path to fix import issues
 project_root = str(Path(__file__).parent.absolute())
@@ -49,6 +53,20 @@ celery_app.conf.update(
     task_routes={
         'tasks.send_whatsapp_message_task': {'queue': 'whatsapp'},
         'tasks.process_whatsapp_message': {'queue': 'default'},
+        'tasks.respond_to_whatsapp_turn': {'queue': 'default'},
+        'tasks.maintain_message_partitions': {'queue': 'default'},
+        'tasks.summarize_conversation_history': {'queue': 'default'},
+        'tasks.sync_calendar_availability': {'queue': 'default'},
+    },
+    beat_schedule={
+        'maintain-message-partitions': {
+            'task': 'tasks.maintain_message_partitions',
+            'schedule': crontab(hour=3, minute=30),
+        },
+        'sync-calendar-availability': {
+            'task': 'tasks.sync_calendar_availability',
+            'schedule': CALENDAR_SYNC_INTERVAL,
+        },
     },
     task_track_started=True,  # Track when tasks start
     task_time_limit=300,  # 5-minute hard time limit for tasks
@@ -66,16 +84,12 @@ if not TWILIO_ACCOUNT_SID or not TWILIO_AUTH_TOKEN or not TWILIO_WHATSAPP_NUMBER
 
 twilio_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
 
-# Use a single event loop for synchronous async operations
-_sync_loop = None
-
-def get_sync_loop():
-    """Get or create a single event loop for synchronous async operations."""
-    global _sync_loop
-    if _sync_loop is None or _sync_loop.is_closed():
-        _sync_loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(_sync_loop)
-    return _sync_loop
+@worker_process_shutdown.connect
+def flush_buffered_messages(**kwargs):
+    """Write any messages still held by the write-behind logger before the process exits."""
+    chat_server = sys.modules.get("chat_server")
+    if chat_server is not None and chat_server.message_writer is not None:
+        chat_server.message_writer.close()
 
 @celery_app.task(bind=True, max_retries=3, retry_backoff=True, retry_jitter=True)
 def send_whatsapp_message_task(self, to_number, message, convo_id=None, username=None, chat_id=None, ai_timestamp=None):
@@ -93,7 +107,7 @@ def send_whatsapp_message_task(self, to_number, message, convo_id=None, username
     Returns:
         bool: True if the message was sent successfully, False otherwise.
     """
-    from chat_server import get_db_connection, release_db_connection, socketio
+    from chat_server import db_lease, log_message, socketio
 
     try:
         # Normalize the phone number format
@@ -113,25 +127,16 @@ def send_whatsapp_message_task(self, to_number, message, convo_id=None, username
 
         # If this task was called from process_whatsapp_message, log the AI response and emit the event
         if convo_id and username and chat_id and ai_timestamp:
-            with get_db_connection() as conn:
-                try:
-                    c = conn.cursor()
-                    c.execute("BEGIN")
-                    # Log the AI message
-                    c.execute(
-                        "INSERT INTO messages (convo_id, username, message, sender, timestamp) "
-                        "VALUES (%s, %s, %s, %s, %s)",
-                        (convo_id, username, message, "ai", ai_timestamp)
-                    )
-                    # Update the conversation's last_updated timestamp
-                    c.execute(
-                        "UPDATE conversations SET last_updated = %s WHERE id = %s",
-                        (ai_timestamp, convo_id)
-                    )
-                    c.execute("COMMIT")
-                    logger.info(f"Logged AI message for convo_id {convo_id}")
-                finally:
-                    release_db_connection(conn)
+            # Log the AI message
+            log_message(convo_id, username, message, "ai", timestamp=ai_timestamp)
+            # Update the conversation's last_updated timestamp
+            with db_lease(autocommit=True) as conn:
+                c = conn.cursor()
+                c.execute(
+                    "UPDATE conversations SET last_updated = %s WHERE id = %s",
+                    (ai_timestamp, convo_id)
+                )
+            logger.info(f"Logged AI message for convo_id {convo_id}")
 
             # Emit the new_message event directly using SocketIO
             room = f"conversation_{convo_id}"
@@ -156,6 +161,38 @@ def send_whatsapp_message_task(self, to_number, message, convo_id=None, username
         logger.error(f"❌ Error sending WhatsApp message to {to_number}: {str(e)}")
         raise self.retry(countdown=60)
 
+def generate_ai_response(message_body, convo_id, language):
+    """
+    Return the AI reply to ``message_body``, or an apology (after handing the
+    conversation to an agent) if the AI call fails. OpenAI API errors are
+    handled inside ``ai_respond``; this covers timeouts and unexpected errors.
+    """
+    from chat_server import ai_respond_sync, update_conversation, socketio
+    from tenacity import RetryError
+
+    try:
+        response = ai_respond_sync(message_body, convo_id, raise_errors=True)
+        logger.info(f"AI response for convo_id {convo_id}: {response}")
+    except (concurrent.futures.TimeoutError, RetryError) as e:
+        logger.error(f"❌ AI response timed out for convo_id {convo_id}: {str(e)}")
+        response = (
+            "I’m sorry, the AI service timed out while processing your request. I’ll connect you with a team member to assist you."
+            if language == "en"
+            else "Lo siento, el servicio de IA se agotó mientras procesaba tu solicitud. Te conectaré con un miembro del equipo para que te ayude."
+        )
+        update_conversation(convo_id, needs_agent=1, handoff_notified=0, last_updated=datetime.now(timezone.utc).isoformat())
+        socketio.emit("refresh_conversations", {"conversation_id": convo_id})
+    except Exception as e:
+        logger.error(f"❌ Unexpected error in ai_respond for convo_id {convo_id}: {str(e)}")
+        response = (
+            "I’m sorry, I’m having trouble processing your request right now. I’ll connect you with a team member to assist you."
+            if language == "en"
+            else "Lo siento, tengo problemas para procesar tu solicitud ahora mismo. Te conectaré con un miembro del equipo para que te ayude."
+        )
+        update_conversation(convo_id, needs_agent=1, handoff_notified=0, last_updated=datetime.now(timezone.utc).isoformat())
+        socketio.emit("refresh_conversations", {"conversation_id": convo_id})
+    return response
+
 @celery_app.task(bind=True, max_retries=3, retry_backoff=True, retry_jitter=True)
 def process_whatsapp_message(self, from_number, chat_id, message_body, user_timestamp):
     """
@@ -167,67 +204,51 @@ def process_whatsapp_message(self, from_number, chat_id, message_body, user_time
         message_body (str): The message content.
         user_timestamp (str): The timestamp of the user's message in ISO format.
     """
-    from chat_server import get_db_connection, release_db_connection, ai_respond_sync, get_ai_enabled, detect_language, socketio
-    from openai import RateLimitError, APIError, AuthenticationError, APITimeoutError
+    from chat_server import (
+        db_lease, get_ai_enabled, detect_language, bump_messages_generation,
+        conversation_state, update_conversation, recent_messages, socketio, message_coalescer
+    )
 
     start_time = time.time()
     logger.info(f"Starting process_whatsapp_message for chat_id {chat_id}: {message_body}")
     try:
-        # Get or create conversation and log user message in a single transaction
-        convo_id = None
-        username = None
-        ai_enabled = None
-        needs_agent = None
-        assigned_agent = None
-        handoff_notified = None
-        language = "en"
-
-        with get_db_connection() as conn:
-            try:
-                c = conn.cursor()
-                c.execute("BEGIN")
-                # Get or create conversation
-                c.execute(
-                    "SELECT id, username, ai_enabled, needs_agent, assigned_agent, handoff_notified, language "
-                    "FROM conversations WHERE chat_id = %s AND channel = %s",
-                    (chat_id, "whatsapp")
-                )
-                result = c.fetchone()
-                current_timestamp = user_timestamp
-                if result:
-                    convo_id = result['id']
-                    username = result['username']
-                    ai_enabled = result['ai_enabled']
-                    needs_agent = result['needs_agent']
-                    assigned_agent = result['assigned_agent']
-                    handoff_notified = result['handoff_notified']
-                    language = result['language'] or "en"
-                    c.execute(
-                        "UPDATE conversations SET last_updated = %s, visible_in_conversations = 1 WHERE id = %s",
-                        (current_timestamp, convo_id)
-                    )
-                else:
-                    username = f"User_{chat_id[-4:]}"
-                    ai_enabled = 1
-                    needs_agent = 0
-                    assigned_agent = None
-                    handoff_notified = 0
-                    c.execute(
-                        "INSERT INTO conversations (chat_id, channel, username, ai_enabled, needs_agent, assigned_agent, handoff_notified, last_updated, visible_in_conversations, language) "
-                        "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING id",
-                        (chat_id, "whatsapp", username, ai_enabled, needs_agent, assigned_agent, handoff_notified, current_timestamp, 1, language)
-                    )
-                    convo_id = c.fetchone()['id']
-                # Log user message
-                c.execute(
-                    "INSERT INTO messages (convo_id, username, message, sender, timestamp) "
-                    "VALUES (%s, %s, %s, %s, %s)",
-                    (convo_id, username, message_body, "user", user_timestamp)
+        # Upsert the conversation and log the user message in a single round trip.
+        # The unique (chat_id, channel) index makes concurrent first messages from
+        # the same number converge on one conversation.
+        with db_lease(autocommit=True) as conn:
+            c = conn.cursor()
+            c.execute(
+                """
+                WITH convo AS (
+                    INSERT INTO conversations (chat_id, channel, username, ai_enabled, needs_agent, assigned_agent, handoff_notified, last_updated, visible_in_conversations, language)
+                    VALUES (%s, %s, %s, 1, 0, NULL, 0, %s, 1, 'en')
+                    ON CONFLICT (chat_id, channel) DO UPDATE
+                        SET last_updated = EXCLUDED.last_updated, visible_in_conversations = 1
+                    RETURNING id, chat_id, channel, username, ai_enabled, needs_agent, assigned_agent, handoff_notified, language, booking_intent,
+                              history_summary, history_summary_through_id, (xmax = 0) AS created
+                ), msg AS (
+                    INSERT INTO messages (convo_id, username, message, sender, timestamp)
+                    SELECT id, username, %s, 'user', %s::timestamptz FROM convo
+                    RETURNING id
                 )
-                c.execute("COMMIT")
-                logger.info(f"Logged user message for convo_id {convo_id}")
-            finally:
-                release_db_connection(conn)
+                SELECT convo.*, msg.id AS message_id FROM convo, msg
+                """,
+                (chat_id, "whatsapp", f"User_{chat_id[-4:]}", user_timestamp, message_body, user_timestamp)
+            )
+            result = c.fetchone()
+        convo_id = result['id']
+        recent_messages.append(convo_id, result['message_id'], message_body, "user", user_timestamp)
+        bump_messages_generation(convo_id)
+        # The upsert already returned the current flags; later lookups in
+        # detect_language and ai_respond are served from the local cache.
+        conversation_state.prime(convo_id, result)
+        username = result['username']
+        ai_enabled = result['ai_enabled']
+        needs_agent = result['needs_agent']
+        assigned_agent = result['assigned_agent']
+        handoff_notified = result['handoff_notified']
+        language = result['language'] or "en"
+        logger.info(f"Logged user message {result['message_id']} for convo_id {convo_id} (new conversation: {result['created']})")
 
         # Emit the user's message to the conversation room
         room = f"conversation_{convo_id}"
@@ -280,101 +301,16 @@ def process_whatsapp_message(self, from_number, chat_id, message_body, user_time
 
         response = None
         ai_timestamp = None
+        if should_respond and message_coalescer.enabled:
+            # Answer the guest's burst of messages as one turn once they pause
+            delay = message_coalescer.add(chat_id, message_body, user_timestamp)
+            respond_to_whatsapp_turn.apply_async((from_number, chat_id, convo_id), countdown=delay)
+            logger.info(f"Deferred AI response for chat_id {chat_id} by {delay:.2f} seconds to coalesce messages")
+            logger.info(f"Finished process_whatsapp_message in {time.time() - start_time:.2f} seconds")
+            return
         if should_respond:
-            try:
-                response = ai_respond_sync(message_body, convo_id)
-                ai_timestamp = datetime.now(timezone.utc).isoformat()
-                logger.info(f"AI response for convo_id {convo_id}: {response}")
-            except RateLimitError as e:
-                logger.error(f"❌ OpenAI RateLimitError in ai_respond for convo_id {convo_id}: {str(e)}")
-                response = (
-                    "I’m sorry, I’m having trouble processing your request right now due to rate limits. I’ll connect you with a team member to assist you."
-                    if language == "en"
-                    else "Lo siento, tengo problemas para procesar tu solicitud ahora mismo debido a límites de tasa. Te conectaré con un miembro del equipo para que te ayude."
-                )
-                with get_db_connection() as conn:
-                    try:
-                        c = conn.cursor()
-                        c.execute(
-                            "UPDATE conversations SET needs_agent = 1, handoff_notified = 0, last_updated = %s WHERE id = %s",
-                            (datetime.now(timezone.utc).isoformat(), convo_id)
-                        )
-                        conn.commit()
-                    finally:
-                        release_db_connection(conn)
-                socketio.emit("refresh_conversations", {"conversation_id": convo_id})
-            except APIError as e:
-                logger.error(f"❌ OpenAI APIError in ai_respond for convo_id {convo_id}: {str(e)}")
-                response = (
-                    "I’m sorry, I’m having trouble processing your request right now due to an API error. I’ll connect you with a team member to assist you."
-                    if language == "en"
-                    else "Lo siento, tengo problemas para procesar tu solicitud ahora mismo debido a un error de API. Te conectaré con un miembro del equipo para que te ayude."
-                )
-                with get_db_connection() as conn:
-                    try:
-                        c = conn.cursor()
-                        c.execute(
-                            "UPDATE conversations SET needs_agent = 1, handoff_notified = 0, last_updated = %s WHERE id = %s",
-                            (datetime.now(timezone.utc).isoformat(), convo_id)
-                        )
-                        conn.commit()
-                    finally:
-                        release_db_connection(conn)
-                socketio.emit("refresh_conversations", {"conversation_id": convo_id})
-            except AuthenticationError as e:
-                logger.error(f"❌ OpenAI AuthenticationError in ai_respond for convo_id {convo_id}: {str(e)}")
-                response = (
-                    "I’m sorry, I’m having trouble authenticating with the AI service. I’ll connect you with a team member to assist you."
-                    if language == "en"
-                    else "Lo siento, tengo problemas para autenticarme con el servicio de IA. Te conectaré con un miembro del equipo para que te ayude."
-                )
-                with get_db_connection() as conn:
-                    try:
-                        c = conn.cursor()
-                        c.execute(
-                            "UPDATE conversations SET needs_agent = 1, handoff_notified = 0, last_updated = %s WHERE id = %s",
-                            (datetime.now(timezone.utc).isoformat(), convo_id)
-                        )
-                        conn.commit()
-                    finally:
-                        release_db_connection(conn)
-                socketio.emit("refresh_conversations", {"conversation_id": convo_id})
-            except APITimeoutError as e:
-                logger.error(f"❌ OpenAI APITimeoutError in ai_respond for convo_id {convo_id}: {str(e)}")
-                response = (
-                    "I’m sorry, the AI service timed out while processing your request. I’ll connect you with a team member to assist you."
-                    if language == "en"
-                    else "Lo siento, el servicio de IA se agotó mientras procesaba tu solicitud. Te conectaré con un miembro del equipo para que te ayude."
-                )
-                with get_db_connection() as conn:
-                    try:
-                        c = conn.cursor()
-                        c.execute(
-                            "UPDATE conversations SET needs_agent = 1, handoff_notified = 0, last_updated = %s WHERE id = %s",
-                            (datetime.now(timezone.utc).isoformat(), convo_id)
-                        )
-                        conn.commit()
-                    finally:
-                        release_db_connection(conn)
-                socketio.emit("refresh_conversations", {"conversation_id": convo_id})
-            except Exception as e:
-                logger.error(f"❌ Unexpected error in ai_respond for convo_id {convo_id}: {str(e)}")
-                response = (
-                    "I’m sorry, I’m having trouble processing your request right now. I’ll connect you with a team member to assist you."
-                    if language == "en"
-                    else "Lo siento, tengo problemas para procesar tu solicitud ahora mismo. Te conectaré con un miembro del equipo para que te ayude."
-                )
-                with get_db_connection() as conn:
-                    try:
-                        c = conn.cursor()
-                        c.execute(
-                            "UPDATE conversations SET needs_agent = 1, handoff_notified = 0, last_updated = %s WHERE id = %s",
-                            (datetime.now(timezone.utc).isoformat(), convo_id)
-                        )
-                        conn.commit()
-                    finally:
-                        release_db_connection(conn)
-                socketio.emit("refresh_conversations", {"conversation_id": convo_id})
+            response = generate_ai_response(message_body, convo_id, language)
+            ai_timestamp = datetime.now(timezone.utc).isoformat()
         elif help_triggered:
             response = (
                 "I’m sorry, I couldn’t process that. I’ll connect you with a team member to assist you."
@@ -382,17 +318,8 @@ def process_whatsapp_message(self, from_number, chat_id, message_body, user_time
                 else "Lo siento, no pude procesar eso. Te conectaré con un miembro del equipo para que te ayude."
             )
             ai_timestamp = datetime.now(timezone.utc).isoformat()
-            with get_db_connection() as conn:
-                try:
-                    c = conn.cursor()
-                    c.execute(
-                        "UPDATE conversations SET ai_enabled = %s, needs_agent = %s, handoff_notified = %s, last_updated = %s WHERE id = %s",
-                        (0, 1, 0, ai_timestamp, convo_id)
-                    )
-                    conn.commit()
-                    logger.info(f"Disabled AI and set needs_agent for convo_id {convo_id} due to help request")
-                finally:
-                    release_db_connection(conn)
+            update_conversation(convo_id, ai_enabled=0, needs_agent=1, handoff_notified=0, last_updated=ai_timestamp)
+            logger.info(f"Disabled AI and set needs_agent for convo_id {convo_id} due to help request")
             socketio.emit("refresh_conversations", {"conversation_id": convo_id})
         else:
             # If AI is disabled or the conversation needs an agent, notify if not already done
@@ -403,17 +330,8 @@ def process_whatsapp_message(self, from_number, chat_id, message_body, user_time
                     else "Tu solicitud ha sido enviada a un miembro del equipo que te asistirá en breve."
                 )
                 ai_timestamp = datetime.now(timezone.utc).isoformat()
-                with get_db_connection() as conn:
-                    try:
-                        c = conn.cursor()
-                        c.execute(
-                            "UPDATE conversations SET handoff_notified = 1, last_updated = %s WHERE id = %s",
-                            (ai_timestamp, convo_id)
-                        )
-                        conn.commit()
-                        logger.info(f"Set handoff_notified for convo_id {convo_id}")
-                    finally:
-                        release_db_connection(conn)
+                update_conversation(convo_id, handoff_notified=1, last_updated=ai_timestamp)
+                logger.info(f"Set handoff_notified for convo_id {convo_id}")
             else:
                 logger.info(f"AI response skipped for convo_id {convo_id}: ai_enabled={ai_enabled}, global_ai_enabled={global_ai_enabled}, help_triggered={help_triggered}, needs_agent={needs_agent}, assigned_agent={assigned_agent}")
                 return
@@ -434,3 +352,183 @@ def process_whatsapp_message(self, from_number, chat_id, message_body, user_time
     except Exception as e:
         logger.error(f"❌ Error in process_whatsapp_message task for chat_id {chat_id}: {str(e)}", exc_info=True)
         raise self.retry(countdown=60)
+
+@celery_app.task(bind=True, max_retries=3, retry_backoff=True, retry_jitter=True)
+def respond_to_whatsapp_turn(self, from_number, chat_id, convo_id):
+    """
+    Celery task that answers the messages a guest sent within one coalescing
+    window with a single AI reply.
+
+    Args:
+        from_number (str): The sender's phone number (with 'whatsapp:' prefix).
+        chat_id (str): The chat ID derived from the phone number.
+        convo_id (int): The conversation the messages were logged to.
+    """
+    from chat_server import conversation_state, get_ai_enabled, message_coalescer
+
+    start_time = time.time()
+    messages = None
+    try:
+        messages, retry_in = message_coalescer.take(chat_id)
+        if messages is None:
+            if retry_in is not None:
+                # Ran before the window closed (clock skew or a newer message); try again at the deadline
+                respond_to_whatsapp_turn.apply_async((from_number, chat_id, convo_id), countdown=retry_in)
+            return
+
+        logger.info(f"Starting respond_to_whatsapp_turn for chat_id {chat_id} with {len(messages)} coalesced message(s)")
+        # An agent may have taken over while the window was open
+        state = conversation_state.get(convo_id)
+        global_ai_enabled, _ = get_ai_enabled()
+        if not state or not state['ai_enabled'] or state['needs_agent'] or state['assigned_agent'] is not None or global_ai_enabled != "1":
+            logger.info(f"AI response skipped for coalesced turn of convo_id {convo_id}: conversation no longer handled by AI")
+            return
+
+        message_body = "\n".join(entry['message'] for entry in messages)
+        response = generate_ai_response(message_body, convo_id, state['language'] or "en")
+        ai_timestamp = datetime.now(timezone.utc).isoformat()
+        send_whatsapp_message_task.delay(
+            from_number,
+            response,
+            convo_id=convo_id,
+            username=state['username'],
+            chat_id=chat_id,
+            ai_timestamp=ai_timestamp
+        )
+        logger.info(f"Queued send_whatsapp_message_task for AI response to {from_number}")
+        logger.info(f"Finished respond_to_whatsapp_turn in {time.time() - start_time:.2f} seconds")
+    except Exception as e:
+        logger.error(f"❌ Error in respond_to_whatsapp_turn for chat_id {chat_id}: {str(e)}", exc_info=True)
+        if messages:
+            # Nothing was sent for this turn; hand the messages to the retry (or the next turn)
+            try:
+                message_coalescer.restore(chat_id, messages)
+                logger.info(f"Restored {len(messages)} coalesced message(s) for chat_id {chat_id}")
+            except Exception as restore_error:
+                logger.error(f"❌ Failed to restore coalesced messages for chat_id {chat_id}: {str(restore_error)}")
+        raise self.retry(countdown=10)
+
+@celery_app.task
+def maintain_message_partitions():
+    """
+    Celery beat task that creates upcoming monthly message partitions and
+    archives partitions older than MESSAGE_RETENTION_MONTHS.
+    """
+    from migrate import connect
+    from message_archive import ensure_partitions, archive_expired_partitions
+
+    start_time = time.time()
+    logger.info("Starting maintain_message_partitions")
+    try:
+        # Archiving a month can take far longer than the pool's lease reclaim
+        # limit, so use a dedicated connection outside the pool.
+        conn = connect()
+        try:
+            conn.autocommit = True
+            created = ensure_partitions(conn)
+            archived = archive_expired_partitions(conn)
+        finally:
+            conn.close()
+        logger.info(f"✅ Created {len(created)} message partition(s), archived {len(archived)} ({sum(archived.values())} messages)")
+        logger.info(f"Finished maintain_message_partitions in {time.time() - start_time:.2f} seconds")
+    except Exception as e:
+        logger.error(f"❌ Error in maintain_message_partitions: {str(e)}", exc_info=True)
+        raise
+
+@celery_app.task
+def sync_calendar_availability():
+    """
+    Celery beat task that mirrors the "Fully Booked" nights of the resort
+    calendar into calendar_booked_nights for check_availability.
+    """
+    from chat_server import db_lease, calendar_pool
+    from calendar_availability import sync_calendar
+
+    start_time = time.time()
+    logger.info("Starting sync_calendar_availability")
+    try:
+        with calendar_pool.lease() as service:
+            sync_calendar(service, db_lease)
+        logger.info(f"Finished sync_calendar_availability in {time.time() - start_time:.2f} seconds")
+    except Exception as e:
+        logger.error(f"❌ Error in sync_calendar_availability: {str(e)}", exc_info=True)
+        raise
+
+@celery_app.task(bind=True, max_retries=3, retry_backoff=True, retry_jitter=True)
+def summarize_conversation_history(self, convo_id, through_id):
+    """
+    Celery task that folds the messages up to ``through_id`` into the
+    conversation's rolling history summary, oldest first, in batches of
+    ``SUMMARY_BATCH_SIZE``. The stored summary advances after each batch, so a
+    failed run resumes where it stopped.
+
+    Args:
+        convo_id (int): The conversation to summarize.
+        through_id (int): Id of the newest message to fold into the summary.
+    """
+    from chat_server import db_lease, redis_client, conversation_state, summarize_history, async_runtime
+    from conversation_memory import SUMMARY_BATCH_SIZE, SUMMARY_PENDING_TTL, SUMMARY_TIMEOUT, summary_pending_key
+
+    start_time = time.time()
+    logger.info(f"Starting summarize_conversation_history for convo_id {convo_id} through message {through_id}")
+    try:
+        with db_lease() as conn:
+            c = conn.cursor()
+            c.execute(
+                "SELECT history_summary, history_summary_through_id FROM conversations WHERE id = %s",
+                (convo_id,)
+            )
+            convo = c.fetchone()
+        if convo is None:
+            logger.info(f"Conversation {convo_id} no longer exists, skipping history summary")
+        else:
+            summary, summarized_through = convo['history_summary'], convo['history_summary_through_id']
+            summarized = 0
+            while summarized_through < through_id:
+                with db_lease() as conn:
+                    c = conn.cursor()
+                    c.execute(
+                        "SELECT id, message, sender FROM messages WHERE convo_id = %s AND id > %s AND id <= %s "
+                        "ORDER BY id LIMIT %s",
+                        (convo_id, summarized_through, through_id, SUMMARY_BATCH_SIZE)
+                    )
+                    messages = c.fetchall()
+                if not messages:
+                    break
+                new_summary = async_runtime.run(summarize_history(summary, messages), timeout=SUMMARY_TIMEOUT)
+                batch_through = messages[-1]['id']
+                with db_lease(autocommit=True) as conn:
+                    c = conn.cursor()
+                    # Only build on the summary this run read; stop if another run moved it
+                    c.execute(
+                        "UPDATE conversations SET history_summary = %s, history_summary_through_id = %s "
+                        "WHERE id = %s AND history_summary_through_id = %s",
+                        (new_summary, batch_through, convo_id, summarized_through)
+                    )
+                    updated = c.rowcount
+                if not updated:
+                    logger.info(f"History summary for convo_id {convo_id} was updated concurrently, stopping")
+                    break
+                conversation_state.invalidate(convo_id)
+                summary, summarized_through = new_summary, batch_through
+                summarized += len(messages)
+            if summarized:
+                logger.info(f"✅ Summarized {summarized} messages for convo_id {convo_id} through message {summarized_through}")
+            else:
+                logger.info(f"History summary for convo_id {convo_id} is already up to date")
+        redis_client.delete(summary_pending_key(convo_id))
+        logger.info(f"Finished summarize_conversation_history in {time.time() - start_time:.2f} seconds")
+    except Exception as e:
+        logger.error(f"❌ Error in summarize_conversation_history for convo_id {convo_id}: {str(e)}", exc_info=True)
+        try:
+            if self.request.retries >= self.max_retries:
+                # Final failure: let the next overflowing turn queue a fresh run
+                redis_client.delete(summary_pending_key(convo_id))
+            else:
+                # Keep other turns from queueing a second run while this one waits to retry
+                redis_client.expire(summary_pending_key(convo_id), SUMMARY_PENDING_TTL)
+        except Exception as flag_error:
+            logger.error(f"❌ Error updating history summary flag for convo_id {convo_id}: {str(flag_error)}")
+        if self.request.retries >= self.max_retries:
+            raise
+        raise self.retry(countdown=30)
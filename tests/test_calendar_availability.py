@@ -0,0 +1,60 @@
+from datetime import date, timedelta
+
+import pytest
+
+pytest.importorskip("googleapiclient")
+
+from calendar_availability import alternative_stays, booked_nights, event_nights
+
+
+def all_day(start, end, summary="Fully Booked", status="confirmed"):
+    return {"summary": summary, "status": status, "start": {"date": start}, "end": {"date": end}}
+
+
+def test_event_nights_all_day_end_is_exclusive():
+    assert list(event_nights(all_day("2024-05-01", "2024-05-03"))) == [date(2024, 5, 1), date(2024, 5, 2)]
+
+
+def test_event_nights_timed_event_books_every_night_it_overlaps():
+    event = {"start": {"dateTime": "2024-05-01T14:00:00Z"}, "end": {"dateTime": "2024-05-03T10:00:00Z"}}
+    assert list(event_nights(event)) == [date(2024, 5, 1), date(2024, 5, 2), date(2024, 5, 3)]
+
+
+def test_event_nights_converts_offsets_to_utc():
+    # 23:00 on May 1st at UTC-2 is 01:00 on May 2nd in UTC
+    event = {"start": {"dateTime": "2024-05-01T23:00:00-02:00"}, "end": {"dateTime": "2024-05-02T12:00:00Z"}}
+    assert list(event_nights(event)) == [date(2024, 5, 2)]
+
+
+def test_booked_nights_ignores_other_and_cancelled_events():
+    events = [
+        all_day("2024-05-01", "2024-05-03"),
+        all_day("2024-05-03", "2024-05-04", summary="Maintenance"),
+        all_day("2024-05-04", "2024-05-05", status="cancelled"),
+        all_day("2024-05-05", "2024-05-10"),
+    ]
+    assert booked_nights(events, date(2024, 5, 2), date(2024, 5, 6)) == [date(2024, 5, 2), date(2024, 5, 5)]
+
+
+def test_alternative_stays_nearest_first_with_same_length():
+    booked = [date(2024, 6, 10), date(2024, 6, 11)]
+    stays = alternative_stays(booked, date(2024, 6, 10), date(2024, 6, 12), earliest=date(2024, 6, 1))
+    assert stays == [(date(2024, 6, 8), date(2024, 6, 10)), (date(2024, 6, 12), date(2024, 6, 14))]
+
+
+def test_alternative_stays_prefers_earlier_on_ties():
+    stays = alternative_stays([], date(2024, 6, 10), date(2024, 6, 12), earliest=date(2024, 6, 1))
+    assert stays == [(date(2024, 6, 9), date(2024, 6, 11)), (date(2024, 6, 11), date(2024, 6, 13))]
+
+
+def test_alternative_stays_never_starts_before_earliest():
+    booked = [date(2024, 6, 10), date(2024, 6, 11)]
+    stays = alternative_stays(booked, date(2024, 6, 10), date(2024, 6, 12), earliest=date(2024, 6, 9))
+    assert stays == [(date(2024, 6, 12), date(2024, 6, 14)), (date(2024, 6, 13), date(2024, 6, 15))]
+
+
+def test_alternative_stays_empty_when_search_window_is_booked():
+    check_in = date(2024, 6, 10)
+    booked = [check_in + timedelta(days=offset) for offset in range(-3, 5)]
+    assert alternative_stays(booked, check_in, check_in + timedelta(days=2), search_days=2,
+                             earliest=date(2024, 6, 1)) == []
@@ -0,0 +1,51 @@
+from conversation_memory import MESSAGE_OVERHEAD_TOKENS, estimate_tokens, fit_history
+
+
+def make_messages(*texts):
+    return [{"id": index, "message": text} for index, text in enumerate(texts, 1)]
+
+
+def test_estimate_tokens_rounds_up_and_adds_overhead():
+    assert estimate_tokens("") == MESSAGE_OVERHEAD_TOKENS
+    assert estimate_tokens(None) == MESSAGE_OVERHEAD_TOKENS
+    assert estimate_tokens("abcd") == 1 + MESSAGE_OVERHEAD_TOKENS
+    assert estimate_tokens("abcde") == 2 + MESSAGE_OVERHEAD_TOKENS
+
+
+def test_fit_history_keeps_everything_within_budget():
+    messages = make_messages("hello", "hi there", "I need a room")
+    kept, overflow = fit_history(messages, budget=1000)
+    assert kept == messages
+    assert overflow == []
+
+
+def test_fit_history_keeps_newest_messages_that_fit():
+    # Each message costs 2 + 4 = 6 tokens
+    messages = make_messages("a" * 8, "b" * 8, "c" * 8, "d" * 8)
+    kept, overflow = fit_history(messages, budget=13)
+    assert [msg["id"] for msg in kept] == [3, 4]
+    assert [msg["id"] for msg in overflow] == [1, 2]
+
+
+def test_fit_history_reserves_room_for_summary():
+    messages = make_messages("a" * 8, "b" * 8, "c" * 8)
+    # The 8-character summary takes 6 of the 18 tokens, leaving room for two messages
+    kept, overflow = fit_history(messages, summary="s" * 8, budget=18)
+    assert [msg["id"] for msg in kept] == [2, 3]
+    assert [msg["id"] for msg in overflow] == [1]
+
+
+def test_fit_history_stops_at_first_message_that_does_not_fit():
+    # The long middle message does not fit, so the short oldest one is dropped too
+    messages = make_messages("a" * 4, "b" * 400, "c" * 4)
+    kept, overflow = fit_history(messages, budget=20)
+    assert [msg["id"] for msg in kept] == [3]
+    assert [msg["id"] for msg in overflow] == [1, 2]
+
+
+def test_fit_history_with_nothing_fitting():
+    messages = make_messages("a" * 400)
+    kept, overflow = fit_history(messages, budget=10)
+    assert kept == []
+    assert overflow == messages
+    assert fit_history([], budget=10) == ([], [])
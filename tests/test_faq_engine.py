@@ -0,0 +1,95 @@
+from pathlib import Path
+
+import pytest
+
+from faq_engine import FAQ_MATCH_THRESHOLD, FAQ_SHARED_THRESHOLD, FAQEngine, parse_qa_pairs, tokenize
+from llm_cache import SCOPE_CONTEXTUAL, SCOPE_FAQ, classify_scope, normalize_message
+
+REFERENCE_PATH = Path(__file__).resolve().parent.parent / "qa_reference.txt"
+
+
+@pytest.fixture(scope="module")
+def engine():
+    return FAQEngine(REFERENCE_PATH.read_text(encoding="utf-8"))
+
+
+def test_tokenize_drops_stopwords_and_plural_s():
+    assert tokenize("What types of Rooms do you offer?") == ["type", "room", "offer"]
+    assert tokenize("¿Tienen piscina?") == ["piscina"]
+
+
+def test_parse_qa_pairs_reads_both_languages():
+    pairs = parse_qa_pairs(
+        "Intro text\n"
+        "Q (English): Do you have a pool?\n"
+        "Q (Spanish): ¿Tienen piscina?\n"
+        "A (English): Yes.\n"
+        "A (Spanish): Sí.\n"
+        "Q (English): Unanswered question?\n"
+    )
+    assert len(pairs) == 1
+    assert pairs[0].question_es == "¿Tienen piscina?"
+    assert pairs[0].answer_es == "Sí."
+
+
+def test_exact_question_is_answered_locally(engine):
+    answer, confidence = engine.answer("Do you have a pool?", "en")
+    assert confidence == 1.0
+    assert answer == engine.match("Do you have a pool?").pair.answer_en
+
+
+def test_spanish_question_gets_spanish_answer(engine):
+    answer, confidence = engine.answer("¿Tienen piscina?", "es")
+    assert confidence >= FAQ_MATCH_THRESHOLD
+    assert answer == engine.match("¿Tienen piscina?").pair.answer_es
+
+
+def test_uncovered_words_lower_confidence(engine):
+    # "table" is not in the pool question, so the pool answer is not reused
+    match = engine.match("do you have a pool table?")
+    assert match.pair.question_en == "Do you have a pool?"
+    assert match.confidence < FAQ_SHARED_THRESHOLD
+    assert engine.answer("do you have a pool table?", "en")[0] is None
+
+
+def test_room_rates_has_no_local_answer(engine):
+    # No Q&A pair covers prices; the closest is "How can I book a room?" on the
+    # word "room" alone. Falling below both thresholds is intended: the model
+    # answers with the conversation history rather than a booking FAQ reply.
+    match = engine.match("what are your room rates")
+    assert match.pair.question_en == "How can I book a room?"
+    assert match.confidence == pytest.approx(0.114)
+    assert match.confidence < FAQ_SHARED_THRESHOLD
+
+
+def test_follow_ups_do_not_match(engine):
+    assert engine.match("yes please") is None
+    assert engine.answer("hola", "es") == (None, 0.0)
+
+
+def test_thresholds_are_configurable():
+    reference = (
+        "Q (English): What time is check-in and check-out?\n"
+        "Q (Spanish): ¿A qué hora es el check-in y el check-out?\n"
+        "A (English): Check-in is at 3 PM.\n"
+        "A (Spanish): El check-in es a las 3 PM.\n"
+    )
+    partial = "What time is check-in?"
+    confidence = FAQEngine(reference).match(partial).confidence
+    assert 0 < confidence < 1
+    assert FAQEngine(reference, threshold=confidence).answer(partial, "en")[0] == "Check-in is at 3 PM."
+    assert FAQEngine(reference, threshold=confidence + 0.01).answer(partial, "en") == (None, confidence)
+
+
+@pytest.mark.parametrize("message, scope", [
+    ("What time is check-in?", SCOPE_FAQ),
+    ("¿Tienen piscina?", SCOPE_FAQ),
+    ("yes please", SCOPE_CONTEXTUAL),
+    ("is that one available?", SCOPE_CONTEXTUAL),
+    ("sí, esa", SCOPE_CONTEXTUAL),
+    ("we are 2 adults", SCOPE_CONTEXTUAL),
+    ("do you have a pool " * 10, SCOPE_CONTEXTUAL),
+    ("", SCOPE_CONTEXTUAL),
+])
+def test_classify_scope(message, scope):
+    assert classify_scope(normalize_message(message)) == scope
@@ -0,0 +1,80 @@
+import time
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")
+
+from message_coalescer import COALESCE_TTL, MessageCoalescer
+
+
+@pytest.fixture
+def redis_client():
+    return fakeredis.FakeRedis(decode_responses=True)
+
+
+def test_add_returns_window_and_take_waits_for_it(redis_client):
+    coalescer = MessageCoalescer(redis_client, window=0.2, max_wait=1.0)
+    assert coalescer.add("chat", "hi", "t1") == pytest.approx(0.2, abs=0.01)
+    messages, retry_in = coalescer.take("chat")
+    assert messages is None
+    assert 0 < retry_in <= 0.2
+    assert 0 < redis_client.ttl("coalesce:chat") <= COALESCE_TTL
+
+
+def test_take_returns_all_pending_messages_once_after_deadline(redis_client):
+    coalescer = MessageCoalescer(redis_client, window=0.05, max_wait=1.0)
+    coalescer.add("chat", "hi", "t1")
+    coalescer.add("chat", "I need a room", "t2")
+    time.sleep(0.06)
+    messages, retry_in = coalescer.take("chat")
+    assert [entry["message"] for entry in messages] == ["hi", "I need a room"]
+    assert retry_in is None
+    # The turn is consumed: a second flush has nothing to do
+    assert coalescer.take("chat") == (None, None)
+    assert not redis_client.exists("coalesce:chat", "coalesce_turn:chat")
+
+
+def test_new_messages_push_deadline_back_up_to_max_wait(redis_client):
+    coalescer = MessageCoalescer(redis_client, window=0.1, max_wait=0.15)
+    coalescer.add("chat", "one", "t1")
+    time.sleep(0.08)
+    # The window would end 0.1s from now, but the turn closes 0.15s after its first message
+    delay = coalescer.add("chat", "two", "t2")
+    assert 0 <= delay <= 0.07
+
+
+def test_chats_are_independent(redis_client):
+    coalescer = MessageCoalescer(redis_client, window=0.05, max_wait=1.0)
+    coalescer.add("a", "for a", "t1")
+    time.sleep(0.06)
+    coalescer.add("b", "for b", "t2")
+    assert [entry["message"] for entry in coalescer.take("a")[0]] == ["for a"]
+    assert coalescer.take("b")[0] is None
+
+
+def test_restore_puts_messages_ahead_of_newer_ones(redis_client):
+    coalescer = MessageCoalescer(redis_client, window=0.05, max_wait=1.0)
+    coalescer.add("chat", "one", "t1")
+    coalescer.add("chat", "two", "t2")
+    time.sleep(0.06)
+    taken, _ = coalescer.take("chat")
+    coalescer.add("chat", "three", "t3")
+    coalescer.restore("chat", taken)
+    time.sleep(0.06)
+    messages, _ = coalescer.take("chat")
+    assert [(entry["message"], entry["timestamp"]) for entry in messages] == [("one", "t1"), ("two", "t2"), ("three", "t3")]
+
+
+def test_restored_turn_can_be_flushed_at_once(redis_client):
+    coalescer = MessageCoalescer(redis_client, window=0.05, max_wait=1.0)
+    coalescer.add("chat", "one", "t1")
+    time.sleep(0.06)
+    taken, _ = coalescer.take("chat")
+    coalescer.restore("chat", taken)
+    # Restoring starts a new turn without a deadline, so the retry flushes immediately
+    assert redis_client.hexists("coalesce_turn:chat", "first")
+    messages, _ = coalescer.take("chat")
+    assert [entry["message"] for entry in messages] == ["one"]
+    coalescer.restore("chat", [])
+    assert not redis_client.exists("coalesce:chat")